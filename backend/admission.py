@@ -0,0 +1,261 @@
+"""
+Admission control for warehouse queries
+Caps concurrent queries globally and per client, and queues the overflow in
+a bounded queue served round-robin across clients, so one heavy user cannot
+take every warehouse slot
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import metrics
+
+
+class AdmissionRejected(Exception):
+    """
+    Base for requests turned away by admission control
+
+    Attributes:
+        status_code (int): HTTP status to answer with
+        retry_after (int): Seconds the client should wait before retrying
+    """
+    status_code = 503
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ClientLimitExceeded(AdmissionRejected):
+    """Raised when a client already has its maximum number of queries queued"""
+    status_code = 429
+
+
+class AdmissionQueueFull(AdmissionRejected):
+    """Raised when the shared queue is full"""
+
+
+class QueueTimeout(AdmissionRejected):
+    """Raised when a queued query waited longer than max_wait"""
+
+
+class _Waiter:
+    __slots__ = ('client', 'granted', 'event', 'queued_at')
+
+    def __init__(self, client, queued_at):
+        self.client = client
+        self.granted = False
+        self.event = threading.Event()
+        self.queued_at = queued_at
+
+
+class Ticket:
+    """
+    An admitted query's slot; release() frees it (only the first call counts)
+
+    Attributes:
+        client: Client the slot belongs to
+        waited (float): Seconds spent queued
+    """
+
+    def __init__(self, controller, client, waited):
+        self.client = client
+        self.waited = waited
+        self._controller = controller
+        self._started = controller._clock()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._controller._release(self.client, self._controller._clock() - self._started)
+
+
+class AdmissionController:
+    """
+    Global and per-client concurrency limits with a fair queue
+
+    A query runs at once if a global slot is free and its client has fewer
+    than max_per_client queries running. Otherwise it waits in its client's
+    queue. Freed slots go to waiting clients in round-robin order, so a
+    client with twenty queued queries gets one slot per turn, like everyone
+    else.
+
+    Requests are rejected rather than queued when the client already has
+    max_client_queued waiting (429) or the queue holds max_queued in total
+    (503). Queued requests give up after max_wait seconds (503). Every
+    rejection carries a Retry-After estimate based on recent query times.
+
+    Args:
+        max_concurrent (int): Queries running at once across all clients
+        max_per_client (int): Queries one client may run at once
+        max_queued (int): Waiting queries across all clients
+        max_client_queued (int): Waiting queries per client
+        max_wait (float): Seconds a query may wait for a slot
+        clock (callable): Monotonic time source
+    """
+
+    def __init__(self, max_concurrent=8, max_per_client=4, max_queued=64, max_client_queued=8,
+                 max_wait=30, clock=time.monotonic):
+        if max_concurrent < 1 or max_per_client < 1:
+            raise ValueError("max_concurrent and max_per_client must be at least 1")
+        self.max_concurrent = max_concurrent
+        self.max_per_client = max_per_client
+        self.max_queued = max_queued
+        self.max_client_queued = max_client_queued
+        self.max_wait = max_wait
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._running = {}
+        self._total_running = 0
+        # client -> deque of waiters; iteration order is the round-robin turn
+        self._waiting = OrderedDict()
+        self._queued = 0
+        # Recent queue waits and an average of how long slots are held
+        self._waits = deque(maxlen=1024)
+        self._hold_seconds = 1.0
+        self._stats = {'admitted': 0, 'queued_total': 0, 'rejected_client': 0, 'rejected_full': 0,
+                       'timed_out': 0}
+
+    def _retry_after(self):
+        """Seconds until the queue ahead is likely to have drained"""
+        rounds = (self._queued + self._total_running) / self.max_concurrent
+        return max(1, min(60, math.ceil(rounds * self._hold_seconds)))
+
+    def _dispatch(self):
+        """Hand free slots to waiting clients, one per client per turn"""
+        while self._total_running < self.max_concurrent and self._waiting:
+            for client, waiters in self._waiting.items():
+                if self._running.get(client, 0) < self.max_per_client:
+                    break
+            else:
+                return
+            waiter = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            self._queued -= 1
+            self._grant(client)
+            waiter.granted = True
+            waiter.event.set()
+
+    def _grant(self, client):
+        self._running[client] = self._running.get(client, 0) + 1
+        self._total_running += 1
+        self._stats['admitted'] += 1
+
+    def acquire(self, client):
+        """
+        Wait for a slot for client
+
+        Returns:
+            Ticket: Release it once the query is done
+
+        Raises:
+            ClientLimitExceeded: Client already has max_client_queued waiting
+            AdmissionQueueFull: max_queued queries are already waiting
+            QueueTimeout: No slot became free within max_wait
+        """
+        with self._lock:
+            if (not self._waiting and self._total_running < self.max_concurrent
+                    and self._running.get(client, 0) < self.max_per_client):
+                self._grant(client)
+                self._waits.append(0.0)
+                return self._admitted(client, 0.0)
+            if len(self._waiting.get(client, ())) >= self.max_client_queued:
+                self._stats['rejected_client'] += 1
+                raise ClientLimitExceeded(
+                    f"Too many queued queries for this client ({self.max_client_queued}); try again shortly",
+                    retry_after=self._retry_after())
+            if self._queued >= self.max_queued:
+                self._stats['rejected_full'] += 1
+                raise AdmissionQueueFull(
+                    f"{self._queued} queries are already waiting for the warehouse; try again shortly",
+                    retry_after=self._retry_after())
+            waiter = _Waiter(client, self._clock())
+            self._waiting.setdefault(client, deque()).append(waiter)
+            self._queued += 1
+            self._stats['queued_total'] += 1
+            self._dispatch()
+
+        waiter.event.wait(self.max_wait)
+        with self._lock:
+            waited = self._clock() - waiter.queued_at
+            if not waiter.granted:
+                waiters = self._waiting.get(client)
+                if waiters is not None and waiter in waiters:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self._waiting[client]
+                    self._queued -= 1
+                self._stats['timed_out'] += 1
+                raise QueueTimeout(f"Waited {waited:.1f}s for a warehouse slot; try again shortly",
+                                   retry_after=self._retry_after())
+            self._waits.append(waited)
+        return self._admitted(client, waited)
+
+    def _admitted(self, client, waited):
+        metrics.record('admission', waited)
+        return Ticket(self, client, waited)
+
+    def _release(self, client, held_seconds):
+        """Free client's slot, note how long it was held and admit the next waiter"""
+        with self._lock:
+            running = self._running.get(client, 0) - 1
+            if running > 0:
+                self._running[client] = running
+            else:
+                self._running.pop(client, None)
+            self._total_running -= 1
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held_seconds
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, client):
+        """
+        Hold a slot for the duration of a with block
+
+        Yields:
+            Ticket
+        """
+        ticket = self.acquire(client)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self):
+        """
+        Admission counters
+
+        Returns:
+            dict: running and queued queries, clients involved, rejection
+            counters and recent queue wait percentiles in seconds
+        """
+        with self._lock:
+            waits = sorted(self._waits)
+            deepest = max(self._waiting.items(), key=lambda item: len(item[1]), default=(None, ()))
+            return {
+                'running': self._total_running,
+                'queued': self._queued,
+                'clients_running': len(self._running),
+                'clients_waiting': len(self._waiting),
+                'deepest_client_queue': len(deepest[1]),
+                'max_concurrent': self.max_concurrent,
+                'max_per_client': self.max_per_client,
+                'max_queued': self.max_queued,
+                'max_client_queued': self.max_client_queued,
+                'max_wait': self.max_wait,
+                'wait_p50': waits[len(waits) // 2] if waits else 0.0,
+                'wait_p95': waits[int(len(waits) * 0.95)] if waits else 0.0,
+                'wait_max': waits[-1] if waits else 0.0,
+                'hold_seconds_avg': round(self._hold_seconds, 3),
+                **self._stats,
+            }
@@ -3,28 +3,167 @@ Flask API server for Databricks SQL queries
 Provides REST endpoints for the frontend to execute queries
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
+import io
 import os
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from db import execute_query, get_table_schema, test_connection
+from db import (
+    stream_query, test_connection,
+    get_table_columns, get_table_schemas, invalidate_table_schema,
+    fetch_arrow_cached, arrow_to_records, arrow_to_columnar,
+    get_cache_stats, clear_result_cache, get_singleflight_stats,
+    get_pool_stats, get_token_stats, warm_pool, close_pool, POOL_MAX_SIZE, POOL_SCHEMA_HEADROOM,
+    recommended_pool_size,
+    get_cached_result, is_result_cached, open_result, STREAM_BATCH_SIZE,
+    fetch_series, get_series_cache_stats, get_slow_queries, get_slow_query_stats,
+)
+from singleflight import TooManyWaiters, WaitTimeout
+from admission import AdmissionController, AdmissionRejected
+from jobs import JobStore, JobQueueFull, QueryTimeout, SUCCEEDED, FAILED, CANCELLED, TIMED_OUT
+from disconnect import DisconnectWatcher, is_disconnected, request_socket
+from pagination import PagedResultStore, PageTokenExpired
+from charts import parse_chart_spec, build_series_query, resolve_window, is_bucket_aligned, cap_window
+from pop import parse_compare, period_over_period
+from compression import compress_response, get_compression_stats
+from downsample import downsample, parse_max_points, parse_method
+from json_provider import FastJSONProvider
+from topn import parse_topn_spec, build_topn_query, build_approx_topn_query, shape_topn
+from batch import parse_batch, run_batch
+import metrics
+import slowlog
+from werkzeug.test import EnvironBuilder
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+# orjson-backed jsonify() with handlers for Decimal/date/numpy/pandas values
+app.json = FastJSONProvider(app)
+
+# Query jobs - /api/query waits on the same executor as /api/jobs
+JOB_MAX_WORKERS = int(os.getenv('JOB_MAX_WORKERS', '8'))
+JOB_MAX_QUEUED = int(os.getenv('JOB_MAX_QUEUED', '64'))
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '600'))
+JOB_PAGE_MAX_ROWS = int(os.getenv('JOB_PAGE_MAX_ROWS', '10000'))
+SYNC_QUERY_TIMEOUT = float(os.getenv('SYNC_QUERY_TIMEOUT', '300'))
+# Seconds a warehouse query may run before it is cancelled (0 for no limit);
+# requests may ask for less or more with "timeout", up to QUERY_TIMEOUT_MAX
+QUERY_TIMEOUT = float(os.getenv('QUERY_TIMEOUT', '600'))
+QUERY_TIMEOUT_MAX = float(os.getenv('QUERY_TIMEOUT_MAX', '3600'))
+# Longest "cache_ttl" a request may ask for; larger values are capped
+CACHE_TTL_MAX = float(os.getenv('CACHE_TTL_MAX', '3600'))
+# How often a waiting request checks whether its client has gone away
+DISCONNECT_POLL_INTERVAL = float(os.getenv('DISCONNECT_POLL_INTERVAL', '0.5'))
+# Seconds shutdown() waits for in-flight jobs before cancelling them
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '30'))
+
+job_store = JobStore(
+    max_workers=JOB_MAX_WORKERS,
+    max_queued=JOB_MAX_QUEUED,
+    result_ttl=JOB_RESULT_TTL,
+    query_timeout=QUERY_TIMEOUT or None
+)
+
+# Streamed queries stopped early, by kind (buffered ones are in job_store.stats())
+_stream_cancellations = {'timed_out': 0, 'disconnected': 0}
+_stream_cancellations_lock = threading.Lock()
+
+# Admission control for warehouse queries (/api/query, /api/jobs, /api/chart, /api/topn)
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', str(JOB_MAX_WORKERS)))
+ADMISSION_MAX_PER_CLIENT = int(os.getenv('ADMISSION_MAX_PER_CLIENT', '4'))
+ADMISSION_MAX_QUEUED = int(os.getenv('ADMISSION_MAX_QUEUED', '64'))
+ADMISSION_MAX_CLIENT_QUEUED = int(os.getenv('ADMISSION_MAX_CLIENT_QUEUED', '8'))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '30'))
+# Request headers identifying the client, first match wins (else the peer address)
+CLIENT_ID_HEADERS = ('X-Forwarded-Email', 'X-Forwarded-User', 'X-Client-Id')
+
+admission = AdmissionController(
+    max_concurrent=ADMISSION_MAX_CONCURRENT,
+    max_per_client=ADMISSION_MAX_PER_CLIENT,
+    max_queued=ADMISSION_MAX_QUEUED,
+    max_client_queued=ADMISSION_MAX_CLIENT_QUEUED,
+    max_wait=ADMISSION_MAX_WAIT
+)
+
+# Paged /api/query results - kept between requests, read from an open cursor
+PAGE_DEFAULT_ROWS = int(os.getenv('PAGE_DEFAULT_ROWS', '500'))
+PAGED_RESULTS_MAX_BYTES = int(os.getenv('PAGED_RESULTS_MAX_BYTES', str(256 * 1024 * 1024)))
+PAGED_RESULTS_IDLE_TIMEOUT = float(os.getenv('PAGED_RESULTS_IDLE_TIMEOUT', '300'))
+PAGED_RESULTS_MAX_OPEN = int(os.getenv('PAGED_RESULTS_MAX_OPEN', '4'))
+
+paged_results = PagedResultStore(
+    open_result,
+    max_bytes=PAGED_RESULTS_MAX_BYTES,
+    idle_timeout=PAGED_RESULTS_IDLE_TIMEOUT,
+    max_open=PAGED_RESULTS_MAX_OPEN,
+    fetch_size=STREAM_BATCH_SIZE
+)
+
+# Aggregated chart series (/api/chart)
+CHART_MAX_BUCKETS = int(os.getenv('CHART_MAX_BUCKETS', '10000'))
+
+# Streaming (NDJSON) responses for /api/query
+NDJSON_MIMETYPE = 'application/x-ndjson'
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
+STREAM_MAX_ROWS = int(os.getenv('STREAM_MAX_ROWS', '1000000'))
+STREAM_MAX_BYTES = int(os.getenv('STREAM_MAX_BYTES', str(256 * 1024 * 1024)))
 
 # Enable CORS for Lovable dev environment and Databricks Apps
 # Allows calls from Lovable.app, localhost, and deployed frontend
 CORS(app, resources={
     r"/api/*": {
         "origins": "*",  # Allow all origins for development
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
+        "methods": ["GET", "POST", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "Cache-Control", "X-Cache-Bypass", "X-Client-Id"],
+        "expose_headers": ["X-Cache", "Retry-After", "Server-Timing"]
     }
 })
 
 
+@app.before_request
+def start_timing():
+    """Collect this request's phase timings and tag its queries with the endpoint"""
+    g.timings, g.timings_token = metrics.start_request()
+    g.endpoint_token = slowlog.set_endpoint(request.endpoint)
+
+
+# Registered before compress_responses so it runs after it and sees its phase
+@app.after_request
+def add_server_timing(response):
+    """Record request latency and summarise the phases in Server-Timing"""
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    total = time.perf_counter() - timings.started
+    metrics.record_request(request.endpoint, total)
+    if not response.is_streamed:
+        metrics.record_result('response', nbytes=response.content_length)
+    response.headers['Server-Timing'] = timings.header(total)
+    response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+
+@app.teardown_request
+def end_timing(error=None):
+    token = g.pop('timings_token', None)
+    if token is not None:
+        metrics.end_request(token)
+    token = g.pop('endpoint_token', None)
+    if token is not None:
+        slowlog.reset_endpoint(token)
+
+
+@app.after_request
+def compress_responses(response):
+    """Compress responses per Accept-Encoding (see compression.py)"""
+    return compress_response(response, request.headers.get('Accept-Encoding', ''))
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -57,6 +196,138 @@ def test_db_connection():
         }), 500
 
 
+@app.route('/api/pool', methods=['GET'])
+def pool_stats():
+    """
+    Connection pool statistics, for sizing DB_POOL_MIN_SIZE / DB_POOL_MAX_SIZE
+
+    Response:
+    {
+        "status": "success",
+        "pool": {"size": 2, "idle": 1, "in_use": 1, "opened": 2, "reused": 40, ...},
+        "auth": {"fetches": 1, "hits": 42, "failures": 0, "expires_in": 2950.0},
+        "compression": {"compressed": 12, "bytes_in": 5242880, "bytes_out": 412000, ...}
+    }
+    """
+    return jsonify({
+        'status': 'success',
+        'pool': get_pool_stats(),
+        'auth': get_token_stats(),
+        'compression': get_compression_stats()
+    })
+
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Metrics in the Prometheus text format
+    
+    Histograms (query_api_*):
+        phase_seconds{phase}: auth, connect, acquire, admission, job_queue,
+            execute, fetch, convert, serialize, compress
+        request_seconds{endpoint}: whole request, up to the first body byte
+        result_rows{stage}, result_bytes{stage}: fetch and response sizes
+    plus the numeric counters of /api/pool, /api/cache, /api/jobs and
+    /api/admission as query_api_<group>_<name>.
+    
+    Each response also carries a Server-Timing header with its own phases,
+    e.g. "acquire;dur=0.1, execute;dur=812.4, fetch;dur=35.0, total;dur=860.2".
+    """
+    with _stream_cancellations_lock:
+        streams = dict(_stream_cancellations)
+    groups = [
+        ('pool', get_pool_stats()),
+        ('auth', get_token_stats()),
+        ('cache', get_cache_stats()),
+        ('singleflight', get_singleflight_stats()),
+        ('paged_results', paged_results.stats()),
+        ('series_cache', get_series_cache_stats()),
+        ('jobs', job_store.stats()),
+        ('streams', streams),
+        ('admission', admission.stats()),
+        ('compression', get_compression_stats()),
+        ('slow_queries', get_slow_query_stats()),
+    ]
+    lines = []
+    for group, stats in groups:
+        lines.extend(metrics.stats_lines(group, stats))
+    return Response(metrics.render(lines), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/debug/slow-queries', methods=['GET'])
+def slow_queries():
+    """
+    The most expensive query shapes from the slow-query log
+    
+    Queries taking at least SLOW_QUERY_THRESHOLD_MS are logged with their
+    SQL fingerprint (literals replaced by ?), warehouse query id, duration,
+    rows, bytes and endpoint. Use this to find chart queries worth
+    pre-aggregating or caching longer.
+    
+    Query params:
+        limit: Fingerprints to return (default 20, max 500)
+        order: "total" (default, time summed over runs), "p95", "count" or "max"
+        since: Only queries from the last this many seconds
+    
+    Response:
+    {
+        "status": "success",
+        "order": "total",
+        "fingerprints": [{"fingerprint": "3f2a...", "sql": "SELECT ... WHERE pickup_zip = ?",
+                          "count": 40, "total_ms": 61234.0, "avg_ms": 1530.9,
+                          "p95_ms": 4210.0, "max_ms": 5002.3, "avg_rows": 31.0,
+                          "avg_bytes": 2048, "errors": 0, "endpoints": {"chart": 40},
+                          "last_query_id": "01ef...", "sample_sql": "...", "last_seen": ...}],
+        "log": {"recorded": 40, "dropped": 0, "threshold_ms": 250.0, ...}
+    }
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 500)
+        since = request.args.get('since')
+        since = float(since) if since else None
+        order = request.args.get('order', 'total')
+        fingerprints = get_slow_queries(limit=limit, order=order, since=since)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    return jsonify({
+        'status': 'success',
+        'order': order,
+        'fingerprints': fingerprints,
+        'log': get_slow_query_stats()
+    })
+
+
+@app.route('/api/admission', methods=['GET'])
+def admission_stats():
+    """
+    Admission control statistics for the query endpoints (/api/query,
+    /api/jobs, /api/chart and /api/topn)
+
+    Response:
+    {
+        "status": "success",
+        "admission": {"running": 8, "queued": 3, "clients_waiting": 2, "wait_p50": 0.4,
+                      "wait_p95": 2.1, "rejected_client": 5, "timed_out": 0, ...}
+    }
+    """
+    return jsonify({
+        'status': 'success',
+        'admission': admission.stats()
+    })
+
+
+def _client_id():
+    """Who a request is from, for per-client admission limits"""
+    for header in CLIENT_ID_HEADERS:
+        value = request.headers.get(header)
+        if value:
+            return value
+    return request.remote_addr or 'unknown'
+
+
 @app.route('/api/query', methods=['POST'])
 def run_query():
     """
@@ -64,9 +335,25 @@ def run_query():
     
     Request body:
     {
-        "query": "SELECT * FROM table LIMIT 10"
+        "query": "SELECT * FROM table LIMIT 10",
+        "stream": false,     // optional, or send Accept: application/x-ndjson
+        "max_rows": 10000,   // optional, streaming only (capped by STREAM_MAX_ROWS)
+        "format": "records", // optional, "columnar" (also accepted as ?format=)
+        "cache": true,       // optional, false (or X-Cache-Bypass: 1) re-runs the query
+        "cache_ttl": 300,    // optional, seconds to cache this result (capped by CACHE_TTL_MAX)
+        "page_size": 500,    // optional, return one page and a page_token
+        "page_token": "...", // optional, next page of an earlier paged query
+        "max_points": 1000,  // optional, down-sample buffered JSON results
+        "downsample": "lttb",  // optional, or "minmax"
+        "x_column": "time",  // optional, x for down-sampling (first time column)
+        "timeout": 60        // optional, seconds before the query is cancelled
     }
     
+    Buffered responses carry an X-Cache header: HIT, MISS, BYPASS or SHARED
+    (joined an identical query that was already running). Only read-only
+    statements (SELECT, WITH, SHOW, DESCRIBE) are cached or shared; anything
+    else runs every time and answers BYPASS.
+    
     Response:
     {
         "status": "success",
@@ -74,58 +361,812 @@ def run_query():
         "row_count": 10,
         "columns": [...]
     }
+    
+    Columnar response (format=columnar) - column names are sent once and
+    decimals/dates/timestamps become numbers/ISO strings:
+    {
+        "status": "success",
+        "columns": ["id", "name"],
+        "types": ["int", "string"],
+        "data": [[1, 2], ["a", "b"]],   // one list per column
+        "row_count": 2
+    }
+    
+    Paged response (page_size or page_token given) - later pages are read
+    from the cached or still-open result set, not by re-running the query;
+    "query" is not needed with a page_token:
+    {
+        "status": "success",
+        "data": [...],
+        "columns": [...],
+        "row_count": 500,
+        "page_token": "...",    // null on the last page
+        "total_rows": null      // known once the last row has been read
+    }
+    An expired page token returns 410; re-run the query to start over. An
+    open cursor is closed once unread for PAGED_RESULTS_IDLE_TIMEOUT, and
+    "timeout" bounds the query's execute.
+    
+    With max_points, results longer than that are reduced on the server
+    (see downsample.py) and the response carries a "downsampling" object:
+    {"method", "max_points", "original_rows", "rows", "x_column", "series",
+    "applied"}. Only buffered JSON responses can be down-sampled.
+    
+    Send Accept: application/vnd.apache.arrow.stream to receive Arrow IPC
+    record batches instead of JSON.
+    
+    Streaming response (application/x-ndjson), one JSON value per line:
+        {"type": "meta", "columns": [...]}
+        [value, value, ...]          // one array per row
+        {"type": "end", "status": "success", "row_count": 10, "columns": [...],
+         "truncated": false, "truncated_reason": null}
+    
+    Queries that reach the warehouse go through admission control (see
+    admission.py and GET /api/admission): at most ADMISSION_MAX_CONCURRENT run
+    at once and ADMISSION_MAX_PER_CLIENT per client, identified by
+    X-Forwarded-Email, X-Forwarded-User or X-Client-Id. The rest wait in a
+    queue served round-robin across clients. A client with too many queued
+    queries gets 429; a full queue or a wait past ADMISSION_MAX_WAIT gets 503.
+    Both carry Retry-After. Cache hits and later pages skip admission.
+    
+    Queries running longer than "timeout" (default QUERY_TIMEOUT) are
+    cancelled in the warehouse and answer 504. So are queries whose client
+    disconnects while waiting for them, unless other requests share the
+    same in-flight query.
     """
     try:
         data = request.get_json()
         query = data.get('query')
+        max_points = parse_max_points(data.get('max_points'))
+        method = parse_method(data.get('downsample'))
         
+        paged = data.get('page_token') or data.get('page_size')
+        if max_points is not None and (paged or _wants_arrow() or _wants_stream(data)):
+            raise ValueError("max_points is only supported for buffered JSON responses")
+        if paged:
+            return _paged_response(query, data)
         if not query:
             return jsonify({
                 'status': 'error',
                 'message': 'Query parameter is required'
             }), 400
         
-        # Execute query and get results as dict
-        results = execute_query(query, return_dict=True)
+        if _wants_arrow() or _wants_stream(data):
+            ticket = admission.acquire(_client_id())
+            try:
+                if _wants_arrow():
+                    response = _arrow_stream_response(query, data)
+                else:
+                    response = _stream_response(query, data)
+            except BaseException:
+                ticket.release()
+                raise
+            # Hold the slot until the stream ends or the client goes away
+            response.call_on_close(ticket.release)
+            return response
+        
+        # Run as a job and wait for it - same path as POST /api/jobs
+        job = _submit_query_job(query, data)
+        timed_out = _await_job(job)
+        if timed_out is not None:
+            return timed_out
         
-        # Get column names from first result if available
-        columns = list(results[0].keys()) if results else []
+        table, downsampling = job.result, None
+        if max_points is not None:
+            table, downsampling = downsample(table, max_points, method, data.get('x_column'))
+        if (data.get('format') or request.args.get('format')) == 'columnar':
+            body = {'status': 'success', **arrow_to_columnar(table)}
+        else:
+            results = arrow_to_records(table)
+            body = {
+                'status': 'success',
+                'data': results,
+                'row_count': len(results),
+                'columns': table.column_names
+            }
+        if downsampling is not None:
+            body['downsampling'] = downsampling
+        response = jsonify(body)
+        response.headers['X-Cache'] = job.cache_status
+        return response
         
+    except Exception as e:
+        return _query_error_response(e)
+
+
+def _query_error_response(e):
+    """
+    JSON error response for an exception raised while running a query
+    
+    Bad input is 400. Admission and queue limits ask the client to retry
+    (AdmissionRejected's 429/503, or 503 for a full job queue or too many
+    waiters on one query), with Retry-After. Timeouts are 504 and anything
+    else is 500.
+    
+    Returns:
+        tuple: (response, status_code)
+    """
+    retry_after = None
+    if isinstance(e, ValueError):
+        status_code = 400
+    elif isinstance(e, AdmissionRejected):
+        status_code, retry_after = e.status_code, e.retry_after
+    elif isinstance(e, (TooManyWaiters, JobQueueFull)):
+        status_code, retry_after = 503, 1
+    elif isinstance(e, (WaitTimeout, QueryTimeout)):
+        status_code = 504
+    else:
+        status_code = 500
+    response = jsonify({
+        'status': 'error',
+        'message': str(e)
+    })
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response, status_code
+
+
+def _paged_response(query, data):
+    """One page of a query result plus the token for the next one"""
+    try:
+        page_size = min(max(int(data.get('page_size') or PAGE_DEFAULT_ROWS), 1), JOB_PAGE_MAX_ROWS)
+    except (TypeError, ValueError):
         return jsonify({
-            'status': 'success',
-            'data': results,
-            'row_count': len(results),
-            'columns': columns
+            'status': 'error',
+            'message': 'page_size must be an integer'
+        }), 400
+    
+    token = data.get('page_token')
+    if token:
+        try:
+            page, next_token, total = paged_results.next(token, page_size)
+        except PageTokenExpired as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 410
+        cache_status = None
+    else:
+        if not query:
+            return jsonify({
+                'status': 'error',
+                'message': 'Query parameter is required'
+            }), 400
+        cached = None if _cache_bypassed(data) else get_cached_result(query)
+        if cached is not None:
+            page, next_token, total = paged_results.start(query, page_size, cached_table=cached)
+        else:
+            # Later pages read from the open cursor without a new query
+            with admission.slot(_client_id()):
+                page, next_token, total = _start_paging(query, page_size, data)
+        cache_status = 'HIT' if cached is not None else 'MISS'
+    
+    body = {'status': 'success', 'page_token': next_token, 'total_rows': total}
+    if (data.get('format') or request.args.get('format')) == 'columnar':
+        body.update(arrow_to_columnar(page))
+    else:
+        body.update({
+            'data': arrow_to_records(page),
+            'columns': page.column_names,
+            'row_count': page.num_rows
         })
+    response = jsonify(body)
+    if cache_status is not None:
+        response.headers['X-Cache'] = cache_status
+    return response
+
+
+def _start_paging(query, page_size, data):
+    """
+    Open a paged query's cursor and read its first page
+    
+    The execute is bounded by the request's timeout and cancelled if the
+    client disconnects meanwhile, as for streams (see _start_stream). Once
+    open, the cursor is closed when the result set goes idle.
+    """
+    cursors = []
+    
+    def cancel():
+        for cursor in cursors:
+            cursor.cancel()
+    
+    def on_cursor(cursor):
+        cursors.append(cursor)
+        return not watcher.check()
+    
+    watcher = DisconnectWatcher(request_socket(request.environ), cancel, DISCONNECT_POLL_INTERVAL)
+    with watcher:
+        return paged_results.start(query, page_size, timeout=_query_timeout(data), on_cursor=on_cursor)
+
+
+def _await_job(job):
+    """
+    Wait for a synchronous request's job
+    
+    If the client disconnects meanwhile, the job is cancelled so the
+    warehouse stops working on a result nobody will read.
+    
+    Returns:
+        None once the job succeeded, a 504 response carrying the job id if
+        it is still running, or a 499 response if the client went away
+    
+    Raises:
+        Exception: The job's error if it failed (QueryTimeout if it ran
+        past its timeout)
+    """
+    sock = request_socket(request.environ)
+    deadline = time.monotonic() + SYNC_QUERY_TIMEOUT
+    while not job.wait(min(DISCONNECT_POLL_INTERVAL, max(deadline - time.monotonic(), 0))):
+        if is_disconnected(sock):
+            job_store.cancel(job.id, disconnected=True)
+            job_store.discard(job.id)
+            return jsonify({
+                'status': 'error',
+                'message': 'Client disconnected; query cancelled'
+            }), 499
+        if time.monotonic() >= deadline:
+            # Still running: hand the client the job id so it can poll instead
+            response = jsonify({
+                'status': 'error',
+                'message': f'Query did not finish within {SYNC_QUERY_TIMEOUT:.0f}s; poll /api/jobs/{job.id}',
+                'job_id': job.id
+            })
+            return response, 504
+    job_store.discard(job.id)
+    if job.error is not None:
+        raise job.error
+    return None
+
+
+def _query_timeout(data):
+    """
+    Seconds a request's query may run: its "timeout", else QUERY_TIMEOUT
+
+    Returns:
+        float or None: None when there is no limit
+
+    Raises:
+        ValueError: If timeout is not a number in (0, QUERY_TIMEOUT_MAX]
+    """
+    value = data.get('timeout')
+    if value is None:
+        return QUERY_TIMEOUT or None
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("timeout must be a number of seconds")
+    if not 0 < timeout <= QUERY_TIMEOUT_MAX:
+        raise ValueError(f"timeout must be between 0 and {QUERY_TIMEOUT_MAX:g} seconds")
+    return timeout
+
+
+def _submit_admitted(query, work, timeout=None, admit=True):
+    """
+    Queue a job under an admission slot for the requesting client
+    
+    Every endpoint that runs warehouse queries submits through here, so the
+    global and per-client limits apply to all of them. The slot is held
+    until work returns, even if the request stops waiting for it or the job
+    is marked finished first (e.g. timed out while leading a shared query
+    that other requests keep running). A job cancelled before it starts
+    frees the slot when it finishes.
+    
+    Args:
+        query (str): SQL text (or a description) for job status
+        work (callable): As for JobStore.submit()
+        timeout (float): As for JobStore.submit()
+        admit (bool): False to skip admission (e.g. the result is cached)
         
+    Returns:
+        Job
+    
+    Raises:
+        AdmissionRejected: The client or the queue is at its limit
+        JobQueueFull: The job executor is full
+    """
+    if not admit:
+        return job_store.submit(query, work, timeout=timeout)
+    
+    ticket = admission.acquire(_client_id())
+    started = threading.Event()
+    
+    def admitted_work(job):
+        started.set()
+        try:
+            return work(job)
+        finally:
+            ticket.release()
+    
+    def release_if_never_started(job):
+        # If work starts after all, the job is stopped so it runs no query
+        if not started.is_set():
+            ticket.release()
+    
+    try:
+        job = job_store.submit(query, admitted_work, timeout=timeout)
+    except BaseException:
+        ticket.release()
+        raise
+    job.add_done_callback(release_if_never_started)
+    return job
+
+
+def _submit_query_job(query, data):
+    """Queue an admitted query on the job executor, going through the result cache"""
+    bypass = _cache_bypassed(data)
+    ttl = _cache_ttl(data)
+    timeout = _query_timeout(data)
+    
+    def work(job):
+        table, job.cache_status = fetch_arrow_cached(
+            query,
+            bypass=bypass,
+            ttl=ttl,
+            # Stop waiting on a shared query when this job's own timeout passes
+            timeout=job.remaining(),
+            attach_cancel=job.attach_cancel
+        )
+        return table
+    
+    # Cached results don't need a warehouse slot
+    return _submit_admitted(query, work, timeout=timeout, admit=bypass or not is_result_cached(query))
+
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def jobs():
+    """
+    Submit an asynchronous query job (POST) or get job executor stats (GET)
+    
+    Request body:
+    {
+        "query": "SELECT ...",
+        "cache": true,       // optional, as for /api/query
+        "cache_ttl": 300,    // optional
+        "timeout": 600       // optional, seconds before the query is cancelled
+    }
+    
+    Response (202):
+    {
+        "status": "success",
+        "job": {"job_id": "...", "status": "queued", ...}
+    }
+    
+    Jobs go through admission control as for /api/query: 429 or 503 with
+    Retry-After when the client or the queue is at its limit.
+    
+    GET also reports streamed queries stopped early:
+    {"status": "success", "jobs": {...}, "streams": {"timed_out": 0, "disconnected": 2}}
+    """
+    if request.method == 'GET':
+        with _stream_cancellations_lock:
+            streams = dict(_stream_cancellations)
+        return jsonify({'status': 'success', 'jobs': job_store.stats(), 'streams': streams})
+    
+    try:
+        data = request.get_json() or {}
+        query = data.get('query')
+        if not query:
+            return jsonify({
+                'status': 'error',
+                'message': 'Query parameter is required'
+            }), 400
+        
+        job = _submit_query_job(query, data)
+        return jsonify({'status': 'success', 'job': job.to_dict()}), 202
     except Exception as e:
+        return _query_error_response(e)
+
+
+def _job_not_found(job_id):
+    return jsonify({
+        'status': 'error',
+        'message': f'Job {job_id} not found (it may have expired)'
+    }), 404
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """
+    Poll a job's status (GET) or cancel it (DELETE)
+    
+    Cancelling a running job cancels its warehouse cursor, unless other
+    requests are waiting on the same query.
+    
+    Response:
+    {
+        "status": "success",
+        "job": {"job_id": "...", "status": "running", "queue_seconds": 0.01,
+                "run_seconds": 4.2, ...}
+    }
+    """
+    if request.method == 'DELETE':
+        job = job_store.cancel(job_id)
+    else:
+        job = job_store.get(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    return jsonify({'status': 'success', 'job': job.to_dict()})
+
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """
+    Fetch a page of a finished job's rows
+    
+    Query params:
+        offset: First row to return (default 0)
+        limit: Rows per page (default 1000, max JOB_PAGE_MAX_ROWS)
+        format: "records" (default) or "columnar"
+    
+    Response:
+    {
+        "status": "success",
+        "data": [...],
+        "columns": [...],
+        "offset": 0,
+        "row_count": 1000,
+        "total_rows": 52000,
+        "next_offset": 1000     // null on the last page
+    }
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    if job.status != SUCCEEDED:
+        # 409 still running, 410 cancelled, 504 timed out, 500 failed
+        status_code = {CANCELLED: 410, TIMED_OUT: 504, FAILED: 500}.get(job.status, 409)
         return jsonify({
             'status': 'error',
-            'message': str(e)
-        }), 500
+            'message': f'Job is {job.status}',
+            'job': job.to_dict()
+        }), status_code
+    
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 1000)), 1), JOB_PAGE_MAX_ROWS)
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'offset and limit must be integers'
+        }), 400
+    
+    table = job.result
+    page = table.slice(offset, limit)
+    next_offset = offset + page.num_rows
+    body = {
+        'status': 'success',
+        'offset': offset,
+        'total_rows': table.num_rows,
+        'next_offset': next_offset if next_offset < table.num_rows else None
+    }
+    if request.args.get('format') == 'columnar':
+        body.update(arrow_to_columnar(page))
+    else:
+        body.update({
+            'data': arrow_to_records(page),
+            'columns': page.column_names,
+            'row_count': page.num_rows
+        })
+    return jsonify(body)
+
+
+def _cache_ttl(data):
+    """
+    Seconds to cache a request's result: its "cache_ttl" capped at
+    CACHE_TTL_MAX, else None for the cache's default
+    
+    Raises:
+        ValueError: If cache_ttl is not a number of seconds >= 0
+    """
+    value = data.get('cache_ttl')
+    if value is None:
+        return None
+    try:
+        ttl = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("cache_ttl must be a number of seconds")
+    if not ttl >= 0:
+        raise ValueError("cache_ttl must not be negative")
+    return min(ttl, CACHE_TTL_MAX)
+
+
+def _cache_bypassed(data):
+    """True if the client asked to skip the result cache"""
+    if data.get('cache') is False:
+        return True
+    if request.headers.get('X-Cache-Bypass', '').lower() in ('1', 'true'):
+        return True
+    return 'no-cache' in request.headers.get('Cache-Control', '').lower()
+
+
+@app.route('/api/cache', methods=['GET', 'DELETE'])
+def result_cache():
+    """
+    Result cache statistics (GET) or clear the cache (DELETE)
+    
+    Response:
+    {
+        "status": "success",
+        "cache": {"entries": 12, "bytes": 1048576, "hits": 80, "misses": 12, ...},
+        "singleflight": {"in_flight": 1, "waiters": 3, "shared": 20, ...}
+    }
+    """
+    if request.method == 'DELETE':
+        removed = clear_result_cache()
+        return jsonify({'status': 'success', 'removed': removed})
+    return jsonify({
+        'status': 'success',
+        'cache': get_cache_stats(),
+        'singleflight': get_singleflight_stats(),
+        'paged_results': paged_results.stats(),
+        'series': get_series_cache_stats()
+    })
+
+
+def _wants_stream(data):
+    """True if the client asked for an NDJSON stream"""
+    if data.get('stream'):
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def _wants_arrow():
+    """True if the client asked for an Arrow IPC stream"""
+    best = request.accept_mimetypes.best_match(['application/json', ARROW_STREAM_MIMETYPE])
+    return best == ARROW_STREAM_MIMETYPE
+
+
+def _count_stream_cancellation(kind):
+    with _stream_cancellations_lock:
+        _stream_cancellations[kind] += 1
+
+
+def _start_stream(query, data, arrow=False):
+    """
+    Start a streamed query and fetch its first batch
+    
+    The request thread blocks in the warehouse until then, so a watcher
+    cancels the query if the client disconnects meanwhile. Afterwards the
+    response's close does that (see call_on_close).
+    
+    Returns:
+        tuple: (batches generator, first (columns, rows) batch)
+    """
+    cursors = []
+    
+    def cancel():
+        for cursor in cursors:
+            cursor.cancel()
+    
+    def on_cursor(cursor):
+        cursors.append(cursor)
+        # The client may have left while we waited for a connection; don't start the query
+        return not watcher.check()
+    
+    watcher = DisconnectWatcher(request_socket(request.environ), cancel, DISCONNECT_POLL_INTERVAL)
+    batches = stream_query(query, arrow=arrow, timeout=_query_timeout(data), on_cursor=on_cursor)
+    try:
+        with watcher:
+            first = next(batches)
+    except QueryTimeout:
+        _count_stream_cancellation('timed_out')
+        raise
+    except Exception:
+        if watcher.disconnected:
+            _count_stream_cancellation('disconnected')
+        raise
+    return batches, first
+
+
+def _arrow_stream_response(query, data):
+    """
+    Stream query results as Arrow IPC record batches
+    
+    Batches come from cursor.fetchmany_arrow() and are written out as-is,
+    so no per-cell Python objects are created. The stream ends with an empty
+    batch whose custom metadata carries row_count and truncation info.
+    """
+    import pyarrow as pa
+    
+    max_rows = min(int(data.get('max_rows') or STREAM_MAX_ROWS), STREAM_MAX_ROWS)
+    max_bytes = STREAM_MAX_BYTES
+    
+    batches, (_, first_table) = _start_stream(query, data, arrow=True)
+    schema = first_table.schema
+    
+    def generate():
+        sink = io.BytesIO()
+        writer = pa.ipc.new_stream(sink, schema)
+        row_count = 0
+        bytes_sent = 0
+        truncated_reason = None
+        table = first_table
+        
+        def drain():
+            # Hand over what the writer has produced so far
+            nonlocal bytes_sent
+            chunk = sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+            bytes_sent += len(chunk)
+            return chunk
+        
+        try:
+            while True:
+                if row_count + table.num_rows > max_rows:
+                    table = table.slice(0, max_rows - row_count)
+                    truncated_reason = 'max_rows'
+                for batch in table.to_batches():
+                    if bytes_sent + batch.nbytes > max_bytes:
+                        truncated_reason = 'max_bytes'
+                        break
+                    writer.write_batch(batch)
+                    row_count += batch.num_rows
+                    yield drain()
+                if truncated_reason:
+                    break
+                try:
+                    _, table = next(batches)
+                except StopIteration:
+                    break
+            status = {'status': 'success'}
+        except GeneratorExit:
+            # The server closes the response early when the client is gone
+            _count_stream_cancellation('disconnected')
+            raise
+        except Exception as e:
+            if isinstance(e, QueryTimeout):
+                _count_stream_cancellation('timed_out')
+            status = {'status': 'error', 'message': str(e)}
+        finally:
+            batches.close()
+        
+        status.update({
+            'row_count': str(row_count),
+            'truncated': str(truncated_reason is not None).lower(),
+            'truncated_reason': truncated_reason or ''
+        })
+        writer.write_batch(pa.RecordBatch.from_pylist([], schema=schema),
+                           custom_metadata=status)
+        writer.close()
+        yield drain()
+    
+    response = Response(generate(), mimetype=ARROW_STREAM_MIMETYPE, headers={
+        'X-Accel-Buffering': 'no',
+        'Cache-Control': 'no-cache'
+    })
+    response.call_on_close(batches.close)
+    return response
+
+
+def _stream_response(query, data):
+    """
+    Stream query results as NDJSON while they are fetched
+    
+    The query is started before the response begins so connection and SQL
+    errors still return a normal JSON 500. Errors after that point are
+    reported in the final "end" line.
+    """
+    max_rows = min(int(data.get('max_rows') or STREAM_MAX_ROWS), STREAM_MAX_ROWS)
+    max_bytes = STREAM_MAX_BYTES
+    
+    batches, (columns, first_rows) = _start_stream(query, data)
+    
+    def line(value):
+        return (app.json.dumps(value) + '\n').encode('utf-8')
+    
+    def generate():
+        row_count = 0
+        bytes_sent = 0
+        truncated_reason = None
+        rows = first_rows
+        
+        try:
+            header = line({'type': 'meta', 'columns': columns})
+            bytes_sent += len(header)
+            yield header
+            
+            while True:
+                chunk = []
+                for row in rows:
+                    if row_count >= max_rows:
+                        truncated_reason = 'max_rows'
+                        break
+                    encoded = line(list(row))
+                    if bytes_sent + len(encoded) > max_bytes:
+                        truncated_reason = 'max_bytes'
+                        break
+                    chunk.append(encoded)
+                    bytes_sent += len(encoded)
+                    row_count += 1
+                if chunk:
+                    yield b''.join(chunk)
+                if truncated_reason:
+                    break
+                try:
+                    _, rows = next(batches)
+                except StopIteration:
+                    break
+        except GeneratorExit:
+            # The server closes the response early when the client is gone
+            _count_stream_cancellation('disconnected')
+            raise
+        except Exception as e:
+            if isinstance(e, QueryTimeout):
+                _count_stream_cancellation('timed_out')
+            yield line({
+                'type': 'end',
+                'status': 'error',
+                'message': str(e),
+                'row_count': row_count,
+                'columns': columns
+            })
+            return
+        finally:
+            # Cancels the warehouse query if we stopped early
+            batches.close()
+        
+        yield line({
+            'type': 'end',
+            'status': 'success',
+            'row_count': row_count,
+            'columns': columns,
+            'truncated': truncated_reason is not None,
+            'truncated_reason': truncated_reason
+        })
+    
+    response = Response(generate(), mimetype=NDJSON_MIMETYPE, headers={
+        # Don't let reverse proxies buffer the whole stream
+        'X-Accel-Buffering': 'no',
+        'Cache-Control': 'no-cache'
+    })
+    # Release the connection even if the client leaves before the first chunk
+    response.call_on_close(batches.close)
+    return response
+
 
+SCHEMA_BULK_MAX_TABLES = int(os.getenv('SCHEMA_BULK_MAX_TABLES', '100'))
 
-@app.route('/api/schema/<path:table_name>', methods=['GET'])
+
+@app.route('/api/schema/<path:table_name>', methods=['GET', 'DELETE'])
 def get_schema(table_name):
     """
-    Get table schema
+    Get table schema (GET) or drop it from the schema cache (DELETE)
     
     URL params:
         table_name: Fully qualified table name (catalog.schema.table)
     
+    Query params:
+        refresh: "true" to bypass the schema cache
+    
     Response:
     {
         "status": "success",
-        "schema": [...]
+        "table": "samples.nyctaxi.trips",
+        "schema": [{"col_name": ..., "data_type": ..., "comment": ...}, ...],
+        "columns": [{"name": ..., "type": ..., "role": "time", "position": 1,
+                     "nullable": true, "comment": null}, ...]
     }
     """
     try:
-        schema = get_table_schema(table_name)
+        if request.method == 'DELETE':
+            removed = invalidate_table_schema(table_name)
+            return jsonify({'status': 'success', 'table': table_name, 'removed': removed})
+        
+        refresh = request.args.get('refresh', '').lower() == 'true'
+        columns = get_table_columns(table_name, refresh=refresh)
         return jsonify({
             'status': 'success',
             'table': table_name,
-            'schema': schema
+            'schema': [column.to_describe_row() for column in columns],
+            'columns': [column.to_dict() for column in columns]
         })
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -133,16 +1174,491 @@ def get_schema(table_name):
         }), 500
 
 
+@app.route('/api/chart', methods=['POST'])
+def chart():
+    """
+    Compute a chart's aggregated series in the warehouse
+    
+    The chart config is validated against the table's cached schema and
+    compiled into one DATE_TRUNC ... GROUP BY query, so only the buckets
+    cross the wire.
+    
+    Request body:
+    {
+        "table": "samples.nyctaxi.trips",
+        "time_column": "tpep_pickup_datetime",   // optional, first time column
+        "grain": "day",
+        "metrics": [{"column": "fare_amount", "aggregation": "sum", "name": "Fare"}],
+        "filters": [{"column": "pickup_zip", "operator": "=", "value": "10001"}],
+        "trailing": {"unit": "day", "count": 30},               // optional
+        "date_range": {"start": "2016-01-01", "end": "2016-01-31"}, // optional
+        "format": "records",  // optional, "columnar"
+        "cache": true,        // optional, false re-runs the query
+        "timeout": 600,       // optional, seconds before the query is cancelled
+        "max_points": 500,    // optional, down-sample long series (see /api/query)
+        "downsample": "lttb"  // optional, or "minmax"
+    }
+    
+    Response:
+    {
+        "status": "success",
+        "data": [{"time": "2016-01-01T00:00:00", "Fare": 1234.5}, ...],
+        "columns": ["time", "Fare"],
+        "row_count": 31,
+        "truncated": false,   // true if more than CHART_MAX_BUCKETS buckets
+        "sql": "SELECT DATE_TRUNC('DAY', ...) ...",
+        "downsampling": {...}  // with max_points, as for /api/query
+    }
+    
+    Period-over-period charts send "chart_type": "period-over-period" and
+    "pop": {"metric", "aggregation", "compare_unit", "compare_count"} (the
+    UI's chartType/popConfig names work too) instead of "metrics". Both
+    periods come from one table scan; rows carry time, current_<agg>_<col>,
+    previous_<agg>_<col> and previous_time.
+    
+    Bounded windows whose ends fall on bucket boundaries (any trailing
+    window, or whole-day date ranges at hour/day grain) go through the
+    per-bucket series cache: only ranges not cached yet are queried, and
+    X-Cache is PARTIAL when some buckets came from the cache. Coarser grains
+    of count/sum/avg/min/max are rolled up from finer cached buckets without
+    a query (X-Cache: ROLLUP); count_distinct is always queried.
+    """
+    try:
+        data = request.get_json() or {}
+        if not data.get('table'):
+            return jsonify({
+                'status': 'error',
+                'message': 'table is required'
+            }), 400
+        
+        max_points = parse_max_points(data.get('max_points'))
+        method = parse_method(data.get('downsample'))
+        columns = get_table_columns(data['table'])
+        if (data.get('chart_type') or data.get('chartType')) == 'period-over-period':
+            job, sql = _submit_pop_job(data, columns), None
+        else:
+            job, sql = _submit_series_job(parse_chart_spec(data, columns), data)
+        timed_out = _await_job(job)
+        if timed_out is not None:
+            return timed_out
+        
+        table = job.result
+        truncated = table.num_rows > CHART_MAX_BUCKETS
+        table = table.slice(0, CHART_MAX_BUCKETS)
+        downsampling = None
+        if max_points is not None:
+            table, downsampling = downsample(table, max_points, method, 'time')
+        body = _series_body(table, data.get('format'))
+        body.update({'status': 'success', 'truncated': truncated, 'sql': sql})
+        if downsampling is not None:
+            body['downsampling'] = downsampling
+        response = jsonify(body)
+        response.headers['X-Cache'] = job.cache_status
+        return response
+        
+    except Exception as e:
+        return _query_error_response(e)
+
+
+def _submit_series_job(spec, data):
+    """
+    Queue a time-series chart
+    
+    Returns:
+        tuple: (job, sql) - sql is the full-window query, for display
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    window = resolve_window(spec, now)
+    if not is_bucket_aligned(window, spec.grain):
+        # Open-ended or partial-bucket windows: cache the whole result by SQL
+        sql = build_series_query(spec, limit=CHART_MAX_BUCKETS + 1)
+        return _submit_query_job(sql, data), sql
+    
+    # One bucket past the cap, so the endpoint can tell it truncated
+    window = cap_window(window, spec.grain, CHART_MAX_BUCKETS + 1)
+    bypass = _cache_bypassed(data)
+    timeout = _query_timeout(data)
+    
+    def work(job):
+        table, job.cache_status, _ = fetch_series(
+            spec, [window],
+            now=now,
+            bypass=bypass,
+            timeout=job.remaining(),
+            attach_cancel=job.attach_cancel
+        )
+        return table
+    
+    sql = build_series_query(spec, ranges=[window], limit=CHART_MAX_BUCKETS + 1)
+    return _submit_admitted(sql, work, timeout=timeout), sql
+
+
+def _submit_pop_job(data, columns):
+    """Validate a period-over-period chart and queue its computation"""
+    pop = data.get('pop') or data.get('popConfig') or {}
+    unit, count = parse_compare(
+        pop.get('compare_unit') or pop.get('compareUnit'),
+        pop.get('compare_count') or pop.get('compareCount')
+    )
+    metric = {
+        'column': pop.get('metric'),
+        'aggregation': pop.get('aggregation'),
+        'name': pop.get('name')
+    }
+    spec = parse_chart_spec({**data, 'metrics': [metric]}, columns)
+    bypass = _cache_bypassed(data)
+    timeout = _query_timeout(data)
+    
+    def work(job):
+        table, job.cache_status = period_over_period(
+            spec, unit, count,
+            bypass=bypass,
+            timeout=job.remaining(),
+            attach_cancel=job.attach_cancel
+        )
+        return table
+    
+    return _submit_admitted(f"period-over-period {spec.table}", work, timeout=timeout)
+
+
+def _series_body(table, fmt=None):
+    """Aggregated rows as JSON, with times as ISO strings"""
+    columnar = arrow_to_columnar(table)
+    if fmt == 'columnar':
+        return columnar
+    return {
+        'data': [dict(zip(columnar['columns'], row)) for row in zip(*columnar['data'])],
+        'columns': columnar['columns'],
+        'row_count': columnar['row_count']
+    }
+
+
+@app.route('/api/topn', methods=['POST'])
+def top_n():
+    """
+    Rank a dimension by an aggregated metric in the warehouse
+    
+    Groups past the limit are folded into one "Other" row, so at most
+    limit + 1 rows (per secondary value) cross the wire.
+    
+    Request body:
+    {
+        "table": "samples.nyctaxi.trips",
+        "dimension": "vendor",
+        "metric": "fare_amount",
+        "aggregation": "sum",
+        "limit": 10,
+        "secondary_dimension": "payment_type",  // optional, stacks each bar
+        "secondary_limit": 10,                  // optional, other series fold into "Other"
+        "filters": [...],                       // optional, as for /api/chart
+        "date_range": {"start": ..., "end": ...},  // optional
+        "include_other": true,                  // optional
+        "approximate": false                    // optional, approx_top_k candidates
+    }
+    
+    Response:
+    {
+        "status": "success",
+        "data": [{"name": "CMT", "rank": 1, "is_other": false, "value": 1234.5}, ...,
+                 {"name": "Other", "rank": 11, "is_other": true, "value": 99.0}],
+        "total": 1333.5,      // metric over all groups
+        "groups": 42,         // distinct dimension values (approximate if approximate)
+        "other_groups": 32,
+        "approximate": false,
+        "sql": "WITH grouped AS (...) ..."
+    }
+    
+    With a secondary dimension each row has "total" plus one key per
+    series, and "series" lists the series names in rank order.
+    """
+    try:
+        data = request.get_json() or {}
+        if not data.get('table'):
+            return jsonify({
+                'status': 'error',
+                'message': 'table is required'
+            }), 400
+        
+        spec = parse_topn_spec(data, get_table_columns(data['table']))
+        sql = build_approx_topn_query(spec) if spec.approximate else build_topn_query(spec)
+        
+        job = _submit_query_job(sql, data)
+        timed_out = _await_job(job)
+        if timed_out is not None:
+            return timed_out
+        
+        body = shape_topn(
+            arrow_to_records(job.result),
+            spec,
+            include_other=data.get('include_other', True) is not False
+        )
+        body.update({'status': 'success', 'sql': sql})
+        response = jsonify(body)
+        response.headers['X-Cache'] = job.cache_status
+        return response
+        
+    except Exception as e:
+        return _query_error_response(e)
+
+
+@app.route('/api/schemas', methods=['POST', 'DELETE'])
+def get_schemas():
+    """
+    Get the schemas of many tables in one request (POST), or clear the
+    schema cache (DELETE)
+    
+    Request body:
+    {
+        "tables": ["samples.nyctaxi.trips", "main.sales.orders"],
+        "refresh": false
+    }
+    
+    Response:
+    {
+        "status": "success",
+        "schemas": {
+            "samples.nyctaxi.trips": [{"name": ..., "type": ..., "role": ...}, ...]
+        },
+        "missing": ["main.sales.orders"]
+    }
+    """
+    try:
+        if request.method == 'DELETE':
+            return jsonify({'status': 'success', 'removed': invalidate_table_schema()})
+        
+        data = request.get_json() or {}
+        tables = data.get('tables')
+        if not isinstance(tables, list) or not tables:
+            return jsonify({
+                'status': 'error',
+                'message': 'tables must be a non-empty list of table names'
+            }), 400
+        if len(tables) > SCHEMA_BULK_MAX_TABLES:
+            return jsonify({
+                'status': 'error',
+                'message': f'At most {SCHEMA_BULK_MAX_TABLES} tables per request'
+            }), 400
+        
+        schemas, missing = get_table_schemas(tables, refresh=bool(data.get('refresh')))
+        return jsonify({
+            'status': 'success',
+            'schemas': {
+                name: [column.to_dict() for column in columns]
+                for name, columns in schemas.items()
+            },
+            'missing': missing
+        })
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+# POST /api/batch
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', '20'))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '8'))
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv('BATCH_DEFAULT_CONCURRENCY', '4'))
+BATCH_TIMEOUT = float(os.getenv('BATCH_TIMEOUT', '120'))
+# Headers and environ keys members inherit from the batch request (client
+# identity for admission, cache bypass, and the socket for disconnects)
+BATCH_FORWARDED_HEADERS = CLIENT_ID_HEADERS + ('X-Cache-Bypass', 'Cache-Control')
+BATCH_FORWARDED_ENVIRON = ('REMOTE_ADDR', 'gunicorn.socket', 'werkzeug.socket')
+
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """
+    Run several independent requests in parallel in one round trip
+    
+    Each member is served by its usual endpoint (same validation, caching,
+    admission control and error bodies) on its own pooled connection. At
+    most max_concurrency run at once; members still running after "timeout"
+    are reported as 504 and the rest are returned anyway.
+    
+    Request body:
+    {
+        "requests": [
+            {"name": "schema", "type": "schema", "table": "samples.nyctaxi.trips"},
+            {"name": "trend", "type": "chart", "table": ..., "grain": "day", "metrics": [...]},
+            {"name": "top", "type": "topn", "table": ..., "dimension": "vendor", ...},
+            {"name": "rows", "type": "query", "query": "SELECT ...", "format": "columnar"},
+            {"name": "ping", "type": "test_connection"}
+        ],
+        "max_concurrency": 4,   // optional, capped by BATCH_MAX_CONCURRENCY
+        "timeout": 120,         // optional, seconds for the whole batch
+        "stream": false         // optional, or send Accept: application/x-ndjson
+    }
+    
+    Member types are query (/api/query), chart (/api/chart), topn
+    (/api/topn), schema (/api/schema/<table>, with optional "refresh") and
+    test_connection. Streaming and paged queries cannot be batched.
+    
+    Response - each result is its endpoint's JSON body plus the member's
+    HTTP status, time taken and X-Cache value:
+    {
+        "status": "success",
+        "results": {
+            "schema": {"status_code": 200, "elapsed_ms": 3.1, "status": "success", "columns": [...]},
+            "top": {"status_code": 400, "elapsed_ms": 0.4, "status": "error", "message": "..."},
+            ...
+        },
+        "failed": ["top"]
+    }
+    
+    Streaming response (application/x-ndjson) - one line per member as soon
+    as it finishes, {"name": "schema", "status_code": 200, ...}, then
+        {"type": "end", "status": "success", "failed": [...]}
+    """
+    try:
+        data = request.get_json() or {}
+        members = parse_batch(data.get('requests'), BATCH_MAX_REQUESTS)
+        concurrency = _bounded_number(data.get('max_concurrency'), BATCH_DEFAULT_CONCURRENCY,
+                                      BATCH_MAX_CONCURRENCY, 'max_concurrency', int)
+        timeout = _bounded_number(data.get('timeout'), BATCH_TIMEOUT, SYNC_QUERY_TIMEOUT, 'timeout', float)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    headers = {name: request.headers[name] for name in BATCH_FORWARDED_HEADERS if name in request.headers}
+    environ = {key: request.environ[key] for key in BATCH_FORWARDED_ENVIRON if key in request.environ}
+    # Don't let a member's query outlive the batch
+    member_timeout = min(timeout, QUERY_TIMEOUT_MAX)
+    
+    def run_member(member):
+        return _run_batch_member(member, headers, environ, member_timeout)
+    
+    results = run_batch(members, run_member, min(concurrency, len(members)), timeout)
+    
+    if _wants_stream(data):
+        def generate():
+            failed = []
+            for member, status_code, body, elapsed in results:
+                if status_code >= 400:
+                    failed.append(member.name)
+                result = _batch_result(status_code, body, elapsed)
+                yield (app.json.dumps({'name': member.name, **result}) + '\n').encode('utf-8')
+            yield (app.json.dumps({'type': 'end', 'status': 'success', 'failed': failed}) + '\n').encode('utf-8')
+        
+        return Response(generate(), mimetype=NDJSON_MIMETYPE, headers={
+            'X-Accel-Buffering': 'no',
+            'Cache-Control': 'no-cache'
+        })
+    
+    finished = {}
+    for member, status_code, body, elapsed in results:
+        finished[member.name] = _batch_result(status_code, body, elapsed)
+    return jsonify({
+        'status': 'success',
+        'results': {member.name: finished[member.name] for member in members},
+        'failed': [member.name for member in members if finished[member.name]['status_code'] >= 400]
+    })
+
+
+def _bounded_number(value, default, maximum, what, kind):
+    """Parse an optional positive number no larger than maximum"""
+    if value is None:
+        return default
+    try:
+        number = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{what} must be a number")
+    if not 0 < number <= maximum:
+        raise ValueError(f"{what} must be between 0 and {maximum:g}")
+    return number
+
+
+def _run_batch_member(member, headers, environ, timeout):
+    """
+    Serve one batch member through its endpoint's view function
+    
+    Runs on a batch worker thread in a request context of its own, without
+    the after_request hooks (the batch response is compressed as a whole).
+    
+    Returns:
+        tuple: (status_code, body) - body also carries X-Cache as "cache"
+    """
+    body = dict(member.body)
+    query_string = None
+    if member.method == 'GET':
+        query_string = {key: str(value).lower() if isinstance(value, bool) else value
+                        for key, value in body.items() if key != 'table'}
+        body = None
+    elif member.type in ('query', 'topn'):
+        body.setdefault('timeout', timeout)
+    
+    builder = EnvironBuilder(path=member.path, method=member.method, json=body, query_string=query_string,
+                             headers={**headers, 'Accept': 'application/json'}, environ_overrides=environ)
+    token = slowlog.set_endpoint(f"batch:{member.type}")
+    try:
+        with app.request_context(builder.get_environ()):
+            response = app.make_response(app.dispatch_request())
+    finally:
+        slowlog.reset_endpoint(token)
+    payload = response.get_json(silent=True) or {'status': 'error', 'message': response.get_data(as_text=True)}
+    if response.headers.get('X-Cache'):
+        payload['cache'] = response.headers['X-Cache']
+    return response.status_code, payload
+
+
+def _batch_result(status_code, body, elapsed):
+    return {'status_code': status_code, 'elapsed_ms': round(elapsed * 1000, 1), **body}
+
+
+def startup():
+    """
+    Per-process startup, run by the dev server and by each gunicorn worker
+    (see gunicorn.conf.py): pre-open DB_POOL_MIN_SIZE connections
+    """
+    needed = recommended_pool_size(ADMISSION_MAX_CONCURRENT, PAGED_RESULTS_MAX_OPEN)
+    if POOL_MAX_SIZE < needed:
+        print(f"⚠️  DB_POOL_MAX_SIZE={POOL_MAX_SIZE} is below {needed} (ADMISSION_MAX_CONCURRENT="
+              f"{ADMISSION_MAX_CONCURRENT} + PAGED_RESULTS_MAX_OPEN={PAGED_RESULTS_MAX_OPEN} + "
+              f"{POOL_SCHEMA_HEADROOM} for schema lookups); queries will wait for connections")
+    try:
+        warm_pool()
+    except Exception as e:
+        print(f"⚠️  Could not warm connection pool: {e}")
+
+
+def shutdown(timeout=SHUTDOWN_DRAIN_TIMEOUT):
+    """
+    Drain in-flight queries, then release warehouse resources
+    
+    New jobs are refused (503) while queued and running ones get up to
+    timeout seconds to finish; the rest are cancelled in the warehouse.
+    
+    Returns:
+        dict: Jobs that finished and that were cancelled while draining
+    """
+    drained = job_store.drain(timeout)
+    paged_results.close()
+    close_pool()
+    print(f"🛑 Drained query jobs: {drained['finished']} finished, {drained['cancelled']} cancelled")
+    return drained
+
+
 if __name__ == '__main__':
-    # Get port from environment or use default
+    # Development server - production runs gunicorn -c gunicorn.conf.py api:app
     port = int(os.getenv('API_PORT', 8001))
     
     print(f"🚀 Starting Databricks Query API on port {port}")
     print(f"📊 Profile: {os.getenv('DATABRICKS_PROFILE', 'pm-bootcamp')}")
     print(f"🔗 Warehouse: {os.getenv('DATABRICKS_SQL_WAREHOUSE_ID', 'not set')}")
+
+    startup()
+    atexit.register(shutdown)
     
     app.run(
         host='0.0.0.0',
         port=port,
+        threaded=True,
         debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     )
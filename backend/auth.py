@@ -0,0 +1,230 @@
+"""
+Cached OAuth token provider for Databricks SQL connections
+Avoids an OAuth round trip per query by caching the bearer token until
+shortly before it expires
+"""
+
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class FakeClock:
+    """
+    Manually advanced clock for testing token refresh offline
+
+    Usage:
+        clock = FakeClock()
+        provider = TokenProvider(fetch, clock=clock, background=False)
+        clock.advance(3500)
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class TokenProvider:
+    """
+    Caches a bearer token and its expiry, refreshing it before it expires
+
+    Concurrent callers share a single refresh: while one thread fetches a new
+    token the others either keep using the still-valid cached token or wait
+    for the refresh to finish if it has already expired.
+
+    Args:
+        fetch (callable): Returns (token, lifetime_seconds). lifetime_seconds
+            may be None when the credential does not report an expiry
+        clock (callable): Monotonic time source (FakeClock in tests)
+        refresh_margin (float): Refresh this many seconds before expiry
+        default_lifetime (float): Assumed lifetime when fetch returns None
+        background (bool): Refresh from a daemon thread ahead of expiry.
+            When False, refreshes happen inline in get_token()
+    """
+
+    def __init__(self, fetch, clock=time.monotonic, refresh_margin=300,
+                 default_lifetime=3600, background=True):
+        self._fetch = fetch
+        self._clock = clock
+        self.refresh_margin = refresh_margin
+        self.default_lifetime = default_lifetime
+        self.background = background
+
+        self._lock = threading.Condition()
+        self._token = None
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._error = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {'fetches': 0, 'hits': 0, 'failures': 0}
+
+    @property
+    def expires_at(self):
+        """Clock time at which the cached token expires (0 if none)"""
+        with self._lock:
+            return self._expires_at
+
+    def _needs_refresh(self, now):
+        return self._token is None or now >= self._expires_at - self.refresh_margin
+
+    def get_token(self):
+        """
+        Get a valid bearer token
+
+        Returns:
+            str: Cached token, refreshed first if missing or expired
+
+        Raises:
+            Exception: If a token could not be fetched
+        """
+        if self.background:
+            self._ensure_refresher()
+
+        with self._lock:
+            while True:
+                now = self._clock()
+                valid = self._token is not None and now < self._expires_at
+                if valid and not self._needs_refresh(now):
+                    self._stats['hits'] += 1
+                    return self._token
+                if self._refreshing:
+                    if valid:
+                        # Someone else is refreshing; the old token still works
+                        self._stats['hits'] += 1
+                        return self._token
+                    self._lock.wait()
+                    if self._error is not None and self._token is None:
+                        raise self._error
+                    continue
+                if valid and self.background:
+                    # Inside the margin: let the refresher thread handle it
+                    self._lock.notify_all()
+                    self._stats['hits'] += 1
+                    return self._token
+                self._refreshing = True
+                fallback = self._token if valid else None
+                break
+
+        try:
+            return self._do_refresh()
+        except Exception:
+            # A failed early refresh is retried next call; the old token still works
+            if fallback is not None:
+                return fallback
+            raise
+
+    def refresh(self):
+        """
+        Force a token refresh, joining one already in progress
+
+        Returns:
+            str: The new token
+        """
+        with self._lock:
+            if self._refreshing:
+                while self._refreshing:
+                    self._lock.wait()
+                if self._error is not None:
+                    raise self._error
+                return self._token
+            self._refreshing = True
+        return self._do_refresh()
+
+    def _do_refresh(self):
+        """Fetch a token (caller has set _refreshing) and wake waiters"""
+        try:
+            token, lifetime = self._fetch()
+            if not token:
+                raise Exception("Could not get authentication token")
+        except Exception as e:
+            with self._lock:
+                self._refreshing = False
+                self._error = e
+                self._stats['failures'] += 1
+                self._lock.notify_all()
+            raise
+
+        if lifetime is None:
+            lifetime = self.default_lifetime
+        with self._lock:
+            self._token = token
+            self._expires_at = self._clock() + lifetime
+            self._refreshing = False
+            self._error = None
+            self._stats['fetches'] += 1
+            self._lock.notify_all()
+        return token
+
+    def _ensure_refresher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._refresh_loop, name="token-refresher", daemon=True
+                )
+                self._thread.start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                if self._token is None:
+                    delay = None
+                else:
+                    delay = self._expires_at - self.refresh_margin - self._clock()
+                if delay is None or delay > 0:
+                    # Woken early by get_token() or stop()
+                    self._lock.wait(delay)
+                    continue
+                if self._refreshing:
+                    self._lock.wait()
+                    continue
+                self._refreshing = True
+            try:
+                self._do_refresh()
+            except Exception as e:
+                print(f"Token refresh failed: {e}")
+                # Back off before retrying; get_token() falls back to inline refresh
+                self._stop.wait(min(30, self.refresh_margin / 4 or 1))
+
+    def stop(self):
+        """Stop the background refresher thread"""
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
+
+    def stats(self):
+        """
+        Token cache counters
+
+        Returns:
+            dict: fetches, hits, failures and seconds until expiry
+        """
+        with self._lock:
+            return {
+                **self._stats,
+                'expires_in': max(self._expires_at - self._clock(), 0) if self._token else 0,
+            }
+
+
+def lifetime_from_expiry(expiry):
+    """
+    Seconds until an SDK token expiry timestamp
+
+    Args:
+        expiry (datetime): Token expiry (naive values are treated as UTC)
+
+    Returns:
+        float or None: Remaining lifetime, None if expiry is unknown
+    """
+    if expiry is None:
+        return None
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return max((expiry - datetime.now(timezone.utc)).total_seconds(), 0)
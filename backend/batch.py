@@ -0,0 +1,137 @@
+"""
+Batched API requests
+Validates a list of named members (queries, charts, Top-N, schema lookups)
+and runs them in parallel with a concurrency limit, reporting each one as it
+finishes so a slow or failing member does not hold back the rest
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+# Member type -> (HTTP method, URL path) of the endpoint that serves it
+MEMBER_TYPES = {
+    'query': ('POST', '/api/query'),
+    'chart': ('POST', '/api/chart'),
+    'topn': ('POST', '/api/topn'),
+    'schema': ('GET', '/api/schema/{table}'),
+    'test_connection': ('GET', '/api/test-connection'),
+}
+# Options that need a response of their own rather than one JSON body
+UNBATCHABLE_OPTIONS = ('stream', 'page_size', 'page_token')
+
+
+@dataclass(frozen=True)
+class BatchMember:
+    """One named request of a batch; body is what its endpoint would receive"""
+    name: str
+    type: str
+    method: str
+    path: str
+    body: dict
+
+
+def parse_batch(members, max_members):
+    """
+    Validate a batch's members
+
+    Each member is a dict with "name" (unique), "type" (see MEMBER_TYPES)
+    and the fields its endpoint takes; schema members also need "table".
+
+    Args:
+        members (list): Member dicts from the request body
+        max_members (int): Largest batch accepted
+
+    Returns:
+        list: BatchMember records in request order
+
+    Raises:
+        ValueError: If the batch or any member is malformed
+    """
+    if not isinstance(members, list) or not members:
+        raise ValueError("requests must be a non-empty list")
+    if len(members) > max_members:
+        raise ValueError(f"At most {max_members} requests per batch")
+
+    parsed = []
+    names = set()
+    for index, member in enumerate(members):
+        if not isinstance(member, dict):
+            raise ValueError(f"requests[{index}] must be an object")
+        name = member.get('name')
+        if not isinstance(name, str) or not name:
+            raise ValueError(f"requests[{index}] needs a name")
+        if name in names:
+            raise ValueError(f"Duplicate request name: {name}")
+        names.add(name)
+
+        kind = member.get('type')
+        if kind not in MEMBER_TYPES:
+            raise ValueError(f"{name}: type must be one of {', '.join(MEMBER_TYPES)}")
+        unbatchable = [option for option in UNBATCHABLE_OPTIONS if member.get(option)]
+        if unbatchable:
+            raise ValueError(f"{name}: {', '.join(unbatchable)} cannot be used in a batch")
+        method, path = MEMBER_TYPES[kind]
+        if kind == 'schema':
+            if not member.get('table'):
+                raise ValueError(f"{name}: table is required")
+            path = path.format(table=member['table'])
+
+        body = {key: value for key, value in member.items() if key not in ('name', 'type')}
+        parsed.append(BatchMember(name, kind, method, path, body))
+    return parsed
+
+
+def run_batch(members, run_member, max_concurrency, timeout):
+    """
+    Run members in parallel and yield their results as they finish
+
+    Members still running at the deadline are reported as timed out; their
+    threads are left to finish (their queries carry their own timeouts).
+
+    Args:
+        members (list): BatchMember records
+        run_member (callable): Called with a BatchMember on a worker thread;
+            returns (status_code, body). Exceptions become 500 results
+        max_concurrency (int): Members running at once
+        timeout (float): Seconds to wait for the whole batch
+
+    Yields:
+        tuple: (BatchMember, status_code, body, elapsed seconds)
+    """
+    deadline = time.monotonic() + timeout
+    started = {}
+    lock = threading.Lock()
+
+    def run(member):
+        with lock:
+            started[member.name] = time.monotonic()
+        try:
+            status_code, body = run_member(member)
+        except Exception as e:
+            status_code, body = 500, {'status': 'error', 'message': str(e)}
+        return status_code, body, time.monotonic() - started[member.name]
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="batch")
+    try:
+        futures = {executor.submit(run, member): member for member in members}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                yield (futures[future], *future.result())
+        for future in pending:
+            future.cancel()
+            member = futures[future]
+            with lock:
+                elapsed = time.monotonic() - started[member.name] if member.name in started else 0.0
+            yield member, 504, {
+                'status': 'error',
+                'message': f'Did not finish within the batch timeout of {timeout:g}s'
+            }, elapsed
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
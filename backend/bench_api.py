@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Benchmark the API against the hermetic fake warehouse
+Runs each scenario (buffered /api/query, /api/schema, NDJSON and Arrow
+streaming) in a fresh subprocess with fake_warehouse.install(), drives it
+with concurrent clients through the Flask test client, and reports
+throughput, p50/p99 latency and the subprocess's peak RSS. Results are
+compared with bench_baseline.json; a regression beyond --tolerance exits 1.
+The comparison is skipped when the baseline was recorded with different
+--requests, --clients or fake warehouse settings.
+
+Caches are off (RESULT_CACHE_TTL=0, SCHEMA_CACHE_TTL=0) so every request
+reaches the warehouse. Baselines are only comparable on the same machine:
+re-run with --save after changing hardware.
+
+Usage:
+    python bench_api.py [--scenario query ...] [--requests 200] [--clients 16]
+                        [--tolerance 0.2] [--save]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+TRIPS = 'samples.nyctaxi.trips'
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+
+# name -> (method, path, JSON body, headers); "{i}" in the query keeps requests distinct
+SCENARIOS = {
+    'query': ('POST', '/api/query', {'query': f"SELECT * FROM {TRIPS} WHERE pickup_zip <> {{i}} LIMIT 1000"}, {}),
+    'query_columnar': ('POST', '/api/query', {'query': f"SELECT * FROM {TRIPS} WHERE pickup_zip <> {{i}} LIMIT 1000",
+                                              'format': 'columnar'}, {}),
+    'schema': ('GET', f'/api/schema/{TRIPS}', None, {}),
+    'stream_ndjson': ('POST', '/api/query', {'query': f"SELECT * FROM {TRIPS} WHERE pickup_zip <> {{i}}",
+                                             'stream': True}, {}),
+    'stream_arrow': ('POST', '/api/query', {'query': f"SELECT * FROM {TRIPS} WHERE pickup_zip <> {{i}}"},
+                     {'Accept': ARROW_STREAM}),
+}
+# Fake warehouse settings shared by every scenario
+WAREHOUSE = {'connect_latency': 0.05, 'execute_latency': 0.02, 'row_cost': 2e-6}
+# Metric -> True if higher is better; compared against the baseline
+COMPARED = {'requests_per_second': True, 'p50_ms': False, 'p99_ms': False, 'peak_rss_mb': False}
+
+
+def peak_rss_mb():
+    """This process's peak resident set size"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_scenario(name, requests, clients):
+    """Drive one scenario in this process; returns its result dict"""
+    import api
+    import metrics
+    from fake_warehouse import FakeWarehouse, install
+
+    warehouse = FakeWarehouse(**WAREHOUSE)
+    install(warehouse)
+    method, path, body, headers = SCENARIOS[name]
+    client_id = iter(range(clients))
+
+    latencies = []
+    errors = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def client():
+        test_client = api.app.test_client()
+        with lock:
+            request_headers = {**headers, 'X-Client-Id': f"bench-{next(client_id)}"}
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            json_body = None if body is None else {
+                key: value.format(i=index) if isinstance(value, str) else value for key, value in body.items()
+            }
+            started = time.perf_counter()
+            response = test_client.open(path, method=method, json=json_body, headers=request_headers)
+            response.get_data()
+            response.close()
+            elapsed = time.perf_counter() - started
+            with lock:
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(response.status_code)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    phases = metrics.PHASE_SECONDS.snapshot()
+    return {
+        'requests': requests,
+        'clients': clients,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        'p99_ms': round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 1)
+        if latencies else None,
+        'errors': len(errors),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'rows_fetched': warehouse.stats()['rows_fetched'],
+        # Mean ms per request spent in each phase, for reading regressions
+        'phase_ms': {phase: round(values['sum'] * 1000 / requests, 2) for phase, values in sorted(phases.items())},
+    }
+
+
+def run_in_subprocess(name, requests, clients):
+    """Run a scenario in a fresh interpreter so its peak RSS is its own"""
+    with tempfile.TemporaryDirectory() as directory:
+        env = {**os.environ, 'RESULT_CACHE_TTL': '0', 'SCHEMA_CACHE_TTL': '0',
+               'SLOW_QUERY_LOG_PATH': os.path.join(directory, 'slow_queries.db')}
+        output = subprocess.run(
+            [sys.executable, __file__, '--run', name, '--requests', str(requests), '--clients', str(clients)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions against the baseline
+
+    Returns:
+        list: "scenario metric: baseline -> current" strings
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name} {metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def change(old, new):
+    if not old or new is None:
+        return ''
+    return f"{(new - old) / old:+.0%}"
+
+
+def ms(value):
+    """A latency column; '-' when no request succeeded"""
+    return '-' if value is None else f"{value:.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default all)")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed fractional regression")
+    parser.add_argument('--save', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_scenario(args.run, args.requests, args.clients)))
+        return 0
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            saved = json.load(f)
+        baseline = saved['results']
+        # Throughput and latency depend on these, so other runs aren't comparable
+        if (saved['requests'], saved['clients'], saved['warehouse']) != (args.requests, args.clients, WAREHOUSE):
+            print(f"Note: the baseline was recorded with {saved['requests']} requests and {saved['clients']} clients"
+                  f" against {saved['warehouse']}; not comparing against it")
+            baseline = {}
+
+    print("=" * 84)
+    print(f"API BENCHMARK ({args.requests} requests, {args.clients} clients, fake warehouse "
+          f"{WAREHOUSE['connect_latency'] * 1000:.0f} ms connect, {WAREHOUSE['execute_latency'] * 1000:.0f} ms execute, "
+          f"{WAREHOUSE['row_cost'] * 1e6:g} us/row)")
+    print("=" * 84)
+    print(f"{'scenario':<16} {'req/s':>8} {'':>5} {'p50 ms':>8} {'p99 ms':>8} {'':>5} "
+          f"{'peak RSS MB':>11} {'':>5} {'errors':>6}")
+
+    results = {}
+    for name in args.scenario or list(SCENARIOS):
+        result = results[name] = run_in_subprocess(name, args.requests, args.clients)
+        previous = baseline.get(name, {})
+        print(f"{name:<16} {result['requests_per_second']:>8.1f} "
+              f"{change(previous.get('requests_per_second'), result['requests_per_second']):>5} "
+              f"{ms(result['p50_ms']):>8} {ms(result['p99_ms']):>8} "
+              f"{change(previous.get('p99_ms'), result['p99_ms']):>5} "
+              f"{result['peak_rss_mb']:>11.1f} {change(previous.get('peak_rss_mb'), result['peak_rss_mb']):>5} "
+              f"{result['errors']:>6}")
+    print("")
+
+    if args.save:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({'warehouse': WAREHOUSE, 'requests': args.requests, 'clients': args.clients,
+                       'python': sys.version.split()[0], 'results': {**baseline, **results}}, f, indent=2)
+            f.write('\n')
+        print(f"Baseline saved to {BASELINE_PATH}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Benchmark response compression: CPU time vs bytes saved
+Compresses records and columnar JSON payloads of synthetic nyctaxi rows (see
+bench_formats.py) with every available encoding at the levels compression.py
+would pick and at a few fixed levels for comparison
+
+Usage:
+    python bench_compression.py [rows ...]
+"""
+
+import sys
+import time
+
+from bench_formats import encode_columnar, encode_records, make_rows
+from compression import available_encodings, compress, level_for
+
+REPEAT = 3
+FIXED_LEVELS = {'gzip': (1, 6, 9), 'br': (1, 4, 9), 'zstd': (1, 3, 9)}
+
+
+def measure(data, encoding, level):
+    """Best-of-REPEAT compress time and compressed size"""
+    best = None
+    size = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        size = len(compress(data, encoding, level))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    encodings = available_encodings()
+
+    print("=" * 78)
+    print(f"RESPONSE COMPRESSION BENCHMARK ({', '.join(encodings)})")
+    print("=" * 78)
+    print(f"{'rows':>7}  {'format':<9} {'encoding':<9} {'level':>7} {'ms':>8} {'MB/s':>8} "
+          f"{'bytes':>12} {'ratio':>7}")
+
+    for count in sizes:
+        rows = make_rows(count)
+        for name, encode in (('records', encode_records), ('columnar', encode_columnar)):
+            data = encode(rows).encode('utf-8')
+            print(f"{count:>7}  {name:<9} {'identity':<9} {'':>7} {'':>8} {'':>8} {len(data):>12,} {'':>7}")
+            for encoding in encodings:
+                chosen = level_for(encoding, len(data))
+                for level in sorted(set(FIXED_LEVELS[encoding]) | {chosen}):
+                    elapsed, size = measure(data, encoding, level)
+                    label = f"{level}*" if level == chosen else str(level)
+                    print(f"{count:>7}  {name:<9} {encoding:<9} {label:>7} {elapsed * 1000:>8.1f} "
+                          f"{len(data) / elapsed / 1e6:>8.0f} {size:>12,} {size / len(data):>7.1%}")
+
+    print("")
+    print("* level chosen by compression.level_for() for this payload size")
+
+
+if __name__ == "__main__":
+    main()
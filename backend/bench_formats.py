@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark /api/query result formats: records vs columnar JSON
+Runs offline on synthetic rows shaped like samples.nyctaxi.trips, encoded
+the way the API serves them - from the Arrow table the cursor returns
+
+Usage:
+    python bench_formats.py [rows ...]
+"""
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pyarrow as pa
+
+from api import app
+from db import arrow_to_columnar, arrow_to_records
+
+DESCRIPTION = [
+    ('tpep_pickup_datetime', 'timestamp'),
+    ('tpep_dropoff_datetime', 'timestamp'),
+    ('trip_distance', 'double'),
+    ('fare_amount', 'decimal'),
+    ('pickup_zip', 'int'),
+    ('dropoff_zip', 'int'),
+]
+REPEAT = 3
+
+
+def make_rows(count, seed=42):
+    """Synthetic nyctaxi-style rows"""
+    rng = random.Random(seed)
+    start = datetime(2016, 1, 1)
+    rows = []
+    for _ in range(count):
+        pickup = start + timedelta(seconds=rng.randint(0, 60 * 60 * 24 * 60))
+        rows.append((
+            pickup,
+            pickup + timedelta(seconds=rng.randint(120, 3600)),
+            round(rng.uniform(0.1, 20), 2),
+            Decimal(f"{rng.uniform(2.5, 80):.2f}"),
+            rng.randint(10001, 11697),
+            rng.randint(10001, 11697),
+        ))
+    return rows
+
+
+def to_arrow(rows):
+    """The pyarrow.Table fetchall_arrow() would return for rows"""
+    return pa.table({name: [row[i] for row in rows] for i, (name, _) in enumerate(DESCRIPTION)})
+
+
+def encode_records(rows):
+    """Records format: Arrow table -> list of dicts -> JSON"""
+    table = to_arrow(rows)
+    records = arrow_to_records(table)
+    return app.json.dumps({
+        'status': 'success',
+        'data': records,
+        'row_count': len(records),
+        'columns': table.column_names
+    })
+
+
+def encode_columnar(rows):
+    """Columnar format: Arrow table -> per-column lists -> JSON"""
+    return app.json.dumps({'status': 'success', **arrow_to_columnar(to_arrow(rows))})
+
+
+def measure(encode, rows):
+    """Best-of-REPEAT encode time and payload size"""
+    best = None
+    payload = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        payload = encode(rows)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(payload.encode('utf-8'))
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+
+    print("=" * 72)
+    print("RESULT FORMAT BENCHMARK (records vs columnar)")
+    print("=" * 72)
+    print(f"{'rows':>8}  {'format':<9} {'encode ms':>10} {'bytes':>12} {'vs records':>11}")
+
+    for count in sizes:
+        rows = make_rows(count)
+        records_time, records_bytes = measure(encode_records, rows)
+        columnar_time, columnar_bytes = measure(encode_columnar, rows)
+
+        print(f"{count:>8}  {'records':<9} {records_time * 1000:>10.1f} {records_bytes:>12,} {'':>11}")
+        print(f"{count:>8}  {'columnar':<9} {columnar_time * 1000:>10.1f} {columnar_bytes:>12,} "
+              f"{columnar_bytes / records_bytes:>10.0%}")
+
+    print("")
+
+
+if __name__ == "__main__":
+    main()
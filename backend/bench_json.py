@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark JSON encoding of typed query results
+Compares Flask's default provider with json_provider.FastJSONProvider on its
+stdlib and orjson paths, over synthetic nyctaxi rows (see bench_formats.py)
+in the shapes the API produces
+
+Usage:
+    python bench_json.py [rows ...]
+"""
+
+import sys
+import time
+
+import pandas as pd
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from bench_formats import DESCRIPTION, make_rows
+from json_provider import FastJSONProvider, orjson
+
+REPEAT = 3
+# Providers only hold a weak reference to their app
+APP = Flask(__name__)
+COLUMNS = [desc[0] for desc in DESCRIPTION]
+
+
+def arrow_records(rows):
+    """Arrow to_pylist() shape: datetime, Decimal, float, int"""
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+
+def pandas_records(rows):
+    """DataFrame.to_dict('records') shape: pandas Timestamps"""
+    return pd.DataFrame(rows, columns=COLUMNS).to_dict(orient='records')
+
+
+def numpy_records(rows):
+    """Row dicts holding numpy scalars, e.g. from DataFrame.itertuples()"""
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df['fare_amount'] = df['fare_amount'].astype(float)
+    return [
+        {name: value for name, value in zip(COLUMNS, values)}
+        for values in zip(*(df[name].to_numpy() for name in COLUMNS))
+    ]
+
+
+def encoders():
+    found = [('flask', DefaultJSONProvider(APP)), ('stdlib', FastJSONProvider(APP, encoder='stdlib'))]
+    if orjson is not None:
+        found.append(('orjson', FastJSONProvider(APP, encoder='orjson')))
+    return found
+
+
+def measure(provider, payload):
+    """Best-of-REPEAT time for jsonify-equivalent encoding to bytes, and size"""
+    best = None
+    size = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        size = len(provider.response(payload).get_data())
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    shapes = [('arrow', arrow_records), ('pandas', pandas_records), ('numpy', numpy_records)]
+
+    print("=" * 72)
+    print("JSON ENCODER BENCHMARK (Flask default vs FastJSONProvider)")
+    print("=" * 72)
+    print(f"{'rows':>8}  {'values':<8} {'encoder':<8} {'ms':>9} {'rows/s':>12} {'bytes':>12} {'speedup':>8}")
+
+    for count in sizes:
+        rows = make_rows(count)
+        for shape, build in shapes:
+            payload = {'status': 'success', 'data': build(rows), 'row_count': count, 'columns': COLUMNS}
+            baseline = None
+            for name, provider in encoders():
+                try:
+                    elapsed, size = measure(provider, payload)
+                except TypeError:
+                    print(f"{count:>8}  {shape:<8} {name:<8} {'unsupported':>9}")
+                    continue
+                baseline = baseline or elapsed
+                print(f"{count:>8}  {shape:<8} {name:<8} {elapsed * 1000:>9.1f} {count / elapsed:>12,.0f} "
+                      f"{size:>12,} {baseline / elapsed:>7.1f}x")
+
+    print("")
+    print("speedup is against the first encoder that handled the values")
+    print("(Flask's default cannot encode numpy scalars)")
+
+
+if __name__ == "__main__":
+    main()
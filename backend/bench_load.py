@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Load test the production server against a local fake warehouse
+Starts gunicorn (gthread, see gunicorn.conf.py) in a subprocess serving from
+fake_warehouse.py with a fixed query latency, then fires concurrent distinct
+/api/query requests at it for several JOB_MAX_WORKERS settings
+
+Usage:
+    python bench_load.py [--latency 0.1] [--requests 128] [--clients 32]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+WORKER_COUNTS = (1, 2, 4, 8, 16)
+WEB_THREADS = 32
+PORT = 8765
+
+
+def serve(port, latency):
+    """Run gunicorn in this process with the fake warehouse installed"""
+    from gunicorn.app.base import BaseApplication
+
+    class BenchServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"127.0.0.1:{port}")
+            self.cfg.set('workers', 1)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', WEB_THREADS)
+            self.cfg.set('loglevel', 'warning')
+
+        def load(self):
+            import api
+            from fake_warehouse import FakeWarehouse, install
+            install(FakeWarehouse(rows=10, execute_latency=latency))
+            return api.app
+
+    BenchServer().run()
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1)
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def run_load(port, requests, clients):
+    """Send requests distinct queries from clients threads; returns (seconds, latencies, errors)"""
+    latencies = []
+    errors = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            body = json.dumps({'query': f"SELECT {index} AS id"}).encode('utf-8')
+            request = urllib.request.Request(f"http://127.0.0.1:{port}/api/query", data=body,
+                                             headers={'Content-Type': 'application/json'})
+            started = time.perf_counter()
+            try:
+                urllib.request.urlopen(request, timeout=60).read()
+            except OSError as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sorted(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.1, help="fake query seconds")
+    parser.add_argument('--requests', type=int, default=128)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.latency)
+        return
+
+    print("=" * 72)
+    print(f"LOAD BENCHMARK ({args.requests} requests, {args.clients} clients, "
+          f"{args.latency * 1000:.0f} ms fake queries, {WEB_THREADS} web threads)")
+    print("=" * 72)
+    print(f"{'job workers':>11} {'seconds':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+
+    for workers in WORKER_COUNTS:
+        env = {**os.environ, 'JOB_MAX_WORKERS': str(workers), 'DB_POOL_MAX_SIZE': str(workers),
+               'RESULT_CACHE_TTL': '0'}
+        server = subprocess.Popen([sys.executable, __file__, '--serve', str(PORT), '--latency', str(args.latency)],
+                                  env=env)
+        try:
+            wait_until_up(PORT)
+            elapsed, latencies, errors = run_load(PORT, args.requests, args.clients)
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+        p50 = latencies[len(latencies) // 2] if latencies else 0
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+        print(f"{workers:>11} {elapsed:>9.2f} {len(latencies) / elapsed:>8.1f} "
+              f"{p50 * 1000:>8.0f} {p95 * 1000:>8.0f} {len(errors):>7}")
+
+    print("")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+In-memory result cache for warehouse queries
+LRU eviction under a global byte budget, with a TTL per entry
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Quoted literals/identifiers are kept verbatim; everything else is whitespace-normalized
+_SQL_TOKEN = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)")
+_WHITESPACE = re.compile(r"\s+")
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_FIRST_WORD = re.compile(r"^[\s(]*([A-Za-z]+)")
+# Statements whose results may be cached and shared between requests
+READ_ONLY_STATEMENTS = ('SELECT', 'WITH', 'SHOW', 'DESCRIBE', 'DESC')
+# A WITH clause can lead into a write, e.g. WITH src AS (...) INSERT INTO ...
+_WRITE_KEYWORD = re.compile(r"\b(?:INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+
+def normalize_sql(query):
+    """
+    Normalize SQL text for use as a cache key
+
+    Collapses runs of whitespace and drops trailing semicolons outside of
+    string literals and quoted identifiers, so queries that differ only in
+    formatting share a key.
+
+    Args:
+        query (str): SQL text
+
+    Returns:
+        str: Normalized SQL
+    """
+    parts = _SQL_TOKEN.split(query)
+    for i in range(0, len(parts), 2):
+        parts[i] = _WHITESPACE.sub(" ", parts[i])
+    normalized = "".join(parts).strip()
+    while normalized.endswith(";"):
+        normalized = normalized[:-1].rstrip()
+    return normalized
+
+
+def is_read_only(query):
+    """
+    Whether a statement only reads data, so its result may be cached
+
+    True for a single SELECT, WITH ... SELECT, SHOW or DESCRIBE statement.
+    Anything else - DML, DDL or several statements - must run every time.
+
+    Args:
+        query (str): SQL text
+
+    Returns:
+        bool
+    """
+    parts = _SQL_TOKEN.split(query)
+    # Keywords only count outside literals, quoted identifiers and comments
+    code = " ".join(_COMMENT.sub(" ", part) for part in parts[0::2]).strip()
+    while code.endswith(";"):
+        code = code[:-1].rstrip()
+    if ";" in code:
+        return False
+    match = _FIRST_WORD.match(code)
+    if match is None or match.group(1).upper() not in READ_ONLY_STATEMENTS:
+        return False
+    return match.group(1).upper() != 'WITH' or _WRITE_KEYWORD.search(code) is None
+
+
+class _Entry:
+    __slots__ = ('value', 'nbytes', 'expires_at')
+
+    def __init__(self, value, nbytes, expires_at):
+        self.value = value
+        self.nbytes = nbytes
+        self.expires_at = expires_at
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with per-entry TTL and a total byte budget
+
+    Values are stored as given; callers pass their size in bytes so the cache
+    can keep the total under max_bytes.
+
+    Args:
+        max_bytes (int): Total size budget across all entries
+        default_ttl (float): Seconds an entry lives unless put() overrides it
+        max_entry_bytes (int): Larger values are not cached (default max_bytes / 4)
+        clock (callable): Monotonic time source
+    """
+
+    def __init__(self, max_bytes, default_ttl=300, max_entry_bytes=None, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'bypasses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'rejected': 0,
+        }
+
+    def get(self, key):
+        """
+        Look up a key, refreshing its LRU position
+
+        Returns:
+            The cached value, or None on a miss or expired entry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if self._clock() >= entry.expires_at:
+                self._remove(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry.value
+
+    def contains(self, key):
+        """True if key holds a live entry; unlike get() it touches no stats or LRU order"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and self._clock() < entry.expires_at
+
+    def put(self, key, value, nbytes, ttl=None):
+        """
+        Store a value, evicting least recently used entries to fit
+
+        Args:
+            key: Hashable cache key
+            value: Value to store
+            nbytes (int): Size of the value in bytes
+            ttl (float): Seconds to keep it (defaults to default_ttl)
+
+        Returns:
+            bool: False if the value was too large to cache
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if nbytes > self.max_entry_bytes or ttl <= 0:
+                self._stats['rejected'] += 1
+                return False
+            while self._entries and self._bytes + nbytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+            self._entries[key] = _Entry(value, nbytes, self._clock() + ttl)
+            self._bytes += nbytes
+            self._stats['stores'] += 1
+            return True
+
+    def record_bypass(self):
+        """Count a request that skipped the cache lookup"""
+        with self._lock:
+            self._stats['bypasses'] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.nbytes
+
+    def invalidate(self, key=None):
+        """
+        Drop one entry, or everything when key is None
+
+        Returns:
+            int: Number of entries removed
+        """
+        with self._lock:
+            if key is None:
+                count = len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+                return count
+            if key in self._entries:
+                self._remove(key)
+                return 1
+            return 0
+
+    def stats(self):
+        """
+        Cache counters and current size
+
+        Returns:
+            dict: entries, bytes, max_bytes, hit_rate and cumulative counters
+        """
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else 0.0,
+                **self._stats,
+            }
@@ -0,0 +1,505 @@
+"""
+Chart spec compilation
+Validates the explorer's chart config against a table schema and compiles it
+into a single pushed-down DATE_TRUNC ... GROUP BY query
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from schema import quote_identifier, quote_table_name, sql_literal
+
+GRAINS = ('hour', 'day', 'week', 'month', 'quarter', 'year')
+AGGREGATIONS = ('count', 'sum', 'avg', 'min', 'max', 'count_distinct')
+NUMERIC_AGGREGATIONS = ('sum', 'avg')
+FILTER_OPERATORS = ('=', '!=', '<>', '>', '>=', '<', '<=', 'LIKE', 'NOT LIKE',
+                    'IN', 'NOT IN', 'IS NULL', 'IS NOT NULL')
+MAX_INTERVAL_COUNT = 1000
+
+# Interval literals only take these units; weeks and quarters are converted
+_INTERVAL_UNITS = {
+    'hour': ('HOUR', 1),
+    'day': ('DAY', 1),
+    'week': ('DAY', 7),
+    'month': ('MONTH', 1),
+    'quarter': ('MONTH', 3),
+    'year': ('YEAR', 1),
+}
+# Partial aggregates per decomposable aggregation: (alias, SQL function, how
+# partials merge). Partials of disjoint row sets merge into the partials of
+# their union, so groups and buckets can be rolled up without rescanning.
+PARTIALS = {
+    'count': (('_count', 'COUNT', 'SUM'),),
+    'sum': (('_sum', 'SUM', 'SUM'),),
+    'min': (('_min', 'MIN', 'MIN'),),
+    'max': (('_max', 'MAX', 'MAX'),),
+    'avg': (('_sum', 'SUM', 'SUM'), ('_count', 'COUNT', 'SUM')),
+}
+_NUMBER = re.compile(r"^-?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?$")
+
+
+@dataclass(frozen=True)
+class Metric:
+    """One aggregated series, e.g. SUM(`fare_amount`) AS `Fare Amount`"""
+    column: str
+    aggregation: str
+    name: str
+
+    def expression(self, value=None):
+        """Aggregate SQL, optionally over value (e.g. a CASE) instead of the column"""
+        if value is None:
+            value = '*' if self.column == '*' else quote_identifier(self.column)
+        if self.aggregation == 'count_distinct':
+            return f"COUNT(DISTINCT {value})"
+        return f"{self.aggregation.upper()}({value})"
+
+    @property
+    def decomposable(self):
+        """True if the metric can be computed from PARTIALS of row subsets"""
+        return self.aggregation in PARTIALS
+
+    def partial_expressions(self):
+        """
+        (alias, SQL) pairs from which the metric's value is computed
+
+        Decomposable metrics return their PARTIALS; any other metric returns
+        its own aggregate, which can only be read back as is.
+        """
+        if not self.decomposable:
+            return [('_value', self.expression())]
+        value = '1' if self.column == '*' else quote_identifier(self.column)
+        return [(alias, f"{function}({value})") for alias, function, _ in PARTIALS[self.aggregation]]
+
+    def final_value(self, partials):
+        """Metric value from the values of partial_expressions(), in order"""
+        if self.aggregation == 'avg':
+            total, count = partials
+            return float(total) / count if total is not None and count else None
+        return partials[0]
+
+
+@dataclass(frozen=True)
+class Filter:
+    """A WHERE condition on one column; values are already validated"""
+    column: str
+    operator: str
+    values: tuple = ()
+    numeric: bool = False
+
+    def to_sql(self):
+        column = quote_identifier(self.column)
+        if self.operator in ('IS NULL', 'IS NOT NULL'):
+            return f"{column} {self.operator}"
+        rendered = [v if self.numeric else sql_literal(v) for v in self.values]
+        if self.operator in ('IN', 'NOT IN'):
+            return f"{column} {self.operator} ({', '.join(rendered)})"
+        return f"{column} {self.operator} {rendered[0]}"
+
+
+@dataclass(frozen=True)
+class ChartSpec:
+    """
+    A validated time-series chart request
+
+    start is inclusive and end exclusive; either may be None. trailing is
+    (unit, count) relative to the warehouse's current_timestamp().
+    """
+    table: str
+    time_column: str
+    grain: str
+    metrics: tuple
+    filters: tuple = ()
+    trailing: tuple = None
+    start: datetime = None
+    end: datetime = None
+
+
+def interval_sql(unit, count):
+    """
+    INTERVAL literal for count units, e.g. ("week", 2) -> INTERVAL '14' DAY
+
+    Raises:
+        ValueError: If the unit is unknown or count is not a positive integer
+    """
+    if unit not in _INTERVAL_UNITS:
+        raise ValueError(f"Unknown interval unit '{unit}': expected one of {', '.join(GRAINS)}")
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        raise ValueError(f"Interval count must be an integer, got '{count}'")
+    if not 0 < count <= MAX_INTERVAL_COUNT:
+        raise ValueError(f"Interval count must be between 1 and {MAX_INTERVAL_COUNT}")
+    sql_unit, multiplier = _INTERVAL_UNITS[unit]
+    return f"INTERVAL '{count * multiplier}' {sql_unit}"
+
+
+def timestamp_sql(value):
+    """TIMESTAMP literal for a naive UTC datetime"""
+    return f"TIMESTAMP '{value.isoformat(sep=' ')}'"
+
+
+def parse_time_bound(value, end=False):
+    """
+    Parse an ISO date or timestamp from the client into a naive UTC datetime
+
+    A date-only end bound (YYYY-MM-DD) is moved to the following midnight so
+    the whole day is included.
+
+    Returns:
+        datetime or None: None for empty values
+
+    Raises:
+        ValueError: If the value is not ISO 8601
+    """
+    if value in (None, ''):
+        return None
+    text = str(value).strip()
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"Invalid date '{value}': expected ISO 8601")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if end and len(text) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def truncate_time(value, grain):
+    """
+    Start of the grain bucket containing value, matching DATE_TRUNC
+
+    Weeks start on Monday, as they do in Databricks SQL.
+    """
+    value = value.replace(minute=0, second=0, microsecond=0)
+    if grain == 'hour':
+        return value
+    value = value.replace(hour=0)
+    if grain == 'day':
+        return value
+    if grain == 'week':
+        return value - timedelta(days=value.weekday())
+    if grain == 'month':
+        return value.replace(day=1)
+    if grain == 'quarter':
+        return value.replace(month=(value.month - 1) // 3 * 3 + 1, day=1)
+    return value.replace(month=1, day=1)
+
+
+def is_bucket_aligned(window, grain):
+    """True if both ends of a [start, end) window fall on grain bucket starts"""
+    return all(value is not None and truncate_time(value, grain) == value for value in window)
+
+
+def cap_window(window, grain, max_buckets):
+    """
+    A bucket-aligned [start, end) window cut to its first max_buckets buckets
+    """
+    start, end = window
+    try:
+        capped = shift_time(start, grain, max_buckets)
+    except (OverflowError, ValueError):
+        # Past datetime.max, so the window is shorter than the cap anyway
+        return window
+    return start, min(end, capped)
+
+
+def _add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    year, month = divmod(index, 12)
+    # Clamp to the last day of the target month, as add_months() does
+    next_month = datetime(year + (month + 1) // 12, (month + 1) % 12 + 1, 1)
+    last_day = (next_month - timedelta(days=1)).day
+    return value.replace(year=year, month=month + 1, day=min(value.day, last_day))
+
+
+def shift_time(value, unit, count):
+    """value moved by count units (negative counts move back)"""
+    if unit == 'hour':
+        return value + timedelta(hours=count)
+    if unit == 'day':
+        return value + timedelta(days=count)
+    if unit == 'week':
+        return value + timedelta(weeks=count)
+    if unit == 'month':
+        return _add_months(value, count)
+    if unit == 'quarter':
+        return _add_months(value, 3 * count)
+    if unit == 'year':
+        return _add_months(value, 12 * count)
+    raise ValueError(f"Unknown interval unit '{unit}'")
+
+
+def resolve_window(spec, now):
+    """
+    Absolute [start, end) window for a spec
+
+    A trailing window is resolved against now and widened to whole grain
+    buckets, ending after the bucket that contains now; it is intersected
+    with any date range.
+
+    Args:
+        spec (ChartSpec): Validated spec
+        now (datetime): Current naive UTC time
+
+    Returns:
+        tuple: (start, end) - either may be None if the spec leaves it open
+    """
+    start, end = spec.start, spec.end
+    if spec.trailing:
+        trailing_end = shift_time(truncate_time(now, spec.grain), spec.grain, 1)
+        unit, count = spec.trailing
+        trailing_start = truncate_time(shift_time(trailing_end, unit, -count), spec.grain)
+        start = trailing_start if start is None else max(start, trailing_start)
+        end = trailing_end if end is None else min(end, trailing_end)
+    return start, end
+
+
+def column_lookup(columns):
+    """{lower-cased name: ColumnInfo} for case-insensitive resolution"""
+    return {column.name.lower(): column for column in columns}
+
+
+def resolve_column(lookup, name, what):
+    """
+    Find a requested column in the schema
+
+    Raises:
+        ValueError: If the table has no such column
+    """
+    column = lookup.get(str(name or '').lower())
+    if column is None:
+        raise ValueError(f"Unknown {what} column '{name}'")
+    return column
+
+
+def parse_metric(metric, lookup):
+    """Validate one {column, aggregation, name} metric into a Metric"""
+    aggregation = str(metric.get('aggregation') or 'sum').lower()
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation '{aggregation}': expected one of {', '.join(AGGREGATIONS)}")
+    name = metric.get('column')
+    if aggregation == 'count' and name in (None, '', '*'):
+        return Metric('*', 'count', metric.get('name') or 'count')
+    column = resolve_column(lookup, name, 'metric')
+    if aggregation in NUMERIC_AGGREGATIONS and column.role != 'metric':
+        raise ValueError(f"Cannot {aggregation.upper()} non-numeric column '{column.name}' ({column.type})")
+    return Metric(column.name, aggregation, metric.get('name') or f"{aggregation}_{column.name}")
+
+
+def parse_filter(item, lookup):
+    """Validate one {column, operator, value} filter into a Filter"""
+    column = resolve_column(lookup, item.get('column'), 'filter')
+    operator = ' '.join(str(item.get('operator') or '=').upper().split())
+    if operator not in FILTER_OPERATORS:
+        raise ValueError(f"Unknown filter operator '{item.get('operator')}'")
+    if operator in ('IS NULL', 'IS NOT NULL'):
+        return Filter(column.name, operator)
+
+    value = item.get('value')
+    if isinstance(value, (list, tuple)):
+        values = [str(v).strip() for v in value]
+    elif operator in ('IN', 'NOT IN'):
+        values = [v.strip() for v in str(value or '').split(',')]
+    else:
+        values = ['' if value is None else str(value).strip()]
+    values = [v for v in values if v != ''] if operator in ('IN', 'NOT IN') else values
+    if not values:
+        raise ValueError(f"Filter on '{column.name}' needs a value")
+
+    numeric = column.role == 'metric' and not operator.endswith('LIKE')
+    if numeric:
+        for v in values:
+            if not _NUMBER.match(v):
+                raise ValueError(f"Filter on numeric column '{column.name}' needs a number, got '{v}'")
+    return Filter(column.name, operator, tuple(values), numeric)
+
+
+def resolve_time_column(body, columns):
+    """
+    The request's time_column, or the table's first date/timestamp column
+
+    Returns:
+        ColumnInfo or None: None if none was requested and the table has none
+
+    Raises:
+        ValueError: If the requested column is unknown or not a time column
+    """
+    time_name = body.get('time_column') or body.get('timeColumn')
+    if not time_name:
+        return next((c for c in columns if c.role == 'time'), None)
+    time_column = resolve_column(column_lookup(columns), time_name, 'time')
+    if time_column.role != 'time':
+        raise ValueError(f"Time column '{time_column.name}' is not a date or timestamp ({time_column.type})")
+    return time_column
+
+
+def parse_time_window(body):
+    """
+    The request's trailing window and date range
+
+    Returns:
+        tuple: (trailing, start, end) - trailing is (unit, count) or None
+
+    Raises:
+        ValueError: If either is malformed
+    """
+    trailing = body.get('trailing')
+    if trailing:
+        if not isinstance(trailing, dict):
+            raise ValueError("trailing must be an object with unit and count")
+        interval_sql(trailing.get('unit'), trailing.get('count'))
+        trailing = (trailing['unit'], int(trailing['count']))
+
+    date_range = body.get('date_range') or body.get('dateRange') or {}
+    if not isinstance(date_range, dict):
+        raise ValueError("date_range must be an object with start and/or end")
+    start = parse_time_bound(date_range.get('start'))
+    end = parse_time_bound(date_range.get('end'), end=True)
+    if start is not None and end is not None and start >= end:
+        raise ValueError("date_range start must be before end")
+    return trailing or None, start, end
+
+
+def parse_chart_spec(body, columns):
+    """
+    Validate a chart request against the table's columns
+
+    Args:
+        body (dict): table, time_column (defaults to the first time column),
+            grain, metrics [{column, aggregation, name}], filters
+            [{column, operator, value}], trailing {unit, count} and
+            date_range {start, end} (dateRange is accepted too)
+        columns (list): schema.ColumnInfo records for the table
+
+    Returns:
+        ChartSpec: Validated spec with identifiers in their schema spelling
+
+    Raises:
+        ValueError: If any part of the request is invalid
+    """
+    table = body.get('table')
+    quote_table_name(table)
+    lookup = column_lookup(columns)
+
+    time_column = resolve_time_column(body, columns)
+    if time_column is None:
+        raise ValueError(f"Table '{table}' has no date or timestamp column")
+
+    grain = str(body.get('grain') or 'day').lower()
+    if grain not in GRAINS:
+        raise ValueError(f"Unknown grain '{grain}': expected one of {', '.join(GRAINS)}")
+
+    metrics = tuple(parse_metric(metric, lookup) for metric in body.get('metrics') or [])
+    if not metrics:
+        raise ValueError("At least one metric is required")
+    names = [metric.name for metric in metrics]
+    if len(set(names)) != len(names) or 'time' in names:
+        raise ValueError("Metric names must be unique and not 'time'")
+
+    filters = tuple(parse_filter(item, lookup) for item in body.get('filters') or [])
+
+    trailing, start, end = parse_time_window(body)
+
+    return ChartSpec(
+        table=table,
+        time_column=time_column.name,
+        grain=grain,
+        metrics=metrics,
+        filters=filters,
+        trailing=trailing,
+        start=start,
+        end=end,
+    )
+
+
+def range_condition(time_column, ranges):
+    """
+    SQL condition keeping rows inside any of the [start, end) ranges
+
+    Args:
+        time_column (str): Column name (unquoted)
+        ranges (list): (start, end) datetime pairs; None leaves a side open
+    """
+    column = quote_identifier(time_column)
+    parts = []
+    for start, end in ranges:
+        bounds = []
+        if start is not None:
+            bounds.append(f"{column} >= {timestamp_sql(start)}")
+        if end is not None:
+            bounds.append(f"{column} < {timestamp_sql(end)}")
+        parts.append(' AND '.join(bounds) or 'TRUE')
+    if len(parts) == 1:
+        return parts[0]
+    return '(' + ' OR '.join(f"({part})" for part in parts) + ')'
+
+
+def where_conditions(spec, ranges=None):
+    """
+    WHERE conditions for a spec's filters and time window
+
+    Args:
+        spec (ChartSpec): Validated spec
+        ranges (list): (start, end) pairs that replace the spec's own
+            trailing window and date range
+
+    Returns:
+        list: SQL conditions to be joined with AND
+    """
+    time_column = quote_identifier(spec.time_column)
+    conditions = [f"{time_column} IS NOT NULL"]
+    if ranges is not None:
+        conditions.append(range_condition(spec.time_column, ranges))
+    else:
+        if spec.trailing:
+            conditions.append(f"{time_column} >= current_timestamp() - {interval_sql(*spec.trailing)}")
+        if spec.start is not None or spec.end is not None:
+            conditions.append(range_condition(spec.time_column, [(spec.start, spec.end)]))
+    conditions.extend(f.to_sql() for f in spec.filters)
+    return conditions
+
+
+def bucket_sql(spec):
+    """DATE_TRUNC expression for the spec's grain"""
+    return f"DATE_TRUNC('{spec.grain.upper()}', {quote_identifier(spec.time_column)})"
+
+
+def partial_column(index, alias):
+    """Result column holding one partial of the index-th metric"""
+    return f"_m{index}{alias}"
+
+
+def build_series_query(spec, limit=None, ranges=None, partials=False):
+    """
+    Compile a spec into one aggregated time-series query
+
+    Args:
+        spec (ChartSpec): Validated spec
+        limit (int): Maximum buckets to return
+        ranges (list): (start, end) pairs to scan instead of the spec's window
+        partials (bool): Select each metric's partial_expressions() as
+            partial_column(index, alias) instead of its final value
+
+    Returns:
+        str: SQL returning a "time" bucket column plus one column per metric
+        (or partial), ordered by time
+    """
+    select = [f"{bucket_sql(spec)} AS `time`"]
+    for index, metric in enumerate(spec.metrics):
+        if partials:
+            select.extend(f"{sql} AS `{partial_column(index, alias)}`"
+                          for alias, sql in metric.partial_expressions())
+        else:
+            select.append(f"{metric.expression()} AS {quote_identifier(metric.name)}")
+    sql = (
+        f"SELECT {', '.join(select)}\n"
+        f"FROM {quote_table_name(spec.table)}\n"
+        f"WHERE {' AND '.join(where_conditions(spec, ranges))}\n"
+        "GROUP BY 1\n"
+        "ORDER BY 1"
+    )
+    if limit is not None:
+        sql += f"\nLIMIT {int(limit)}"
+    return sql
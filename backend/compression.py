@@ -0,0 +1,246 @@
+"""
+HTTP response compression
+Negotiates zstd, brotli or gzip from Accept-Encoding and compresses buffered
+and streamed API responses, picking the level from the payload size
+"""
+
+import os
+import threading
+import zlib
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # optional: brotli is skipped when not installed
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd is skipped when not installed
+    zstandard = None
+
+# Responses smaller than this are sent as is - headers and CPU cost more
+# than the bytes saved
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+# Server preference, best first; a client's q-values are honoured before it
+COMPRESSION_ENCODINGS = [
+    name.strip() for name in os.getenv('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',') if name.strip()
+]
+COMPRESSIBLE_MIMETYPES = (
+    'application/json',
+    'application/x-ndjson',
+    'application/vnd.apache.arrow.stream',
+    'text/',
+)
+
+# (payload bytes below which the level applies, {encoding: level}); bigger
+# payloads get cheaper levels so compression never dominates response time
+_LEVELS = (
+    (256 * 1024, {'gzip': 6, 'br': 5, 'zstd': 6}),
+    (4 * 1024 * 1024, {'gzip': 4, 'br': 4, 'zstd': 3}),
+    (None, {'gzip': 1, 'br': 1, 'zstd': 1}),
+)
+# Streams are compressed as they are produced, size unknown
+_STREAM_LEVELS = {'gzip': 4, 'br': 4, 'zstd': 3}
+
+_stats_lock = threading.Lock()
+_stats = {'compressed': 0, 'streamed': 0, 'skipped_small': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+
+def available_encodings():
+    """Configured encodings whose libraries are installed, best first"""
+    installed = {'gzip': True, 'br': brotli is not None, 'zstd': zstandard is not None}
+    return [name for name in COMPRESSION_ENCODINGS if installed.get(name)]
+
+
+def negotiate(accept_encoding, available=None):
+    """
+    Pick a content coding from an Accept-Encoding header
+
+    Args:
+        accept_encoding (str): Header value, e.g. "gzip, br;q=0.9, *;q=0"
+        available (list): Encodings to choose from, best first (default
+            available_encodings())
+
+    Returns:
+        str or None: Chosen encoding, or None to send the body as is
+    """
+    available = available_encodings() if available is None else available
+    weights = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        weights[name] = quality
+
+    best = None
+    for rank, name in enumerate(available):
+        quality = weights.get(name, weights.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[0]):
+            best = (quality, rank, name)
+    return best[2] if best else None
+
+
+def level_for(encoding, size):
+    """Compression level for a payload of size bytes (None: streamed)"""
+    if size is None:
+        return _STREAM_LEVELS[encoding]
+    for limit, levels in _LEVELS:
+        if limit is None or size < limit:
+            return levels[encoding]
+
+
+def compress(data, encoding, level=None):
+    """
+    Compress a whole payload
+
+    Returns:
+        bytes
+    """
+    level = level_for(encoding, len(data)) if level is None else level
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Unsupported encoding '{encoding}'")
+
+
+class StreamCompressor:
+    """
+    Incremental compressor for chunked responses
+
+    Each chunk is flushed so the client can decode it as soon as it
+    arrives - an NDJSON row or Arrow batch is not held back waiting for
+    the compressor's window to fill.
+
+    Args:
+        encoding (str): gzip, br or zstd
+        level (int): Compression level (default for streams)
+    """
+
+    def __init__(self, encoding, level=None):
+        level = level_for(encoding, None) if level is None else level
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        elif encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError(f"Unsupported encoding '{encoding}'")
+
+    def compress(self, chunk):
+        """Compress and flush one chunk"""
+        if self.encoding == 'gzip':
+            return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'br':
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        """Trailing bytes that end the compressed stream"""
+        if self.encoding == 'gzip':
+            return self._compressor.flush(zlib.Z_FINISH)
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def _compress_stream(chunks, compressor):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                with _stats_lock:
+                    _stats['bytes_in'] += len(chunk)
+                    _stats['bytes_out'] += len(data)
+                yield data
+        yield compressor.finish()
+    finally:
+        # Closing the wrapper (client went away) must still release whatever
+        # the inner generator holds, e.g. a pooled connection
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def _compressible(response):
+    mimetype = response.mimetype or ''
+    return any(mimetype.startswith(prefix) for prefix in COMPRESSIBLE_MIMETYPES)
+
+
+def compress_response(response, accept_encoding):
+    """
+    Compress a Flask response for the client's Accept-Encoding
+
+    Buffered bodies under COMPRESSION_MIN_BYTES and responses that are
+    already encoded, not successful or not JSON/NDJSON/Arrow/text are
+    returned unchanged. Streamed bodies are wrapped in a StreamCompressor.
+
+    Args:
+        response (flask.Response): Outgoing response
+        accept_encoding (str): The request's Accept-Encoding header
+
+    Returns:
+        flask.Response: The same response, possibly compressed
+    """
+    # Only whole 2xx bodies: 206 ranges are byte offsets into the unencoded body
+    if (not 200 <= response.status_code < 300 or response.status_code in (204, 206)
+            or 'Content-Encoding' in response.headers or not _compressible(response)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, StreamCompressor(encoding))
+        response.direct_passthrough = False
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        with _stats_lock:
+            _stats['streamed'] += 1
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_BYTES:
+        with _stats_lock:
+            _stats['skipped_small'] += 1
+        return response
+    with metrics.phase('compress'):
+        body = compress(data, encoding)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    with _stats_lock:
+        _stats['compressed'] += 1
+        _stats['bytes_in'] += len(data)
+        _stats['bytes_out'] += len(body)
+    return response
+
+
+def get_compression_stats():
+    """
+    Compression counters
+
+    Returns:
+        dict: responses compressed/streamed/skipped, bytes before and after
+        and the encodings on offer
+    """
+    with _stats_lock:
+        return {**_stats, 'encodings': available_encodings(), 'min_bytes': COMPRESSION_MIN_BYTES}
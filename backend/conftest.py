@@ -0,0 +1,51 @@
+"""
+Shared pytest fixtures for the offline backend tests
+Swaps the db.py connection pool for the in-memory fake warehouse in
+fake_warehouse.py, answering every query with warehouse.result
+"""
+
+import pytest
+
+import api
+import db
+from fake_warehouse import TRIPS_TABLE, FakeWarehouse
+from schema import make_column, table_key
+
+TRIPS_COLUMNS = [
+    ('tpep_pickup_datetime', 'timestamp'),
+    ('trip_distance', 'double'),
+    ('fare_amount', 'decimal(10,2)'),
+    ('pickup_zip', 'int'),
+    ('vendor', 'string'),
+]
+
+
+@pytest.fixture
+def warehouse(monkeypatch, tmp_path):
+    fake = FakeWarehouse(rows=100)
+    fake.result = (['id', 'name'], [(i, f"row-{i}") for i in range(25)])
+    monkeypatch.setattr(db, '_slow_queries', db.SlowQueryLog(str(tmp_path / 'slow_queries.db'), threshold_ms=0))
+    monkeypatch.setattr(db, '_pool', db.ConnectionPool(fake.connection_factory, max_size=2))
+    monkeypatch.setattr(db, 'STREAM_BATCH_SIZE', 10)
+    monkeypatch.setattr(db, '_result_cache', db.ResultCache(1024 * 1024))
+    monkeypatch.setattr(db, '_schema_cache', db.ResultCache(1024 * 1024))
+    monkeypatch.setattr(db, '_series_cache', db.SeriesCache(1024 * 1024))
+    monkeypatch.setattr(api, 'job_store', api.JobStore(max_workers=4, max_queued=8))
+    monkeypatch.setattr(api, 'admission', api.AdmissionController(max_concurrent=4))
+    monkeypatch.setattr(api, '_stream_cancellations', {'timed_out': 0, 'disconnected': 0})
+    monkeypatch.setattr(api, 'paged_results', api.PagedResultStore(db.open_result, max_open=1, fetch_size=10))
+    return fake
+
+
+@pytest.fixture
+def trips(warehouse):
+    """Seed the schema cache with the NYC taxi trips columns"""
+    columns = [make_column(name, data_type, position)
+               for position, (name, data_type) in enumerate(TRIPS_COLUMNS, start=1)]
+    db._schema_cache.put((db.SQL_WAREHOUSE_ID, table_key(TRIPS_TABLE)), columns, 1)
+    return columns
+
+
+@pytest.fixture
+def client():
+    return api.app.test_client()
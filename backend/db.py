@@ -4,10 +4,24 @@ Reusable module for database operations
 """
 
 import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import replace
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from databricks import sql
 from databricks.sdk.core import Config
 import pandas as pd
+import metrics
+from auth import TokenProvider, lifetime_from_expiry
+from cache import ResultCache, is_read_only, normalize_sql
+from singleflight import SingleFlight
+from jobs import QueryTimeout
+from slowlog import SlowQueryLog
+from schema import build_columns_query, parse_columns_rows, parse_describe_rows, table_key
+from charts import PARTIALS, build_series_query, partial_column, truncate_time
+from timeseries import FINER_GRAINS, SeriesCache, merge_intervals, naive_utc, rollup_buckets
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +31,120 @@ load_dotenv()
 DATABRICKS_PROFILE = os.getenv("DATABRICKS_PROFILE", "")  # Empty string means use default auth
 SQL_WAREHOUSE_ID = os.getenv("DATABRICKS_SQL_WAREHOUSE_ID", "")
 
+# Connection pool sizing - see get_pool_stats() / GET /api/pool when tuning.
+# The default is recommended_pool_size() for api.py's defaults: 8 admitted
+# queries (jobs and streams) and 4 open page cursors
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "0"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "14"))
+# Connections left for schema lookups, which run outside admission control
+POOL_SCHEMA_HEADROOM = 2
+POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "30"))
+POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "60"))
+
+# OAuth tokens handed out by the SDK are short lived; pooled connections are
+# recycled this many seconds before the token they were opened with expires
+TOKEN_LIFETIME = float(os.getenv("DATABRICKS_TOKEN_LIFETIME", "3600"))
+TOKEN_REFRESH_MARGIN = float(os.getenv("DATABRICKS_TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_BACKGROUND_REFRESH = os.getenv("DATABRICKS_TOKEN_BACKGROUND_REFRESH", "true").lower() == "true"
+
+# Rows pulled per cursor.fetchmany() call when streaming results
+STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", "1000"))
+
+# Query result cache - Arrow tables keyed by normalized SQL + warehouse
+# Set RESULT_CACHE_TTL=0 to disable
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+
+# Parsed table schemas - invalidate with DELETE /api/schema/<table>
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "600"))
+SCHEMA_CACHE_MAX_BYTES = int(os.getenv("SCHEMA_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Per-bucket time-series aggregates - closed buckets live for SERIES_CACHE_TTL,
+# the bucket containing now for SERIES_OPEN_BUCKET_TTL
+SERIES_CACHE_MAX_BYTES = int(os.getenv("SERIES_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SERIES_CACHE_TTL = float(os.getenv("SERIES_CACHE_TTL", "3600"))
+SERIES_OPEN_BUCKET_TTL = float(os.getenv("SERIES_OPEN_BUCKET_TTL", "60"))
+
+# Identical concurrent queries share one warehouse execution
+SINGLEFLIGHT_MAX_WAITERS = int(os.getenv("SINGLEFLIGHT_MAX_WAITERS", "64"))
+SINGLEFLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", "600"))
+
+# Slow-query log (see slowlog.py): queries at least SLOW_QUERY_THRESHOLD_MS
+# long are appended to a local SQLite file, rotated at SLOW_QUERY_LOG_MAX_BYTES
+SLOW_QUERY_LOG_PATH = os.getenv(
+    "SLOW_QUERY_LOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "slow_queries.db")
+)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "250"))
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(16 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "2"))
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_databricks_config():
+    """
+    Get the Databricks SDK config, created once per process
+    
+    Uses profile-based auth for local dev, service principal for deployed apps.
+    
+    Returns:
+        databricks.sdk.core.Config: Shared config object
+    """
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                # Initialize config - will use profile for local dev, service principal when deployed
+                if DATABRICKS_PROFILE:
+                    # Local development: use profile from .env
+                    _config = Config(profile=DATABRICKS_PROFILE)
+                else:
+                    # Deployed in Databricks Apps: use default auth (service principal)
+                    _config = Config()
+    return _config
+
+
+def _fetch_token():
+    """
+    Fetch a fresh bearer token from the SDK config
+    
+    Returns:
+        tuple: (token, lifetime_seconds) - lifetime is None for non-OAuth auth
+    """
+    cfg = get_databricks_config()
+    
+    # cfg.authenticate() returns {'Authorization': 'Bearer <token>'}
+    with metrics.phase('auth'):
+        auth_dict = cfg.authenticate()
+    token = auth_dict.get('Authorization', '').replace('Bearer ', '')
+    
+    # OAuth credentials (profile login and service principal) report an expiry
+    try:
+        lifetime = lifetime_from_expiry(cfg.oauth_token().expiry)
+    except Exception:
+        lifetime = None
+    return token, lifetime
+
+
+_token_provider = TokenProvider(
+    _fetch_token,
+    refresh_margin=TOKEN_REFRESH_MARGIN,
+    default_lifetime=TOKEN_LIFETIME,
+    background=TOKEN_BACKGROUND_REFRESH,
+)
+
+
+def get_token_stats():
+    """
+    Get auth token cache statistics
+
+    Returns:
+        dict: Token fetches, cache hits, failures and seconds until expiry
+    """
+    return _token_provider.stats()
+
 
 def get_databricks_connection():
     """
@@ -35,30 +163,17 @@ def get_databricks_connection():
         if not warehouse_id:
             return None, "Please set DATABRICKS_SQL_WAREHOUSE_ID environment variable"
         
-        # Initialize config - will use profile for local dev, service principal when deployed
-        if DATABRICKS_PROFILE:
-            # Local development: use profile from .env
-            cfg = Config(profile=DATABRICKS_PROFILE)
-        else:
-            # Deployed in Databricks Apps: use default auth (service principal)
-            cfg = Config()
-        
-        # Get the OAuth token from the config
-        # cfg.authenticate() returns {'Authorization': 'Bearer <token>'}
-        auth_dict = cfg.authenticate()
-        
-        # Extract the Bearer token from the Authorization header
-        token = auth_dict.get('Authorization', '').replace('Bearer ', '')
-        
-        if not token:
-            return None, "Could not get authentication token"
+        # Cached token - only hits the OAuth endpoint when close to expiry
+        token = _token_provider.get_token()
+        cfg = get_databricks_config()
         
         # Create SQL connection using the access token
-        connection = sql.connect(
-            server_hostname=cfg.host.replace("https://", ""),
-            http_path=f"/sql/1.0/warehouses/{warehouse_id}",
-            access_token=token
-        )
+        with metrics.phase('connect'):
+            connection = sql.connect(
+                server_hostname=cfg.host.replace("https://", ""),
+                http_path=f"/sql/1.0/warehouses/{warehouse_id}",
+                access_token=token
+            )
         
         return connection, None
     except Exception as e:
@@ -66,48 +181,1106 @@ def get_databricks_connection():
         return None, f"Connection failed: {str(e)}. {env_hint}"
 
 
-def execute_query(query, return_dict=False):
+class _PooledConnection:
+    """Bookkeeping for a connection owned by the pool"""
+
+    def __init__(self, connection, expires_at):
+        now = time.monotonic()
+        self.connection = connection
+        self.created_at = now
+        self.last_used_at = now
+        self.expires_at = expires_at
+        self.suspect = False
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of Databricks SQL connections
+
+    Connections are opened lazily up to max_size and handed back to the pool
+    after each query instead of being closed. On borrow a connection is
+    discarded if it was idle for longer than idle_timeout, if the token it was
+    opened with is about to expire, or if it fails a health check.
+
+    Args:
+        connect (callable): Returns (connection, error_message) like
+            get_databricks_connection()
+        min_size (int): Connections kept open even when idle
+        max_size (int): Hard cap on open connections
+        idle_timeout (float): Seconds before an idle connection is closed
+        acquire_timeout (float): Seconds to wait for a free connection
+        health_check_interval (float): Idle seconds after which a borrowed
+            connection is pinged with SELECT 1 before use
+        token_lifetime (float): Seconds a connection's token stays valid
+        refresh_margin (float): Recycle connections this long before expiry
+        token_expiry (callable): Returns the monotonic expiry time of the
+            token new connections are opened with; overrides token_lifetime
+    """
+
+    def __init__(self, connect, min_size=0, max_size=8, idle_timeout=300,
+                 acquire_timeout=30, health_check_interval=60,
+                 token_lifetime=3600, refresh_margin=300, token_expiry=None):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self._connect = connect
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.token_lifetime = token_lifetime
+        self.refresh_margin = refresh_margin
+        self._token_expiry = token_expiry
+
+        self._lock = threading.Condition()
+        self._idle = []  # LIFO stack so hot connections stay hot
+        self._in_use = 0
+        self._opening = 0
+        self._closed = False
+        self._stats = {
+            'opened': 0,
+            'closed': 0,
+            'borrowed': 0,
+            'reused': 0,
+            'recycled': 0,
+            'expired_idle': 0,
+            'health_check_failures': 0,
+            'waits': 0,
+            'wait_timeouts': 0,
+            'peak_in_use': 0,
+        }
+
+    def _open(self):
+        connection, error = self._connect()
+        if error:
+            raise Exception(f"Connection Error: {error}")
+        if self._token_expiry is not None:
+            expires_at = self._token_expiry()
+        else:
+            expires_at = time.monotonic() + self.token_lifetime
+        return _PooledConnection(connection, expires_at)
+
+    def _close_entry(self, entry):
+        try:
+            entry.connection.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._stats['closed'] += 1
+
+    def _is_healthy(self, entry, now):
+        if not getattr(entry.connection, 'open', True):
+            return False
+        if not entry.suspect and now - entry.last_used_at < self.health_check_interval:
+            return True
+        try:
+            cursor = entry.connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            entry.suspect = False
+            return True
+        except Exception:
+            return False
+
+    def _reap_idle(self, now):
+        """Pop idle connections past idle_timeout (caller holds the lock)"""
+        stale = []
+        keep = []
+        total = len(self._idle) + self._in_use
+        # Oldest connections sit at the bottom of the stack
+        for entry in self._idle:
+            if (now - entry.last_used_at > self.idle_timeout
+                    and total - len(stale) > self.min_size):
+                stale.append(entry)
+            else:
+                keep.append(entry)
+        self._idle = keep
+        self._stats['expired_idle'] += len(stale)
+        return stale
+
+    def acquire(self, timeout=None):
+        """
+        Borrow a connection from the pool
+
+        Args:
+            timeout (float): Seconds to wait for a free slot (defaults to
+                acquire_timeout)
+
+        Returns:
+            _PooledConnection: Entry to hand back with release()
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            to_close = []
+            entry = None
+            open_new = False
+            with self._lock:
+                if self._closed:
+                    raise Exception("Connection Error: connection pool is closed")
+                now = time.monotonic()
+                to_close.extend(self._reap_idle(now))
+                if self._idle:
+                    entry = self._idle.pop()
+                    self._in_use += 1
+                elif self._in_use + len(self._idle) + self._opening < self.max_size:
+                    self._opening += 1
+                    open_new = True
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['wait_timeouts'] += 1
+                        raise Exception(
+                            f"Connection Error: timed out after {timeout:.1f}s waiting "
+                            f"for a pooled connection (max_size={self.max_size})"
+                        )
+                    self._stats['waits'] += 1
+                    self._lock.wait(remaining)
+                    continue
+
+            for stale in to_close:
+                self._close_entry(stale)
+
+            if open_new:
+                try:
+                    entry = self._open()
+                except Exception:
+                    with self._lock:
+                        self._opening -= 1
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self._opening -= 1
+                    self._in_use += 1
+                    self._stats['opened'] += 1
+                    self._stats['borrowed'] += 1
+                    self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._in_use)
+                return entry
+
+            now = time.monotonic()
+            if entry.expires_at - now <= self.refresh_margin:
+                self._discard(entry, 'recycled')
+                continue
+            if not self._is_healthy(entry, now):
+                self._discard(entry, 'health_check_failures')
+                continue
+
+            with self._lock:
+                self._stats['borrowed'] += 1
+                self._stats['reused'] += 1
+                self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._in_use)
+            return entry
+
+    def _discard(self, entry, reason):
+        with self._lock:
+            self._in_use -= 1
+            self._stats[reason] += 1
+            self._lock.notify()
+        self._close_entry(entry)
+
+    def release(self, entry, discard=False):
+        """
+        Hand a borrowed connection back to the pool
+
+        Args:
+            entry (_PooledConnection): Entry returned by acquire()
+            discard (bool): Close the connection instead of reusing it
+        """
+        entry.last_used_at = time.monotonic()
+        with self._lock:
+            self._in_use -= 1
+            reuse = not discard and not self._closed and getattr(entry.connection, 'open', True)
+            if reuse:
+                self._idle.append(entry)
+            self._lock.notify()
+        if not reuse:
+            self._close_entry(entry)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Borrow a connection for the duration of a with-block
+
+        If the block raises, the connection is returned but flagged so it is
+        health-checked before its next use.
+        """
+        # Includes opening a connection (see the "connect" phase) when none is idle
+        with metrics.phase('acquire'):
+            entry = self.acquire(timeout)
+        try:
+            yield entry.connection
+        except BaseException:
+            entry.suspect = True
+            self.release(entry)
+            raise
+        else:
+            self.release(entry)
+
+    def warm(self):
+        """Open connections until the pool holds min_size"""
+        with self._lock:
+            if self._closed:
+                return
+            size = len(self._idle) + self._in_use + self._opening
+            needed = max(min(self.min_size, self.max_size) - size, 0)
+            # Reserve the slots so concurrent borrows can't overshoot max_size
+            self._opening += needed
+        for opened in range(needed):
+            try:
+                entry = self._open()
+            except Exception:
+                with self._lock:
+                    self._opening -= needed - opened
+                    self._lock.notify_all()
+                raise
+            with self._lock:
+                self._opening -= 1
+                self._stats['opened'] += 1
+                self._idle.insert(0, entry)
+                self._lock.notify()
+
+    def stats(self):
+        """
+        Snapshot of pool counters
+
+        Returns:
+            dict: Sizes, configuration and cumulative counters
+        """
+        with self._lock:
+            return {
+                'size': len(self._idle) + self._in_use,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                **self._stats,
+            }
+
+    def close(self):
+        """Close all idle connections and refuse new borrows"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._lock.notify_all()
+        for entry in idle:
+            self._close_entry(entry)
+
+
+_pool = ConnectionPool(
+    get_databricks_connection,
+    min_size=POOL_MIN_SIZE,
+    max_size=POOL_MAX_SIZE,
+    idle_timeout=POOL_IDLE_TIMEOUT,
+    acquire_timeout=POOL_ACQUIRE_TIMEOUT,
+    health_check_interval=POOL_HEALTH_CHECK_INTERVAL,
+    token_lifetime=TOKEN_LIFETIME,
+    refresh_margin=TOKEN_REFRESH_MARGIN,
+    token_expiry=lambda: _token_provider.expires_at,
+)
+
+
+def recommended_pool_size(admitted, open_cursors):
+    """
+    Smallest DB_POOL_MAX_SIZE that never makes a query wait for a connection
+    
+    Args:
+        admitted (int): Warehouse queries admitted at once (ADMISSION_MAX_CONCURRENT)
+        open_cursors (int): Paged results allowed to keep a cursor open
+        
+    Returns:
+        int: admitted + open_cursors + POOL_SCHEMA_HEADROOM
+    """
+    return admitted + open_cursors + POOL_SCHEMA_HEADROOM
+
+
+def get_connection(timeout=None):
+    """
+    Borrow a pooled Databricks SQL connection
+
+    Usage:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+
+    Args:
+        timeout (float): Seconds to wait for a free connection
+
+    Returns:
+        context manager yielding a SQL connection
+    """
+    return _pool.connection(timeout)
+
+
+def get_pool_stats():
+    """
+    Get connection pool statistics
+
+    Returns:
+        dict: Pool sizes and counters (see ConnectionPool.stats)
+    """
+    return _pool.stats()
+
+
+def warm_pool():
+    """Open DB_POOL_MIN_SIZE connections ahead of the first request"""
+    _pool.warm()
+
+
+def close_pool():
+    """Close all pooled connections (call on shutdown)"""
+    _pool.close()
+    _token_provider.stop()
+
+
+def execute_query(query, return_dict=False, return_arrow=False):
     """
     Execute a SQL query and return results
     
     Args:
         query (str): SQL query to execute
         return_dict (bool): If True, return dict format. If False, return DataFrame
+        return_arrow (bool): If True, return a pyarrow.Table straight from the
+            connector (no per-cell Python objects). Takes precedence over return_dict
         
     Returns:
-        pandas.DataFrame or dict or None: Query results or None on error
+        pandas.DataFrame or dict or pyarrow.Table: Query results
+    """
+    if return_arrow:
+        return _execute_arrow(query)
+
+    # Borrow a pooled connection (raises "Connection Error: ..." on failure)
+    with get_connection() as connection:
+        try:
+            cursor = connection.cursor()
+            try:
+                with _slow_queries.track(query, cursor) as logged:
+                    with metrics.phase('execute'):
+                        cursor.execute(query)
+
+                    # Fetch results
+                    columns = [desc[0] for desc in cursor.description]
+                    with metrics.phase('fetch'):
+                        rows = cursor.fetchall()
+                    logged.add(len(rows))
+            finally:
+                cursor.close()
+        except Exception as e:
+            raise Exception(f"Query Error: {str(e)}")
+    metrics.record_result('fetch', rows=len(rows))
+
+    # Convert to DataFrame
+    with metrics.phase('convert'):
+        df = pd.DataFrame(rows, columns=columns)
+        if return_dict:
+            return df.to_dict(orient='records')
+    return df
+
+
+def _to_float(value):
+    return float(value)
+
+
+def _to_iso(value):
+    return value.isoformat()
+
+
+# Per-column converters for JSON, keyed by the connector's type_code
+COLUMN_CONVERTERS = {
+    'decimal': _to_float,
+    'date': _to_iso,
+    'timestamp': _to_iso,
+    'timestamp_ntz': _to_iso,
+}
+
+
+def _require_pyarrow():
+    """Import pyarrow, which is only needed for the Arrow result path"""
+    try:
+        import pyarrow
+    except ImportError:
+        raise Exception("Arrow results require pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def _execute_arrow(query, on_cursor=None):
     """
-    # Create fresh connection for each query
-    connection, error = get_databricks_connection()
+    Execute a SQL query and return a pyarrow.Table via fetchall_arrow()
     
-    if error:
-        raise Exception(f"Connection Error: {error}")
+    on_cursor, if given, is called with the live cursor before execution so
+    the caller can cancel it from another thread. If it returns False the
+    caller has already stopped and the query is not run at all: cancelling a
+    cursor that has not executed anything does nothing.
+    """
+    _require_pyarrow()
+    with get_connection() as connection:
+        try:
+            cursor = connection.cursor()
+            try:
+                if on_cursor is not None and on_cursor(cursor) is False:
+                    raise Exception("Query was cancelled before it started")
+                with _slow_queries.track(query, cursor) as logged:
+                    with metrics.phase('execute'):
+                        cursor.execute(query)
+                    with metrics.phase('fetch'):
+                        table = cursor.fetchall_arrow()
+                    logged.add(table.num_rows, table.nbytes)
+                metrics.record_result('fetch', rows=table.num_rows, nbytes=table.nbytes)
+                return table
+            finally:
+                cursor.close()
+        except Exception as e:
+            raise Exception(f"Query Error: {str(e)}")
+
+
+_slow_queries = SlowQueryLog(
+    SLOW_QUERY_LOG_PATH,
+    threshold_ms=SLOW_QUERY_THRESHOLD_MS,
+    max_bytes=SLOW_QUERY_LOG_MAX_BYTES,
+    backups=SLOW_QUERY_LOG_BACKUPS,
+)
+
+
+def get_slow_queries(limit=20, order='total', since=None):
+    """
+    Most expensive logged query fingerprints (see SlowQueryLog.report)
     
-    try:
-        cursor = connection.cursor()
-        cursor.execute(query)
+    Args:
+        limit (int): Fingerprints to return
+        order (str): "total", "p95", "count" or "max"
+        since (float): Only queries logged in the last since seconds
         
-        # Fetch results
-        columns = [desc[0] for desc in cursor.description]
-        rows = cursor.fetchall()
+    Returns:
+        list: Per-fingerprint summaries
+    """
+    return _slow_queries.report(limit=limit, order=order, since=since)
+
+
+def get_slow_query_stats():
+    """
+    Get slow-query log statistics
+    
+    Returns:
+        dict: Recorded/written/dropped counts, threshold and size on disk
+    """
+    return _slow_queries.stats()
+
+
+_result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, default_ttl=RESULT_CACHE_TTL)
+
+
+def query_cache_key(query):
+    """Cache key for a query: (warehouse id, normalized SQL)"""
+    return (SQL_WAREHOUSE_ID, normalize_sql(query))
+
+
+_flights = SingleFlight(max_waiters=SINGLEFLIGHT_MAX_WAITERS)
+
+
+def fetch_arrow_cached(query, bypass=False, ttl=None, timeout=None, attach_cancel=None, store=True):
+    """
+    Execute a SQL query through the result cache
+    
+    Results are cached as pyarrow.Tables, which are compact and report their
+    exact size for the cache's byte budget. On a miss, concurrent requests
+    for the same normalized SQL wait on a single warehouse execution.
+    Statements that are not read-only (see cache.is_read_only) skip both and
+    run every time.
+    
+    Args:
+        query (str): SQL query to execute
+        bypass (bool): Skip the lookup and refresh the cached entry
+        ttl (float): Seconds to cache this result (default RESULT_CACHE_TTL)
+        timeout (float): Seconds to wait for the result (default
+            SINGLEFLIGHT_WAIT_TIMEOUT); the query keeps running for others
+        attach_cancel (callable): Receives a function that cancels the
+            warehouse query. It does nothing and returns False while other
+            requests are waiting on the same query, or if this call joined
+            another request's query. attach_cancel returning False means the
+            caller has already stopped, so the query is not started
+        store (bool): Cache the result (False for one-off queries whose
+            results are kept elsewhere)
         
-        cursor.close()
-        connection.close()
+    Returns:
+        tuple: (pyarrow.Table, cache_status) - status is "HIT", "MISS",
+        "BYPASS" (also for statements that are never cached) or "SHARED"
+        (joined an identical in-flight query)
+    
+    Raises:
+        singleflight.TooManyWaiters: Too many requests already waiting on this query
+        singleflight.WaitTimeout: timeout passed before the query finished
+    """
+    if not is_read_only(query):
+        # Writes must reach the warehouse every time: no cache, no coalescing
+        wire_cancel = (lambda cursor: attach_cancel(cursor.cancel)) if attach_cancel else None
+        return _execute_arrow(query, wire_cancel), 'BYPASS'
+    
+    key = query_cache_key(query)
+    if bypass:
+        _result_cache.record_bypass()
+        status = 'BYPASS'
+    else:
+        table = _result_cache.get(key)
+        if table is not None:
+            return table, 'HIT'
+        status = 'MISS'
+
+    def on_cursor(cursor):
+        def cancel():
+            if _flights.waiters(key) > 1:
+                return False
+            cursor.cancel()
+            return True
+        return attach_cancel(cancel)
+
+    def run():
+        if attach_cancel is not None:
+            # This call executes the query; on_cursor() wires up the real cancel
+            attach_cancel(lambda: True)
+        table = _execute_arrow(query, on_cursor if attach_cancel else None)
+        # Cache before the flight ends so late arrivals hit the cache
+        if store:
+            _result_cache.put(key, table, table.nbytes, ttl)
+        return table
+
+    timeout = SINGLEFLIGHT_WAIT_TIMEOUT if timeout is None else timeout
+    if attach_cancel is not None:
+        # Until run() says otherwise, this call is waiting on someone else's query
+        attach_cancel(lambda: False)
+    table, shared = _flights.do(key, run, timeout=timeout)
+    return table, 'SHARED' if shared else status
+
+
+def get_singleflight_stats():
+    """
+    Get in-flight query coalescing statistics
+    
+    Returns:
+        dict: In-flight queries, waiters, shared/rejected/detached counters
+    """
+    return _flights.stats()
+
+
+def get_cache_stats():
+    """
+    Get result cache statistics
+    
+    Returns:
+        dict: Entry count, bytes used and hit/miss/eviction counters
+    """
+    return _result_cache.stats()
+
+
+def clear_result_cache():
+    """
+    Drop all cached query results and time-series buckets
+    
+    Returns:
+        int: Number of entries removed
+    """
+    return _result_cache.invalidate() + _series_cache.invalidate()
+
+
+_ARROW_TYPE_NAMES = {
+    'int8': 'tinyint',
+    'int16': 'smallint',
+    'int32': 'int',
+    'int64': 'bigint',
+    'float': 'float',
+    'double': 'double',
+    'bool': 'boolean',
+    'string': 'string',
+    'large_string': 'string',
+    'binary': 'binary',
+    'date32[day]': 'date',
+}
+
+
+def _arrow_type_name(arrow_type):
+    """SQL-style type name for an Arrow type, matching cursor.description"""
+    import pyarrow as pa
+    if pa.types.is_decimal(arrow_type):
+        return 'decimal'
+    if pa.types.is_timestamp(arrow_type):
+        return 'timestamp'
+    return _ARROW_TYPE_NAMES.get(str(arrow_type), str(arrow_type))
+
+
+def arrow_to_records(table):
+    """
+    Convert a pyarrow.Table to a list of row dicts (the /api/query records format)
+    
+    Returns:
+        list: One dict per row
+    """
+    with metrics.phase('convert'):
+        return table.to_pylist()
+
+
+def arrow_to_columnar(table):
+    """
+    Convert a pyarrow.Table to the columnar JSON layout
+    
+    Decimals are cast to float64 in Arrow; dates and timestamps go through
+    COLUMN_CONVERTERS, looked up once per column rather than per cell.
+    
+    Returns:
+        dict: {"columns": [...], "types": [...], "data": [[col values], ...],
+        "row_count": int}
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    types = [_arrow_type_name(field.type) for field in table.schema]
+    data = []
+    with metrics.phase('convert'):
+        for column, type_name in zip(table.columns, types):
+            if type_name == 'decimal':
+                data.append(pc.cast(column, pa.float64()).to_pylist())
+                continue
+            converter = COLUMN_CONVERTERS.get(type_name)
+            values = column.to_pylist()
+            if converter is not None:
+                values = [None if v is None else converter(v) for v in values]
+            data.append(values)
+
+    return {
+        'columns': table.column_names,
+        'types': types,
+        'data': data,
+        'row_count': table.num_rows,
+    }
+
+
+_series_cache = SeriesCache(
+    SERIES_CACHE_MAX_BYTES,
+    ttl=SERIES_CACHE_TTL,
+    open_ttl=SERIES_OPEN_BUCKET_TTL
+)
+
+
+def series_key(spec, metric):
+    """Series cache key: one metric of a chart spec, independent of time range"""
+    return (
+        SQL_WAREHOUSE_ID, table_key(spec.table), spec.time_column.lower(), spec.grain,
+        metric.column, metric.aggregation, tuple(f.to_sql() for f in spec.filters),
+    )
+
+
+def _rollup_series(spec, metric, ranges, now):
+    """
+    Derive a decomposable metric's buckets from a finer grain already cached
+    
+    Returns:
+        dict or None: {bucket time: partials} covering ranges at the spec's
+        grain, or None if no finer series covers all of ranges
+    """
+    merges = [merge for _, _, merge in PARTIALS[metric.aggregation]]
+    for grain in FINER_GRAINS.get(spec.grain, ()):
+        fine, gaps = _series_cache.lookup(series_key(replace(spec, grain=grain), metric), ranges)
+        if gaps:
+            continue
+        rolled = rollup_buckets(fine, spec.grain, merges)
+        _series_cache.store(series_key(spec, metric), ranges, rolled,
+                            truncate_time(now, spec.grain), rolled_up=True)
+        return rolled
+    return None
+
+
+def fetch_series(spec, ranges, now=None, bypass=False, timeout=None, attach_cancel=None):
+    """
+    Get a chart spec's bucketed series, querying only ranges not yet cached
+    
+    Each metric's buckets are cached per series (see timeseries.SeriesCache)
+    as partial aggregates (charts.PARTIALS), e.g. sum and count for AVG.
+    Ranges a decomposable metric is missing at this grain are first rolled
+    up from a finer grain that covers them, so switching a chart from day to
+    month needs no query. Whatever is still missing for any metric is
+    fetched together in one query and merged in, so widening "last 30 days"
+    to "last 45 days" only scans the 15 new days. Metrics without partials
+    (COUNT DISTINCT) always come from their own grain or the warehouse.
+    
+    Args:
+        spec (charts.ChartSpec): Validated spec
+        ranges (list): Bucket-aligned [start, end) datetime pairs
+        now (datetime): Naive UTC time deciding which bucket is still open
+        bypass (bool): Ignore cached buckets and refetch every range
+        timeout (float): As for fetch_arrow_cached()
+        attach_cancel (callable): As for fetch_arrow_cached()
         
-        # Convert to DataFrame
-        df = pd.DataFrame(rows, columns=columns)
+    Returns:
+        tuple: (pyarrow.Table, cache_status, sql) - time plus one column per
+        metric; status is HIT, ROLLUP (answered from cache with at least one
+        metric rolled up), PARTIAL, MISS or BYPASS; sql is the query that
+        ran, or None when nothing was fetched
+    """
+    pa = _require_pyarrow()
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    ranges = merge_intervals(ranges)
+    keys = [series_key(spec, metric) for metric in spec.metrics]
+
+    values = []
+    missing = []
+    rolled_up = False
+    for key, metric in zip(keys, spec.metrics):
+        if bypass:
+            values.append({})
+            missing.extend(ranges)
+            continue
+        known, gaps = _series_cache.lookup(key, ranges)
+        if gaps and metric.decomposable:
+            rolled = _rollup_series(spec, metric, gaps, now)
+            if rolled is not None:
+                known.update(rolled)
+                gaps = []
+                rolled_up = True
+        values.append(known)
+        missing.extend(gaps)
+    missing = merge_intervals(missing)
+
+    sql = None
+    if missing:
+        sql = build_series_query(spec, ranges=missing, partials=True)
+        table, _ = fetch_arrow_cached(sql, timeout=timeout, attach_cancel=attach_cancel, store=False)
+        times = [naive_utc(t) for t in table.column('time').to_pylist()]
+        open_from = truncate_time(now, spec.grain)
+        for index, (key, known, metric) in enumerate(zip(keys, values, spec.metrics)):
+            partials = zip(*(table.column(partial_column(index, alias)).to_pylist()
+                             for alias, _ in metric.partial_expressions()))
+            fetched = dict(zip(times, partials))
+            _series_cache.store(key, missing, fetched, open_from)
+            known.update((t, v) for t, v in fetched.items()
+                         if any(start <= t < end for start, end in missing))
+
+    if bypass:
+        status = 'BYPASS'
+    elif not missing:
+        status = 'ROLLUP' if rolled_up else 'HIT'
+    elif missing == ranges:
+        status = 'MISS'
+    else:
+        status = 'PARTIAL'
+
+    buckets = sorted({t for known in values for t in known})
+    columns = {'time': pa.array(buckets, pa.timestamp('us'))}
+    for known, metric in zip(values, spec.metrics):
+        columns[metric.name] = [metric.final_value(known[t]) if t in known else None for t in buckets]
+    return pa.table(columns), status, sql
+
+
+def get_series_cache_stats():
+    """
+    Get time-series bucket cache statistics
+    
+    Returns:
+        dict: Series held, bytes used and full/partial hit counters
+    """
+    return _series_cache.stats()
+
+
+def get_cached_result(query):
+    """
+    Look up a query's cached pyarrow.Table without executing anything
+    
+    Returns:
+        pyarrow.Table or None
+    """
+    return _result_cache.get(query_cache_key(query))
+
+
+def is_result_cached(query):
+    """True if a query's result is cached; not counted as a cache hit or miss"""
+    return _result_cache.contains(query_cache_key(query))
+
+
+class OpenResult:
+    """
+    A query whose cursor stays open so rows can be fetched on demand
+    
+    Holds a pooled connection until close() is called - callers must close it.
+    
+    Args:
+        query (str): SQL query to execute
+        timeout (float): Seconds execute() may take; past it the cursor is
+            cancelled and QueryTimeout raised
+        on_cursor (callable): As for stream_query()
+    """
+
+    def __init__(self, query, timeout=None, on_cursor=None):
+        _require_pyarrow()
+        with metrics.phase('acquire'):
+            self._entry = _pool.acquire()
+        self._cursor = None
+        self._logged = None
+        timer = None
+        timed_out = threading.Event()
+        try:
+            cursor = self._cursor = self._entry.connection.cursor()
+            # Timed until close(), as the rows are read page by page
+            self._logged = _slow_queries.start(query, cursor)
+            if on_cursor is not None and on_cursor(cursor) is False:
+                raise Exception("Query was cancelled before it started")
+            if timeout:
+                def expire():
+                    timed_out.set()
+                    cursor.cancel()
+                timer = threading.Timer(timeout, expire)
+                timer.daemon = True
+                timer.start()
+            with metrics.phase('execute'):
+                cursor.execute(query)
+        except Exception as e:
+            self.close(failed=True)
+            if timed_out.is_set():
+                raise QueryTimeout(f"Query exceeded its {timeout:g}s timeout and was cancelled")
+            raise Exception(f"Query Error: {str(e)}")
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def fetch(self, size):
+        """
+        Fetch up to size more rows
         
-        if return_dict:
-            return df.to_dict(orient='records')
-        return df
+        Returns:
+            pyarrow.Table: Empty once the result is exhausted
+        """
+        try:
+            with metrics.phase('fetch'):
+                table = self._cursor.fetchmany_arrow(size)
+        except Exception as e:
+            raise Exception(f"Query Error: {str(e)}")
+        self._logged.add(table.num_rows, table.nbytes)
+        return table
+
+    def close(self, failed=False):
+        """Cancel any unread rows and return the connection to the pool"""
+        if self._entry is None:
+            return
+        entry, self._entry = self._entry, None
+        if self._logged is not None:
+            self._logged.finish('error' if failed else 'ok')
+        if self._cursor is not None:
+            try:
+                if failed:
+                    self._cursor.cancel()
+                self._cursor.close()
+            except Exception:
+                failed = True
+        entry.suspect = failed
+        _pool.release(entry)
+
+
+def open_result(query, timeout=None, on_cursor=None):
+    """
+    Execute a query and keep its cursor open for incremental fetching
+    
+    Args:
+        query (str): SQL query to execute
+        timeout (float): Seconds the execute may take
+        on_cursor (callable): As for stream_query()
+    
+    Returns:
+        OpenResult: Call fetch() for rows and close() when done
+    """
+    return OpenResult(query, timeout=timeout, on_cursor=on_cursor)
+
+
+def stream_query(query, batch_size=None, arrow=False, timeout=None, on_cursor=None):
+    """
+    Execute a SQL query and yield results batch by batch
+    
+    Rows are pulled with cursor.fetchmany() so the caller can write them out
+    before the full result has arrived. The pooled connection is held until
+    the generator is exhausted or closed; closing it early cancels the query.
+    
+    Args:
+        query (str): SQL query to execute
+        batch_size (int): Rows per fetchmany() call (default DB_STREAM_BATCH_SIZE)
+        arrow (bool): Fetch with fetchmany_arrow() and yield pyarrow.Tables
+        timeout (float): Seconds the query may run, counting the whole
+            stream; past it the cursor is cancelled and QueryTimeout raised
+        on_cursor (callable): Called with the live cursor before execution
+            so the caller can cancel it from another thread; returning False
+            means the caller has already stopped and the query is not run
         
-    except Exception as e:
-        # Try to close connection on error
+    Yields:
+        tuple: (columns, rows) - column names and a list of row tuples
+        (or a pyarrow.Table when arrow=True).
+        The first batch may be empty if the query returned no rows.
+    """
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    if arrow:
+        _require_pyarrow()
+
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        finished = False
+        timer = None
+        timed_out = threading.Event()
+        if timeout:
+            def expire():
+                timed_out.set()
+                cursor.cancel()
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+        logged = _slow_queries.start(query, cursor)
         try:
-            connection.close()
-        except:
-            pass
-        raise Exception(f"Query Error: {str(e)}")
+            if on_cursor is not None and on_cursor(cursor) is False:
+                raise Exception("Query Error: Query was cancelled before it started")
+            if timer is not None:
+                timer.start()
+            try:
+                with metrics.phase('execute'):
+                    cursor.execute(query)
+                columns = [desc[0] for desc in cursor.description]
+            except Exception as e:
+                if timed_out.is_set():
+                    raise QueryTimeout(f"Query exceeded its {timeout:g}s timeout and was cancelled")
+                raise Exception(f"Query Error: {str(e)}")
+
+            first = True
+            while True:
+                try:
+                    with metrics.phase('fetch'):
+                        if arrow:
+                            rows = cursor.fetchmany_arrow(batch_size)
+                        else:
+                            rows = cursor.fetchmany(batch_size)
+                except Exception as e:
+                    if timed_out.is_set():
+                        raise QueryTimeout(f"Query exceeded its {timeout:g}s timeout and was cancelled")
+                    raise Exception(f"Query Error: {str(e)}")
+                logged.add(len(rows), rows.nbytes if arrow else None)
+                # Always yield once so empty results still report their columns
+                if len(rows) == 0 and not first:
+                    break
+                first = False
+                yield columns, rows
+                if len(rows) == 0:
+                    break
+            finished = True
+        finally:
+            if timer is not None:
+                timer.cancel()
+            logged.finish('ok' if finished else 'timed_out' if timed_out.is_set() else 'stopped')
+            if not finished:
+                # Consumer stopped early - don't leave the warehouse running
+                try:
+                    cursor.cancel()
+                except Exception:
+                    pass
+            cursor.close()
+
+
+_schema_cache = ResultCache(SCHEMA_CACHE_MAX_BYTES, default_ttl=SCHEMA_CACHE_TTL)
+
+
+def _query_records(query):
+    """Execute a small metadata query and return row dicts (no pandas, so NULLs stay None)"""
+    with get_connection() as connection:
+        try:
+            cursor = connection.cursor()
+            try:
+                with _slow_queries.track(query, cursor) as logged:
+                    with metrics.phase('execute'):
+                        cursor.execute(query)
+                    columns = [desc[0] for desc in cursor.description]
+                    with metrics.phase('fetch'):
+                        rows = cursor.fetchall()
+                    logged.add(len(rows))
+                return [dict(zip(columns, row)) for row in rows]
+            finally:
+                cursor.close()
+        except Exception as e:
+            raise Exception(f"Query Error: {str(e)}")
+
+
+def _columns_nbytes(columns):
+    """Rough in-memory size of a list of ColumnInfo records"""
+    return sum(200 + len(c.name) + len(c.type) + len(c.comment or '') for c in columns)
+
+
+def get_table_columns(table_name, refresh=False):
+    """
+    Get parsed column records for a table, cached for SCHEMA_CACHE_TTL
+    
+    Args:
+        table_name (str): Fully qualified table name (catalog.schema.table)
+        refresh (bool): Ignore the cached entry and re-run DESCRIBE TABLE
+        
+    Returns:
+        list: schema.ColumnInfo records in table order
+    
+    Raises:
+        ValueError: If table_name is not catalog.schema.table
+    """
+    key = (SQL_WAREHOUSE_ID, table_key(table_name))
+    if not refresh:
+        columns = _schema_cache.get(key)
+        if columns is not None:
+            return columns
+
+    rows = _query_records(f"DESCRIBE TABLE {table_name}")
+    columns = parse_describe_rows(rows)
+    _schema_cache.put(key, columns, _columns_nbytes(columns))
+    return columns
+
+
+def get_table_schemas(table_names, refresh=False):
+    """
+    Get column records for many tables with at most one warehouse query
+    
+    Cached tables are served from the schema cache; the rest are looked up
+    together in a single information_schema.columns query.
+    
+    Args:
+        table_names (list): Fully qualified table names
+        refresh (bool): Ignore cached entries
+        
+    Returns:
+        tuple: (schemas, missing)
+        - schemas: dict of requested name -> list of ColumnInfo
+        - missing: requested names not found in information_schema
+    """
+    schemas = {}
+    to_fetch = {}
+    for name in table_names:
+        key = table_key(name)
+        columns = None if refresh else _schema_cache.get((SQL_WAREHOUSE_ID, key))
+        if columns is not None:
+            schemas[name] = columns
+        else:
+            to_fetch.setdefault(key, []).append(name)
+
+    missing = []
+    if to_fetch:
+        rows = _query_records(build_columns_query(list(to_fetch)))
+        parsed = parse_columns_rows(rows)
+        for key, names in to_fetch.items():
+            columns = parsed.get(key)
+            if columns is None:
+                missing.extend(names)
+                continue
+            _schema_cache.put((SQL_WAREHOUSE_ID, key), columns, _columns_nbytes(columns))
+            for name in names:
+                schemas[name] = columns
+
+    return schemas, missing
+
+
+def invalidate_table_schema(table_name=None):
+    """
+    Drop a cached table schema, or all of them when table_name is None
+    
+    Returns:
+        int: Number of entries removed
+    """
+    if table_name is None:
+        return _schema_cache.invalidate()
+    return _schema_cache.invalidate((SQL_WAREHOUSE_ID, table_key(table_name)))
 
 
 def get_table_schema(table_name):
@@ -118,11 +1291,9 @@ def get_table_schema(table_name):
         table_name (str): Fully qualified table name (catalog.schema.table)
         
     Returns:
-        list: List of column info dicts
+        list: List of column info dicts (DESCRIBE TABLE col_name/data_type/comment)
     """
-    query = f"DESCRIBE TABLE {table_name}"
-    result = execute_query(query, return_dict=True)
-    return result
+    return [column.to_describe_row() for column in get_table_columns(table_name)]
 
 
 def test_connection():
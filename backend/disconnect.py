@@ -0,0 +1,95 @@
+"""
+Client disconnect detection
+WSGI has no signal for a client that goes away mid-request, so peek at the
+request's socket instead: readable with nothing to read means the peer has
+closed its end
+"""
+
+import select
+import socket
+import threading
+
+
+def request_socket(environ):
+    """The client socket behind a WSGI request, if the server exposes it"""
+    return environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+
+
+def is_disconnected(sock):
+    """
+    Check whether the client has closed the connection, without blocking
+
+    Bytes already waiting (a pipelined request) count as still connected.
+    Sockets that cannot be peeked (e.g. TLS) are assumed connected.
+
+    Args:
+        sock (socket.socket): Client socket, or None
+
+    Returns:
+        bool: True if the client is gone
+    """
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except ConnectionError:
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+class DisconnectWatcher:
+    """
+    Call on_disconnect from a background thread if the client goes away
+
+    For request threads that block in the warehouse (e.g. cursor.execute)
+    and so cannot poll themselves. Use as a context manager around the
+    blocking call.
+
+    Args:
+        sock (socket.socket): Client socket (None disables the watcher)
+        on_disconnect (callable): Called once, typically cursor.cancel
+        interval (float): Seconds between checks
+    """
+
+    def __init__(self, sock, on_disconnect, interval=0.5):
+        self.sock = sock
+        self.on_disconnect = on_disconnect
+        self.interval = interval
+        self.disconnected = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            if is_disconnected(self.sock):
+                self.disconnected = True
+                try:
+                    self.on_disconnect()
+                except Exception as e:
+                    print(f"Cancel after client disconnect failed: {e}")
+                return
+
+    def check(self):
+        """
+        Check now rather than at the next poll
+
+        Returns:
+            bool: True if the client has gone away
+        """
+        if not self.disconnected and is_disconnected(self.sock):
+            self.disconnected = True
+        return self.disconnected
+
+    def __enter__(self):
+        if self.sock is not None:
+            self._thread = threading.Thread(target=self._watch, name="disconnect-watch", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        return False
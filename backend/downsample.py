@@ -0,0 +1,204 @@
+"""
+Server-side down-sampling of time series
+Reduces a result to at most max_points rows before it is serialized, with
+Largest-Triangle-Three-Buckets or per-bucket min/max selection, so charts of
+long hour-grain windows stay light without losing their peaks
+"""
+
+METHODS = ('lttb', 'minmax')
+MIN_POINTS = 3
+MAX_POINTS = 100000
+
+
+def parse_max_points(value):
+    """
+    Validate an optional max_points request field
+
+    Returns:
+        int or None
+
+    Raises:
+        ValueError: If value is not an integer in [MIN_POINTS, MAX_POINTS]
+    """
+    if value is None or value == '':
+        return None
+    try:
+        points = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("max_points must be an integer")
+    if not MIN_POINTS <= points <= MAX_POINTS:
+        raise ValueError(f"max_points must be between {MIN_POINTS} and {MAX_POINTS}")
+    return points
+
+
+def parse_method(value):
+    """
+    Validate an optional down-sampling method (default lttb)
+
+    Raises:
+        ValueError: If the method is unknown
+    """
+    method = str(value or 'lttb').lower()
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsample method '{method}': expected one of {', '.join(METHODS)}")
+    return method
+
+
+def _as_float(column):
+    """Arrow column as a float64 numpy array, nulls as NaN"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if pa.types.is_timestamp(column.type) or pa.types.is_date64(column.type):
+        column = pc.cast(column, pa.int64())
+    elif pa.types.is_date32(column.type):
+        column = pc.cast(column, pa.int32())
+    return pc.cast(column, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def _is_numeric(data_type):
+    import pyarrow as pa
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type) or pa.types.is_decimal(data_type)
+
+
+def _is_temporal(data_type):
+    import pyarrow as pa
+    return pa.types.is_timestamp(data_type) or pa.types.is_date(data_type)
+
+
+def lttb_indices(x, y, n):
+    """
+    Largest-Triangle-Three-Buckets point selection
+
+    Keeps the first and last points and one point from each of n - 2 equal
+    buckets in between: the one forming the largest triangle with the point
+    kept in the previous bucket and the mean of the next bucket. Areas of a
+    bucket are computed in one numpy expression. The buckets holding the
+    series' maximum and minimum then keep those points instead, so spikes
+    are never dropped.
+
+    Args:
+        x (numpy.ndarray): Positions, in row order
+        y (numpy.ndarray): Values; NaN for nulls
+        n (int): Points to keep (at least 3)
+
+    Returns:
+        numpy.ndarray: Sorted row indices
+    """
+    import numpy as np
+
+    size = len(y)
+    if n >= size:
+        return np.arange(size)
+    filled = np.where(np.isnan(y), np.nanmean(y) if not np.isnan(y).all() else 0.0, y)
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    # Mean point of every bucket, then of the final point as the last "next bucket"
+    counts = np.diff(edges)
+    next_x = np.append(np.add.reduceat(x[:-1], edges[:-1]) / counts, x[-1])[1:]
+    next_y = np.append(np.add.reduceat(filled[:-1], edges[:-1]) / counts, filled[-1])[1:]
+    selected = np.empty(n, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    for bucket in range(n - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        anchor = selected[bucket]
+        area = np.abs(
+            (x[anchor] - next_x[bucket]) * (filled[start:end] - filled[anchor])
+            - (x[anchor] - x[start:end]) * (next_y[bucket] - filled[anchor])
+        )
+        selected[bucket + 1] = start + int(np.argmax(area))
+    if not np.isnan(y).all():
+        for peak in (int(np.nanargmax(y)), int(np.nanargmin(y))):
+            bucket = int(np.searchsorted(edges, peak, side='right')) - 1
+            if 0 <= bucket < n - 2:
+                selected[bucket + 1] = peak
+    return np.unique(selected)
+
+
+def minmax_indices(y, n):
+    """
+    Keep the minimum and maximum of each bucket, plus the first and last point
+
+    Fully vectorized: rows are sorted by (bucket, value) once and the first
+    row of each bucket taken from either end.
+
+    Args:
+        y (numpy.ndarray): Values; NaN for nulls
+        n (int): Points to keep (at least 3)
+
+    Returns:
+        numpy.ndarray: Sorted row indices
+    """
+    import numpy as np
+
+    size = len(y)
+    if n >= size:
+        return np.arange(size)
+    buckets = max((n - 2) // 2, 1)
+    edges = np.linspace(0, size, buckets + 1).astype(np.int64)
+    segment = np.repeat(np.arange(buckets), np.diff(edges))
+    highest = np.lexsort((-np.nan_to_num(y, nan=-np.inf), segment))[edges[:-1]]
+    lowest = np.lexsort((np.nan_to_num(y, nan=np.inf), segment))[edges[:-1]]
+    return np.unique(np.concatenate(([0, size - 1], highest, lowest)))
+
+
+def downsample(table, max_points, method='lttb', x_column=None):
+    """
+    Reduce a table to at most max_points rows
+
+    Every numeric column other than x is a series. Each series gets an
+    equal share of max_points (at least MIN_POINTS) and the rows any series
+    selects are kept, with all their columns, in their original order.
+
+    Args:
+        table (pyarrow.Table): Rows ordered by x
+        max_points (int): Row budget
+        method (str): lttb or minmax
+        x_column (str): Column to use as x (default: first date/timestamp
+            column, else the first numeric one)
+
+    Returns:
+        tuple: (pyarrow.Table, info) - info describes the reduction: method,
+        max_points, original_rows, rows, x_column, series and applied
+
+    Raises:
+        ValueError: If there is no usable x column or numeric series
+    """
+    import numpy as np
+    import pyarrow as pa
+
+    fields = {field.name: field.type for field in table.schema}
+    if x_column is None:
+        x_column = next((name for name, data_type in fields.items() if _is_temporal(data_type)), None)
+        if x_column is None:
+            x_column = next((name for name, data_type in fields.items() if _is_numeric(data_type)), None)
+    elif x_column not in fields:
+        raise ValueError(f"Unknown x_column '{x_column}'")
+    if x_column is None or not (_is_temporal(fields[x_column]) or _is_numeric(fields[x_column])):
+        raise ValueError("max_points needs a date, timestamp or numeric x column")
+    series = [name for name, data_type in fields.items() if name != x_column and _is_numeric(data_type)]
+    if not series:
+        raise ValueError("max_points needs at least one numeric column to down-sample")
+
+    info = {
+        'method': method,
+        'max_points': max_points,
+        'original_rows': table.num_rows,
+        'rows': table.num_rows,
+        'x_column': x_column,
+        'series': series,
+        'applied': False,
+    }
+    if table.num_rows <= max_points:
+        return table, info
+
+    x = _as_float(table.column(x_column))
+    x = np.where(np.isnan(x), np.arange(len(x), dtype=np.float64), x)
+    share = max(max_points // len(series), MIN_POINTS)
+    keep = []
+    for name in series:
+        y = _as_float(table.column(name))
+        keep.append(lttb_indices(x, y, share) if method == 'lttb' else minmax_indices(y, share))
+    indices = np.unique(np.concatenate(keep))
+    reduced = table.take(pa.array(indices))
+    info.update({'rows': reduced.num_rows, 'applied': True})
+    return reduced, info
@@ -0,0 +1,343 @@
+"""
+Hermetic fake Databricks SQL warehouse
+An in-process stand-in for the databricks.sql connector, serving a synthetic
+copy of samples.nyctaxi.trips with configurable connect latency, query
+latency, per-row fetch cost and injected failures, so the API can be tested
+and benchmarked without a workspace
+
+Usage:
+    warehouse = FakeWarehouse(connect_latency=0.05, row_cost=2e-6)
+    install(warehouse)  # db.py now borrows its connections from the fake
+
+The offline tests share it too: conftest.py points the pool at one with a
+canned result (warehouse.result), and test_pool.py uses its connections.
+"""
+
+import random
+import re
+import threading
+import time
+import uuid
+
+import numpy as np
+import pyarrow as pa
+
+import db
+import metrics
+
+TRIPS_TABLE = 'samples.nyctaxi.trips'
+# Rows in the real samples.nyctaxi.trips
+TRIPS_ROWS = 21932
+# (name, connector type, information_schema full_data_type, Arrow type)
+TRIPS_SCHEMA = [
+    ('tpep_pickup_datetime', 'timestamp', 'timestamp', pa.timestamp('us')),
+    ('tpep_dropoff_datetime', 'timestamp', 'timestamp', pa.timestamp('us')),
+    ('trip_distance', 'double', 'double', pa.float64()),
+    ('fare_amount', 'double', 'double', pa.float64()),
+    ('pickup_zip', 'int', 'int', pa.int32()),
+    ('dropoff_zip', 'int', 'int', pa.int32()),
+]
+
+_COLUMN_ROW_NAMES = ['table_catalog', 'table_schema', 'table_name', 'column_name', 'full_data_type',
+                     'is_nullable', 'ordinal_position', 'comment']
+_DESCRIBE_ROW_NAMES = ['col_name', 'data_type', 'comment']
+
+_LIMIT = re.compile(r"\bLIMIT\s+(\d+)\s*;?\s*$", re.IGNORECASE)
+_SELECT_FROM = re.compile(r"^\s*SELECT\s+(.*?)\s+FROM\s", re.IGNORECASE | re.DOTALL)
+_SELECT_ONLY = re.compile(r"^\s*SELECT\s+(.*?)\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+_ALIAS = re.compile(r"^(.*?)\s+AS\s+`?(\w+)`?$", re.IGNORECASE)
+_STATEMENTS = {'SELECT', 'WITH', 'VALUES', 'DESCRIBE', 'SHOW', 'EXPLAIN', 'USE', 'SET', 'INSERT', 'UPDATE',
+               'DELETE', 'MERGE', 'CREATE', 'ALTER', 'DROP', 'TRUNCATE', 'OPTIMIZE'}
+
+
+class FakeWarehouseError(Exception):
+    """An injected warehouse failure"""
+
+
+def make_trips(rows=TRIPS_ROWS, seed=42):
+    """
+    Synthetic trips shaped like samples.nyctaxi.trips (January-February 2016)
+
+    Args:
+        rows (int): Number of trips
+        seed (int): Random seed; the same seed gives the same table
+
+    Returns:
+        pyarrow.Table
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2016-01-01T00:00:00', 'us')
+    pickup = start + np.sort(rng.integers(0, 60 * 24 * 3600, rows)).astype('timedelta64[s]')
+    dropoff = pickup + rng.integers(120, 3600, rows).astype('timedelta64[s]')
+    distance = np.round(rng.gamma(1.5, 2.0, rows), 2)
+    fare = np.round(2.5 + distance * 2.5 + rng.uniform(0, 5, rows), 2)
+    columns = [pickup, dropoff, distance, fare,
+               rng.integers(10001, 11697, rows, dtype=np.int32),
+               rng.integers(10001, 11697, rows, dtype=np.int32)]
+    return pa.table({name: pa.array(values, type=arrow_type)
+                     for (name, _, _, arrow_type), values in zip(TRIPS_SCHEMA, columns)})
+
+
+class FakeCursor:
+    """DB-API cursor over a FakeWarehouse (execute, fetch*, fetch*_arrow, cancel, close)"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.warehouse = connection.warehouse
+        self.description = None
+        self.query_id = None
+        self.fetched = 0
+        self._table = None
+        self._fail_after = None
+        self._cancelled = threading.Event()
+        self.closed = False
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def execute(self, query):
+        self.query = query
+        self.query_id = uuid.uuid4().hex
+        self.fetched = 0
+        warehouse = self.warehouse
+        warehouse._count('queries')
+        if self.connection.broken:
+            raise FakeWarehouseError("connection reset")
+        if self._cancelled.wait(warehouse.execute_latency):
+            raise FakeWarehouseError("Query was cancelled")
+        warehouse._maybe_fail('execute')
+        self._table = warehouse.run(query)
+        self._fail_after = warehouse.fail_after
+        self.description = [(field.name, _type_name(field.type), None, None, None, None, None)
+                            for field in self._table.schema]
+
+    def _next(self, size):
+        if self._table is None:
+            raise FakeWarehouseError("No query has been executed")
+        if self._cancelled.is_set():
+            raise FakeWarehouseError("Query was cancelled")
+        if self._fail_after is not None and self.fetched >= self._fail_after:
+            raise FakeWarehouseError("connection reset")
+        self.warehouse._maybe_fail('fetch')
+        batch = self._table.slice(self.fetched, size)
+        self.fetched += batch.num_rows
+        if batch.num_rows and self.warehouse.row_cost:
+            time.sleep(batch.num_rows * self.warehouse.row_cost)
+        self.warehouse._count('rows_fetched', batch.num_rows)
+        return batch
+
+    def fetchmany_arrow(self, size):
+        return self._next(size)
+
+    def fetchall_arrow(self):
+        return self._next(self._table.num_rows if self._table is not None else 0)
+
+    def fetchmany(self, size):
+        batch = self._next(size)
+        return list(zip(*(column.to_pylist() for column in batch.columns)))
+
+    def fetchall(self):
+        return self.fetchmany(self._table.num_rows if self._table is not None else 0)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    """A warehouse connection; set broken to make every statement fail"""
+
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+        self.open = True
+        self.broken = False
+
+    def cursor(self):
+        cursor = FakeCursor(self)
+        self.warehouse.cursors.append(cursor)
+        return cursor
+
+    def close(self):
+        self.open = False
+
+
+class FakeWarehouse:
+    """
+    Fake SQL warehouse serving samples.nyctaxi.trips
+
+    Understands the statements the API sends: information_schema.columns
+    and DESCRIBE lookups for the trips table, SELECT <columns or *> FROM the
+    trips table with an optional trailing LIMIT (other clauses are ignored,
+    as are unknown tables), and FROM-less selects of literals such as
+    SELECT 1. Any other select list returns every trips column, writes
+    such as DELETE return one placeholder row, and text that does not
+    start with a SQL statement keyword fails with PARSE_SYNTAX_ERROR.
+
+    Tests can pin the answer instead: set result to (columns, rows) and
+    every statement returns those rows, and set fail_after to a row count
+    to break the fetch after that many rows. Every connection and cursor
+    handed out is kept in connections and cursors.
+
+    Args:
+        rows (int): Rows in the trips table
+        connect_latency (float): Seconds to open a connection
+        execute_latency (float): Seconds cursor.execute() takes (cancellable)
+        row_cost (float): Seconds per fetched row
+        connect_error_rate (float): Chance a connect fails, 0 to 1
+        execute_error_rate (float): Chance a query fails
+        fetch_error_rate (float): Chance a fetch call fails mid-result
+        seed (int): Seed for the data and for error injection
+    """
+
+    def __init__(self, rows=TRIPS_ROWS, connect_latency=0.0, execute_latency=0.0, row_cost=0.0,
+                 connect_error_rate=0.0, execute_error_rate=0.0, fetch_error_rate=0.0, seed=42):
+        self.trips = make_trips(rows, seed)
+        self.connect_latency = connect_latency
+        self.execute_latency = execute_latency
+        self.row_cost = row_cost
+        self.error_rates = {'connect': connect_error_rate, 'execute': execute_error_rate,
+                            'fetch': fetch_error_rate}
+        self.result = None
+        self.fail_after = None
+        self.connections = []
+        self.cursors = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {'connections': 0, 'queries': 0, 'rows_fetched': 0,
+                       'connect_errors': 0, 'execute_errors': 0, 'fetch_errors': 0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _maybe_fail(self, stage):
+        rate = self.error_rates[stage]
+        if not rate:
+            return
+        with self._lock:
+            failed = self._random.random() < rate
+            if failed:
+                self._stats[f'{stage}_errors'] += 1
+        if failed:
+            raise FakeWarehouseError(f"Injected {stage} failure")
+
+    def connect(self, server_hostname=None, http_path=None, access_token=None, **kwargs):
+        """Open a connection, like databricks.sql.connect()"""
+        time.sleep(self.connect_latency)
+        self._maybe_fail('connect')
+        self._count('connections')
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+    def connection_factory(self):
+        """
+        ConnectionPool factory, shaped like db.get_databricks_connection()
+
+        Returns:
+            tuple: (connection, error_message)
+        """
+        try:
+            with metrics.phase('connect'):
+                return self.connect(), None
+        except Exception as e:
+            return None, f"Connection failed: {str(e)}. (fake warehouse)"
+
+    def run(self, query):
+        """
+        Result of a statement
+
+        Returns:
+            pyarrow.Table
+        """
+        words = query.split(None, 1)
+        if not words or words[0].upper() not in _STATEMENTS:
+            raise FakeWarehouseError(f"[PARSE_SYNTAX_ERROR] Syntax error at or near '{words[0] if words else ''}'")
+        if self.result is not None:
+            columns, rows = self.result
+            return _rows_table(columns, rows)
+        if 'information_schema.columns' in query.lower():
+            return self._columns_rows(query)
+        if query.lstrip().upper().startswith('DESCRIBE'):
+            return _rows_table(_DESCRIBE_ROW_NAMES, [(name, data_type, None)
+                                                     for name, _, data_type, _ in TRIPS_SCHEMA])
+
+        match = _SELECT_FROM.match(query)
+        if match is None:
+            return self._literals(query)
+        table = self._project(match.group(1))
+        limit = _LIMIT.search(query)
+        if limit:
+            table = table.slice(0, int(limit.group(1)))
+        return table
+
+    def _columns_rows(self, query):
+        catalog, schema_name, table = TRIPS_TABLE.split('.')
+        lowered = query.lower()
+        rows = []
+        if f"`{catalog}`" in lowered and f"'{schema_name}'" in lowered and f"'{table}'" in lowered:
+            rows = [(catalog, schema_name, table, name, data_type, 'YES', position, None)
+                    for position, (name, _, data_type, _) in enumerate(TRIPS_SCHEMA, start=1)]
+        return _rows_table(_COLUMN_ROW_NAMES, rows)
+
+    def _project(self, select_list):
+        names = [item.strip().strip('`') for item in select_list.split(',')]
+        if names == ['*'] or not all(name in self.trips.column_names for name in names):
+            return self.trips
+        return self.trips.select(names)
+
+    def _literals(self, query):
+        """One row for SELECT <literal> [AS name], ... without FROM"""
+        match = _SELECT_ONLY.match(query)
+        items = match.group(1).split(',') if match else ['1']
+        values = {}
+        for item in items:
+            item = item.strip()
+            alias = _ALIAS.match(item)
+            expression, name = (alias.group(1).strip(), alias.group(2)) if alias else (item, item)
+            values[name] = [int(expression) if expression.lstrip('-').isdigit() else expression.strip("'")]
+        return pa.table(values)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Connections opened, queries run, rows fetched and injected errors
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+def install(warehouse, max_size=None):
+    """
+    Point db.py's connection pool at a fake warehouse
+
+    Args:
+        warehouse (FakeWarehouse): Fake to serve queries from
+        max_size (int): Pool size (default DB_POOL_MAX_SIZE)
+
+    Returns:
+        ConnectionPool: The pool it replaced
+    """
+    previous = db._pool
+    db._pool = db.ConnectionPool(warehouse.connection_factory, max_size=max_size or db.POOL_MAX_SIZE)
+    return previous
+
+
+def _rows_table(names, rows):
+    return pa.table({name: [row[i] for row in rows] for i, name in enumerate(names)})
+
+
+def _type_name(arrow_type):
+    """The type name the connector reports in cursor.description"""
+    if pa.types.is_timestamp(arrow_type):
+        return 'timestamp'
+    if pa.types.is_int32(arrow_type):
+        return 'int'
+    if pa.types.is_integer(arrow_type):
+        return 'bigint'
+    if pa.types.is_floating(arrow_type):
+        return 'double'
+    return 'string'
@@ -0,0 +1,45 @@
+"""
+Production server configuration
+    gunicorn -c gunicorn.conf.py api:app
+
+Each worker process is a thread pool (gthread): WEB_THREADS request threads
+share that process's connection pool, caches and query-job executor
+(JOB_MAX_WORKERS concurrent warehouse queries, DB_POOL_MAX_SIZE connections;
+see app.yaml for sizing the pool).
+Query jobs, page tokens and cached results live in the process, so keep
+WEB_WORKERS at 1 unless requests are routed stickily; scale concurrency with
+WEB_THREADS and JOB_MAX_WORKERS instead.
+
+On SIGTERM a worker stops accepting connections and lets in-flight requests
+finish for up to SHUTDOWN_DRAIN_TIMEOUT seconds. Background jobs from
+/api/jobs then get up to another SHUTDOWN_DRAIN_TIMEOUT before they are
+cancelled in the warehouse, and the worker's connections are closed
+(api.shutdown).
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('API_PORT', '8001')}"
+workers = int(os.getenv('WEB_WORKERS', '1'))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '32'))
+# Idle connections held open by browsers; not counted against threads
+worker_connections = int(os.getenv('WEB_MAX_CONNECTIONS', '1000'))
+keepalive = int(os.getenv('WEB_KEEPALIVE', '5'))
+# Heartbeat timeout - long queries run on request threads, so be generous
+timeout = int(os.getenv('WEB_TIMEOUT', '600'))
+graceful_timeout = int(float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '30')))
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """Warm the worker's own connection pool once the app is loaded"""
+    import api
+    api.startup()
+
+
+def worker_exit(server, worker):
+    """In-flight requests are done (or out of time): drain query jobs"""
+    import api
+    api.shutdown(timeout=graceful_timeout)
@@ -0,0 +1,398 @@
+"""
+Asynchronous query jobs
+A bounded executor runs warehouse work; a job store tracks status and keeps
+results until they expire
+"""
+
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timed_out'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED, TIMED_OUT)
+# Stopped before finishing; whatever the work returns afterwards is dropped
+STOPPED_STATES = (CANCELLED, TIMED_OUT)
+
+
+class JobQueueFull(Exception):
+    """Raised when the executor already has max_queued jobs waiting"""
+
+
+class QueryTimeout(Exception):
+    """Raised when a query ran past its timeout and was cancelled"""
+
+
+class Job:
+    """
+    One submitted query and its outcome
+
+    The work function may call attach_cancel() with a callable that stops the
+    underlying warehouse query (typically cursor.cancel). The callable returns
+    False if it could not stop it, e.g. because other requests share it.
+    """
+
+    def __init__(self, query):
+        self.id = uuid.uuid4().hex
+        self.query = query
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.cache_status = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # time.monotonic() by which the job must finish, once it runs with a timeout
+        self.deadline = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._cancel_fn = None
+        self._callbacks = []
+
+    def add_done_callback(self, fn):
+        """Call fn(job) once the job finishes; at once if it already has"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def attach_cancel(self, cancel_fn):
+        """
+        Register how to stop the running query; runs now if already cancelled
+
+        Returns:
+            bool: False if the job has already been stopped, so the caller
+            should not start the query
+        """
+        with self._lock:
+            self._cancel_fn = cancel_fn
+            cancelled = self.status in STOPPED_STATES
+        if cancelled:
+            cancel_fn()
+        return not cancelled
+
+    def remaining(self):
+        """Seconds left before the job times out (None if it has no timeout)"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def wait(self, timeout=None):
+        """
+        Block until the job finishes
+
+        Returns:
+            bool: True if it finished within timeout
+        """
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def _finish(self, status, result=None, error=None):
+        """
+        Record the outcome and wake waiters
+
+        Returns:
+            bool: False if the job had already finished (the call did nothing)
+        """
+        with self._lock:
+            if self._done.is_set():
+                return False
+            if self.status in STOPPED_STATES:
+                # Cancelled while running; drop whatever the work produced
+                status, result, error = self.status, None, self.error
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                print(f"Job {self.id} callback failed: {e}")
+        return True
+
+    def to_dict(self):
+        """Status summary for the API (without the result itself)"""
+        now = time.time()
+        started = self.started_at or now
+        info = {
+            'job_id': self.id,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'queue_seconds': round(started - self.submitted_at, 3),
+            'run_seconds': round((self.finished_at or now) - started, 3) if self.started_at else 0.0,
+        }
+        if self.error is not None:
+            info['message'] = str(self.error)
+        if self.status == SUCCEEDED and hasattr(self.result, 'num_rows'):
+            info['row_count'] = self.result.num_rows
+            info['columns'] = self.result.column_names
+        if self.cache_status is not None:
+            info['cache'] = self.cache_status
+        return info
+
+
+class JobStore:
+    """
+    Runs jobs on a bounded thread pool and keeps them until they expire
+
+    Args:
+        max_workers (int): Jobs executing at once
+        max_queued (int): Jobs allowed to wait for a worker
+        result_ttl (float): Seconds a finished job (and its result) is kept
+        query_timeout (float): Seconds a job may run before it is cancelled
+            (None for no limit); submit() can override it per job
+    """
+
+    def __init__(self, max_workers=4, max_queued=64, result_ttl=600, query_timeout=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.query_timeout = query_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="query-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        # Unfinished jobs, including sync ones already discarded from _jobs
+        self._active = set()
+        self._queued = 0
+        self._draining = False
+        self._stats = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'cancelled': 0,
+                       'timed_out': 0, 'disconnected': 0, 'rejected': 0, 'expired': 0}
+
+    def submit(self, query, work, timeout=None):
+        """
+        Queue a job
+
+        Args:
+            query (str): SQL text, kept for status reporting
+            work (callable): Called with the Job on a worker thread; returns the result
+            timeout (float): Seconds the job may run once started (default
+                query_timeout). Past it the job is cancelled and ends in
+                TIMED_OUT with a QueryTimeout error
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            JobQueueFull: If max_queued jobs are already waiting, or the
+                store is draining for shutdown
+        """
+        self._expire()
+        job = Job(query)
+        with self._lock:
+            if self._draining:
+                self._stats['rejected'] += 1
+                raise JobQueueFull("Server is shutting down; try again shortly")
+            if self._queued >= self.max_queued:
+                self._stats['rejected'] += 1
+                raise JobQueueFull(f"{self._queued} queries are already queued; try again shortly")
+            self._queued += 1
+            self._jobs[job.id] = job
+            self._active.add(job)
+            self._stats['submitted'] += 1
+        timeout = self.query_timeout if timeout is None else timeout
+        # Run in the submitter's context so per-request state (metrics.Timings) follows
+        self._executor.submit(contextvars.copy_context().run, self._run, job, work, timeout)
+        return job
+
+    def _run(self, job, work, timeout):
+        try:
+            self._execute(job, work, timeout)
+        finally:
+            with self._lock:
+                self._active.discard(job)
+
+    def _execute(self, job, work, timeout):
+        with self._lock:
+            self._queued -= 1
+        with job._lock:
+            if job.status in STOPPED_STATES:
+                skip = True
+            else:
+                skip = False
+                job.status = RUNNING
+                job.started_at = time.time()
+        if skip:
+            # Cancelled while queued; usually finished by _cancel() already
+            if job._finish(job.status):
+                self._count(job.status)
+            return
+        metrics.record('job_queue', job.started_at - job.submitted_at)
+
+        timer = None
+        if timeout:
+            job.deadline = time.monotonic() + timeout
+            timer = threading.Timer(timeout, self._cancel, (job, TIMED_OUT, timeout))
+            timer.daemon = True
+            timer.start()
+        try:
+            result = work(job)
+        except Exception as e:
+            if job.deadline is not None and time.monotonic() >= job.deadline:
+                # Gave up at the deadline (e.g. waiting on a shared query)
+                self._cancel(job, TIMED_OUT, timeout)
+            elif job._finish(FAILED, error=e):
+                self._count(job.status)
+        else:
+            if job._finish(SUCCEEDED, result=result):
+                self._count(job.status)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def _count(self, status):
+        with self._lock:
+            self._stats[status] += 1
+
+    def get(self, job_id):
+        """
+        Look up a job
+
+        Returns:
+            Job or None: None if unknown or expired
+        """
+        self._expire()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id, disconnected=False):
+        """
+        Cancel a queued or running job
+
+        Running jobs have their registered cancel callable invoked, which
+        stops the warehouse query. The job finishes at once either way.
+
+        Args:
+            job_id (str): Job to cancel
+            disconnected (bool): The client waiting on it went away; counted
+                separately in stats()
+
+        Returns:
+            Job or None: The job, or None if unknown
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if disconnected and not job.done:
+            self._count('disconnected')
+        return self._cancel(job)
+
+    def _cancel(self, job, status=CANCELLED, timeout=None):
+        """
+        Stop a job's query and finish the job as status
+
+        The job finishes even if the query cannot be stopped (another request
+        shares it), so whoever waits on the job is released on time.
+
+        Args:
+            job (Job): Job to stop
+            status (str): CANCELLED or TIMED_OUT
+            timeout (float): The timeout that passed, for TIMED_OUT
+        """
+        with job._lock:
+            if job.status in FINISHED_STATES:
+                return job
+            job.status = status
+            job.error = (QueryTimeout(f"Query exceeded its {timeout:g}s timeout") if status == TIMED_OUT
+                         else Exception("Query was cancelled"))
+            cancel_fn = job._cancel_fn
+        stopped = True
+        if cancel_fn is not None:
+            try:
+                stopped = cancel_fn() is not False
+            except Exception as e:
+                print(f"Cancel of job {job.id} failed: {e}")
+        if status == TIMED_OUT:
+            message = f"Query exceeded its {timeout:g}s timeout"
+            if stopped:
+                message += " and was cancelled"
+            else:
+                message += "; it keeps running for other requests sharing it"
+            job.error = QueryTimeout(message)
+        if job._finish(status):
+            self._count(status)
+        return job
+
+    def discard(self, job_id):
+        """Forget a job immediately (used once a sync request has its result)"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+            self._stats['expired'] += len(expired)
+
+    def stats(self):
+        """
+        Job counters
+
+        Returns:
+            dict: queued/running/stored job counts and cumulative counters
+        """
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+            return {
+                'queued': self._queued,
+                'running': running,
+                'stored': len(self._jobs),
+                'max_workers': self.max_workers,
+                'max_queued': self.max_queued,
+                'draining': self._draining,
+                **self._stats,
+            }
+
+    def drain(self, timeout):
+        """
+        Stop accepting jobs and let queued and running ones finish
+
+        New submissions raise JobQueueFull from now on. Jobs still unfinished
+        after timeout seconds are cancelled, which stops their warehouse
+        queries.
+
+        Args:
+            timeout (float): Seconds to wait for in-flight jobs
+
+        Returns:
+            dict: {"finished": jobs that completed while draining,
+            "cancelled": jobs cancelled at the deadline}
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._draining = True
+            pending = list(self._active)
+        finished = 0
+        for job in pending:
+            if job.wait(max(deadline - time.monotonic(), 0)):
+                finished += 1
+        leftover = [job for job in pending if not job.done]
+        for job in leftover:
+            self._cancel(job)
+        # Cancelled jobs still waiting for a worker finish as soon as one
+        # picks them up
+        self._executor.shutdown(wait=False)
+        return {'finished': finished, 'cancelled': len(leftover)}
+
+    def shutdown(self, wait=True):
+        """Stop accepting work; optionally wait for running jobs"""
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
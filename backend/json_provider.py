@@ -0,0 +1,147 @@
+"""
+Fast JSON serialization for API responses
+A Flask JSON provider that encodes with orjson when it is installed (stdlib
+json otherwise) and converts warehouse values - Decimal, dates, numpy
+scalars, pandas Timestamps - through a table of per-type handlers
+"""
+
+import json
+import os
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+import metrics
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+# "orjson" (default when installed) or "stdlib"
+JSON_ENCODER = os.getenv('JSON_ENCODER', 'orjson').lower()
+
+
+def _iso(value):
+    # pandas.NaT is a datetime that is not equal to itself
+    return None if value != value else value.isoformat()
+
+
+def _item(value):
+    return value.item()
+
+
+# Handlers by type; subclasses (e.g. pandas.Timestamp) use their nearest
+# registered base
+TYPE_HANDLERS = {
+    Decimal: float,
+    datetime: _iso,
+    date: _iso,
+    time: _iso,
+    uuid.UUID: str,
+    bytes: lambda value: value.hex(),
+    set: list,
+    frozenset: list,
+    np.generic: _item,
+    np.ndarray: lambda value: value.tolist(),
+}
+# Exact type -> handler, filled as types are first seen
+_resolved = dict(TYPE_HANDLERS)
+
+
+def register_type(value_type, handler):
+    """
+    Serialize values of value_type (and subclasses) as handler(value)
+
+    Args:
+        value_type (type): Type to handle
+        handler (callable): Returns a JSON-native value
+    """
+    TYPE_HANDLERS[value_type] = handler
+    _resolved.clear()
+    _resolved.update(TYPE_HANDLERS)
+
+
+def default(value):
+    """
+    Convert a value the encoder has no native support for
+
+    Raises:
+        TypeError: If no handler matches the value's type
+    """
+    value_type = type(value)
+    handler = _resolved.get(value_type)
+    if handler is None:
+        handler = next((TYPE_HANDLERS[base] for base in value_type.__mro__ if base in TYPE_HANDLERS), None)
+        if handler is None:
+            raise TypeError(f"Object of type {value_type.__name__} is not JSON serializable")
+        _resolved[value_type] = handler
+    return handler(value)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson, with the stdlib as fallback
+
+    Both paths use default() for non-native values, keep dict keys in
+    insertion order (so records keep column order) and write ISO 8601 for
+    dates and times. orjson writes NaN as null, the stdlib as NaN.
+
+    Args:
+        app (flask.Flask): Application to serve
+        encoder (str): "orjson" or "stdlib" (default JSON_ENCODER)
+    """
+
+    sort_keys = False
+
+    def __init__(self, app, encoder=None):
+        super().__init__(app)
+        self.encoder = 'orjson' if (encoder or JSON_ENCODER) == 'orjson' and orjson is not None else 'stdlib'
+
+    def _orjson_options(self, kwargs):
+        """orjson option flags for dumps() kwargs, or None if orjson can't honour them"""
+        options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        indent = kwargs.pop('indent', None)
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        if kwargs.pop('sort_keys', False):
+            options |= orjson.OPT_SORT_KEYS
+        return None if kwargs else options
+
+    def dumps_bytes(self, obj, **kwargs):
+        """Serialize obj to UTF-8 JSON bytes"""
+        if self.encoder == 'orjson':
+            options = self._orjson_options(dict(kwargs))
+            if options is not None:
+                return orjson.dumps(obj, default=default, option=options)
+        return self.dumps(obj, **kwargs).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        """Serialize obj to a JSON string"""
+        if self.encoder == 'orjson':
+            options = self._orjson_options(dict(kwargs))
+            if options is not None:
+                return orjson.dumps(obj, default=default, option=options).decode('utf-8')
+        kwargs.setdefault('default', default)
+        kwargs.setdefault('ensure_ascii', False)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        """Parse JSON text or bytes"""
+        if self.encoder == 'orjson' and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        """Like jsonify(), encoding straight to bytes"""
+        obj = self._prepare_response_obj(args, kwargs)
+        dump_args = {}
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            dump_args['indent'] = 2
+        with metrics.phase('serialize'):
+            body = self.dumps_bytes(obj, **dump_args) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,233 @@
+"""
+Phase-level latency metrics
+Histograms of the time spent in each step of serving a query (auth, connect,
+pool acquire, execute, fetch, convert, serialize, compress) and of result
+rows and bytes, rendered in the Prometheus text format. Each request also
+collects its own phase totals for the Server-Timing header.
+
+Recording is a perf_counter() pair, a bisect and a short locked update, so
+it stays on in production (METRICS_ENABLED=false turns it off).
+"""
+
+import contextvars
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRIC_PREFIX = 'query_api'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120, 300)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+BYTE_BUCKETS = tuple(256 * 4 ** power for power in range(12))  # 256 B .. 1 GiB
+
+
+class Histogram:
+    """
+    Cumulative histogram with one series per label value
+
+    Args:
+        name (str): Metric name (without METRIC_PREFIX)
+        help (str): Description for the HELP line
+        buckets (tuple): Ascending upper bounds; +Inf is implied
+        label (str): Label distinguishing the series
+    """
+
+    def __init__(self, name, help, buckets, label):
+        self.name = f"{METRIC_PREFIX}_{name}"
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._lock = threading.Lock()
+        # label value -> [per-bucket counts (last is +Inf), sum]
+        self._series = {}
+
+    def observe(self, label_value, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: label value -> {"count", "sum"}
+        """
+        with self._lock:
+            return {value: {'count': sum(counts), 'sum': total}
+                    for value, (counts, total) in self._series.items()}
+
+    def render(self):
+        """Prometheus text lines for every series"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {value: (list(counts), total) for value, (counts, total) in self._series.items()}
+        for value in sorted(series):
+            counts, total = series[value]
+            label = f'{self.label}="{_escape(value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else f"{bound:g}"
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total:.6g}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+PHASE_SECONDS = Histogram('phase_seconds', 'Seconds spent in each phase of serving a request',
+                          LATENCY_BUCKETS, 'phase')
+REQUEST_SECONDS = Histogram('request_seconds', 'Request latency by endpoint', LATENCY_BUCKETS, 'endpoint')
+RESULT_ROWS = Histogram('result_rows', 'Rows per result, by where they were counted', ROW_BUCKETS, 'stage')
+RESULT_BYTES = Histogram('result_bytes', 'Bytes per result, by where they were counted', BYTE_BUCKETS, 'stage')
+HISTOGRAMS = (PHASE_SECONDS, REQUEST_SECONDS, RESULT_ROWS, RESULT_BYTES)
+
+
+class Timings:
+    """Phase totals for one request, for its Server-Timing header"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._phases = {}
+
+    def add(self, phase, seconds):
+        with self._lock:
+            total, count = self._phases.get(phase, (0.0, 0))
+            self._phases[phase] = (total + seconds, count + 1)
+
+    def phases(self):
+        """
+        Returns:
+            dict: phase -> (seconds, times recorded), in first-seen order
+        """
+        with self._lock:
+            return dict(self._phases)
+
+    def header(self, total=None):
+        """
+        Server-Timing value, e.g. 'execute;dur=812.4, fetch;dur=35.0;desc="3x"'
+
+        Args:
+            total (float): Request seconds so far, added as "total"
+        """
+        entries = []
+        for phase, (seconds, count) in self.phases().items():
+            entry = f"{phase};dur={seconds * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="{count}x"'
+            entries.append(entry)
+        if total is not None:
+            entries.append(f"total;dur={total * 1000:.1f}")
+        return ', '.join(entries)
+
+
+# The current request's Timings; job threads run in a copy of the submitting
+# thread's context, so their phases land here too
+_current = contextvars.ContextVar('timings', default=None)
+
+
+def start_request():
+    """
+    Begin collecting phases for the current request
+
+    Returns:
+        tuple: (Timings, token) - pass token to end_request()
+    """
+    timings = Timings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current_timings():
+    return _current.get()
+
+
+def record(phase, seconds):
+    """Record a phase duration in the histogram and the current request"""
+    if not METRICS_ENABLED:
+        return
+    PHASE_SECONDS.observe(phase, seconds)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+@contextmanager
+def phase(name):
+    """Time the with block as phase name (recorded even if it raises)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def record_result(stage, rows=None, nbytes=None):
+    """Record a result's size at a stage (e.g. "fetch", "response")"""
+    if not METRICS_ENABLED:
+        return
+    if rows is not None:
+        RESULT_ROWS.observe(stage, rows)
+    if nbytes is not None:
+        RESULT_BYTES.observe(stage, nbytes)
+
+
+def record_request(endpoint, seconds):
+    if METRICS_ENABLED:
+        REQUEST_SECONDS.observe(endpoint or 'unknown', seconds)
+
+
+def stats_lines(group, stats):
+    """
+    Prometheus lines for the numeric values of a stats() dict
+
+    Args:
+        group (str): Name part, e.g. "pool" gives query_api_pool_<key>
+        stats (dict): Values to export; nested dicts, strings and None are skipped
+    """
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if not isinstance(value, (int, float)):
+            continue
+        name = f"{METRIC_PREFIX}_{group}_{key}"
+        lines.append(f"# TYPE {name} untyped")
+        lines.append(f"{name} {value:.6g}" if isinstance(value, float) else f"{name} {value}")
+    return lines
+
+
+def render(extra_lines=()):
+    """
+    The full /api/metrics document
+
+    Args:
+        extra_lines (iterable): More lines, e.g. from stats_lines()
+
+    Returns:
+        str: Prometheus text exposition format
+    """
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,255 @@
+"""
+Server-side result pagination
+Result sets are kept between page requests, either as a cached Arrow table or
+as a still-open cursor that is read only as far as the pages requested
+"""
+
+import base64
+import json
+import secrets
+import threading
+import time
+
+
+class PageTokenExpired(Exception):
+    """Raised when a page token refers to an evicted or unknown result set"""
+
+
+def encode_page_token(result_id, offset):
+    raw = json.dumps({'r': result_id, 'o': offset}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_page_token(token):
+    """
+    Returns:
+        tuple: (result_id, offset)
+
+    Raises:
+        PageTokenExpired: If the token is malformed
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(payload['r']), int(payload['o'])
+    except Exception:
+        raise PageTokenExpired("Invalid page token")
+
+
+class _ResultSet:
+    """Rows fetched so far for one query, plus the cursor if not yet exhausted"""
+
+    def __init__(self, result_id, table=None, source=None):
+        self.id = result_id
+        # Reentrant: a failed read drops (and closes) the result while holding it
+        self.lock = threading.RLock()
+        self.tables = [table] if table is not None else []
+        self.fetched_rows = table.num_rows if table is not None else 0
+        self.nbytes = table.nbytes if table is not None else 0
+        self.source = source
+        self.exhausted = source is None
+        self.last_access = time.monotonic()
+        self.schema = table.schema if table is not None else None
+
+    def read(self, offset, limit, fetch_size):
+        """Rows [offset, offset + limit), fetching from the cursor as needed"""
+        while not self.exhausted and self.fetched_rows < offset + limit:
+            table = self.source.fetch(max(fetch_size, offset + limit - self.fetched_rows))
+            if self.schema is None:
+                self.schema = table.schema
+            if table.num_rows == 0:
+                self.close_source()
+                break
+            self.tables.append(table)
+            self.fetched_rows += table.num_rows
+            self.nbytes += table.nbytes
+        return self._slice(offset, limit)
+
+    def _slice(self, offset, limit):
+        import pyarrow as pa
+        tables = [t for t in self.tables if t.num_rows]
+        if not tables:
+            return pa.Table.from_batches([], schema=self.schema)
+        return pa.concat_tables(tables).slice(offset, limit)
+
+    def close_source(self, failed=False):
+        if self.source is not None:
+            source, self.source = self.source, None
+            source.close(failed=failed)
+        self.exhausted = True
+
+
+class PagedResultStore:
+    """
+    Keeps paged result sets between requests
+
+    Result sets are evicted when idle for longer than idle_timeout, and least
+    recently used ones are dropped when buffered rows exceed max_bytes. At
+    most max_open result sets may hold an open cursor (and so a pooled
+    connection) at once. A background thread checks for idle result sets
+    every reap_interval seconds, so an abandoned cursor is closed even if
+    nobody else pages.
+
+    Args:
+        opener (callable): Returns an object with fetch(size) and close()
+            for a query (db.open_result)
+        max_bytes (int): Budget for buffered rows across all result sets
+        idle_timeout (float): Seconds before an untouched result set is dropped
+        max_open (int): Result sets allowed to keep a cursor open
+        fetch_size (int): Minimum rows pulled per cursor fetch
+        reap_interval (float): Seconds between idle checks (default a
+            quarter of idle_timeout, at most 60)
+    """
+
+    def __init__(self, opener, max_bytes=256 * 1024 * 1024, idle_timeout=300,
+                 max_open=4, fetch_size=1000, reap_interval=None):
+        self._opener = opener
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.max_open = max_open
+        self.fetch_size = fetch_size
+        self.reap_interval = reap_interval or min(idle_timeout / 4, 60)
+        self._lock = threading.Lock()
+        self._results = {}
+        self._reaper = None
+        self._stop = threading.Event()
+        self._stats = {'opened': 0, 'from_cache': 0, 'pages': 0,
+                       'evicted_idle': 0, 'evicted_memory': 0, 'expired_tokens': 0}
+
+    def start(self, query, page_size, cached_table=None, **open_options):
+        """
+        Start paging a query and return its first page
+
+        Args:
+            query (str): SQL query
+            page_size (int): Rows per page
+            cached_table (pyarrow.Table): Already-cached full result, if any
+            **open_options: Passed to the opener, e.g. timeout
+
+        Returns:
+            tuple: (page, next_token, total_rows) - total_rows is None until
+            the result set is exhausted
+        """
+        self._evict()
+        result_id = secrets.token_urlsafe(12)
+        if cached_table is not None:
+            result = _ResultSet(result_id, table=cached_table)
+            stat = 'from_cache'
+        else:
+            self._make_room_for_cursor()
+            result = _ResultSet(result_id, source=self._opener(query, **open_options))
+            stat = 'opened'
+        with self._lock:
+            self._results[result_id] = result
+            self._stats[stat] += 1
+            if result.source is not None:
+                self._ensure_reaper()
+        return self._page(result, 0, page_size)
+
+    def _ensure_reaper(self):
+        """Start the idle-result thread; called with self._lock held"""
+        if self._reaper is None and not self._stop.is_set():
+            self._reaper = threading.Thread(target=self._reap_loop, name="paged-result-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while not self._stop.wait(self.reap_interval):
+            try:
+                self._evict()
+            except Exception as e:
+                print(f"Paged result eviction failed: {e}")
+
+    def next(self, token, page_size):
+        """
+        Return the page a token points at
+
+        Raises:
+            PageTokenExpired: If the result set was evicted or never existed
+        """
+        result_id, offset = decode_page_token(token)
+        self._evict()
+        with self._lock:
+            result = self._results.get(result_id)
+            if result is None:
+                self._stats['expired_tokens'] += 1
+        if result is None:
+            raise PageTokenExpired("Page token has expired; re-run the query")
+        return self._page(result, offset, page_size)
+
+    def _page(self, result, offset, page_size):
+        with result.lock:
+            result.last_access = time.monotonic()
+            try:
+                page = result.read(offset, page_size, self.fetch_size)
+            except Exception:
+                self._drop(result.id, failed=True)
+                raise
+            end = offset + page.num_rows
+            has_more = end < result.fetched_rows or not result.exhausted
+            total = result.fetched_rows if result.exhausted else None
+        with self._lock:
+            self._stats['pages'] += 1
+        self._evict()
+        next_token = encode_page_token(result.id, end) if has_more else None
+        return page, next_token, total
+
+    def _drop(self, result_id, failed=False):
+        with self._lock:
+            result = self._results.pop(result_id, None)
+        if result is not None:
+            # Wait out a read in progress rather than closing the cursor under it
+            with result.lock:
+                result.close_source(failed=failed)
+
+    def _make_room_for_cursor(self):
+        """Drop least recently used cursor-holding result sets beyond max_open - 1"""
+        with self._lock:
+            open_results = sorted((r for r in self._results.values() if r.source is not None),
+                                  key=lambda r: r.last_access)
+            victims = open_results[:max(len(open_results) - self.max_open + 1, 0)]
+            self._stats['evicted_memory'] += len(victims)
+        for result in victims:
+            self._drop(result.id)
+
+    def _evict(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [r for r in self._results.values() if now - r.last_access > self.idle_timeout]
+            self._stats['evicted_idle'] += len(idle)
+            remaining = sorted((r for r in self._results.values() if r not in idle),
+                               key=lambda r: r.last_access)
+            total = sum(r.nbytes for r in remaining)
+            over = []
+            # Keep the most recently used result set even if it alone is over budget
+            while total > self.max_bytes and len(remaining) > 1:
+                victim = remaining.pop(0)
+                total -= victim.nbytes
+                over.append(victim)
+            self._stats['evicted_memory'] += len(over)
+        for result in idle + over:
+            self._drop(result.id)
+
+    def stats(self):
+        """
+        Paging counters
+
+        Returns:
+            dict: result sets held, open cursors, buffered bytes and counters
+        """
+        with self._lock:
+            results = list(self._results.values())
+            return {
+                'result_sets': len(results),
+                'open_cursors': sum(1 for r in results if r.source is not None),
+                'bytes': sum(r.nbytes for r in results),
+                'max_bytes': self.max_bytes,
+                **self._stats,
+            }
+
+    def close(self):
+        """Drop every result set and release their connections"""
+        self._stop.set()
+        with self._lock:
+            ids = list(self._results)
+        for result_id in ids:
+            self._drop(result_id)
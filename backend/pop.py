@@ -0,0 +1,198 @@
+"""
+Period-over-period series
+Computes a metric for the current window and for the same window shifted back
+by compareCount compareUnits, with a single scan of the table
+"""
+
+from dataclasses import replace
+from datetime import datetime, timezone
+
+from charts import (
+    interval_sql, is_bucket_aligned, range_condition, resolve_window, shift_time,
+    truncate_time, where_conditions,
+)
+from db import SERIES_OPEN_BUCKET_TTL, fetch_arrow_cached, fetch_series
+from schema import quote_identifier, quote_table_name
+from timeseries import naive_utc
+
+COMPARE_UNITS = ('day', 'week', 'month', 'quarter', 'year')
+_UNIT_DAYS = {'day': 1, 'week': 7}
+_UNIT_MONTHS = {'month': 1, 'quarter': 3, 'year': 12}
+_GRAIN_MONTHS = {'month': 1, 'quarter': 3, 'year': 12}
+
+
+def parse_compare(unit, count):
+    """
+    Validate compareUnit/compareCount
+
+    Returns:
+        tuple: (unit, count)
+
+    Raises:
+        ValueError: If the unit or count is invalid
+    """
+    unit = str(unit or '').lower()
+    if unit not in COMPARE_UNITS:
+        raise ValueError(f"Unknown compare unit '{unit}': expected one of {', '.join(COMPARE_UNITS)}")
+    interval_sql(unit, count)
+    return unit, int(count)
+
+
+def is_aligned(grain, unit, count):
+    """
+    True if shifting by count units maps grain buckets one-to-one
+
+    Then the previous period's series is just the unshifted series of the
+    earlier window, so both windows can come from the per-bucket series
+    cache and be reused (this week's series is next week's previous period). Shifts such as one month
+    at day grain fold several days into one and are computed with
+    conditional aggregation instead.
+    """
+    if unit in _UNIT_DAYS:
+        days = _UNIT_DAYS[unit] * count
+        return grain in ('hour', 'day') or (grain == 'week' and days % 7 == 0)
+    months = _UNIT_MONTHS[unit] * count
+    return grain in _GRAIN_MONTHS and months % _GRAIN_MONTHS[grain] == 0
+
+
+def period_ranges(spec, unit, count, now):
+    """
+    Current and previous [start, end) windows
+
+    Without a trailing window or date range the current period is the last
+    count units up to now.
+
+    Returns:
+        tuple: ((start, end), (previous_start, previous_end))
+
+    Raises:
+        ValueError: If the spec's window is open on one side
+    """
+    if not spec.trailing and spec.start is None and spec.end is None:
+        spec = replace(spec, trailing=(unit, count))
+    start, end = resolve_window(spec, now)
+    if start is None or end is None:
+        raise ValueError("Period-over-period needs a trailing window or a date_range with start and end")
+    return (start, end), (shift_time(start, unit, -count), shift_time(end, unit, -count))
+
+
+def series_name(metric):
+    """Base column name for a metric's series, e.g. sum_fare_amount"""
+    return 'count' if metric.column == '*' else f"{metric.aggregation}_{metric.column}"
+
+
+def build_pop_query(spec, unit, count, current, previous):
+    """
+    One-scan period-over-period query using conditional aggregation
+
+    Every row is read once and paired with a two-row inline table: the
+    unshifted copy feeds the current value and the copy moved forward by the
+    compare interval feeds the previous value of the bucket it lands in.
+
+    Returns:
+        str: SQL returning time, current_<series> and previous_<series>
+    """
+    metric = spec.metrics[0]
+    column = quote_identifier(spec.time_column)
+    name = series_name(metric)
+    value = '1' if metric.column == '*' else quote_identifier(metric.column)
+    current_value = metric.expression(f"CASE WHEN NOT p.shifted THEN {value} END")
+    previous_value = metric.expression(f"CASE WHEN p.shifted THEN {value} END")
+    moved = f"CASE WHEN p.shifted THEN {column} + {interval_sql(unit, count)} ELSE {column} END"
+    in_period = (f"CASE WHEN p.shifted THEN {range_condition(spec.time_column, [previous])} "
+                 f"ELSE {range_condition(spec.time_column, [current])} END")
+    conditions = where_conditions(spec, ranges=[previous, current]) + [in_period]
+    return (
+        f"SELECT DATE_TRUNC('{spec.grain.upper()}', {moved}) AS `time`, "
+        f"{current_value} AS {quote_identifier('current_' + name)}, "
+        f"{previous_value} AS {quote_identifier('previous_' + name)}\n"
+        f"FROM {quote_table_name(spec.table)} CROSS JOIN (VALUES (false), (true)) AS p(shifted)\n"
+        f"WHERE {' AND '.join(conditions)}\n"
+        "GROUP BY 1\n"
+        "ORDER BY 1"
+    )
+
+
+def _series(table, name):
+    """{bucket time: value} from a time-series result"""
+    times = [naive_utc(t) for t in table.column('time').to_pylist()]
+    return dict(zip(times, table.column(name).to_pylist()))
+
+
+def _ttl(window, now, open_ttl):
+    """Short TTL for a window whose last bucket is still filling up"""
+    return open_ttl if window[1] > now else None
+
+
+def _build_table(spec, unit, count, times, current_values, previous_values):
+    import pyarrow as pa
+    name = series_name(spec.metrics[0])
+    return pa.table({
+        'time': pa.array(times, pa.timestamp('us')),
+        f'current_{name}': current_values,
+        f'previous_{name}': previous_values,
+        'previous_time': pa.array([shift_time(t, unit, -count) for t in times], pa.timestamp('us')),
+    })
+
+
+def period_over_period(spec, unit, count, now=None, bypass=False, open_ttl=SERIES_OPEN_BUCKET_TTL,
+                       timeout=None, attach_cancel=None):
+    """
+    Compute a metric's current and previous period series
+
+    For aligned shifts (see is_aligned) over bucket-aligned windows both
+    windows are read through db.fetch_series(): whatever neither window has
+    cached is fetched in one scan, and a window computed as the current
+    period is reused when it later comes around as the previous one. Other
+    shifts run build_pop_query(), also a single scan.
+
+    Args:
+        spec (charts.ChartSpec): Validated spec; only the first metric is used
+        unit (str): Compare unit (day, week, month, quarter, year)
+        count (int): Compare units to shift back
+        now (datetime): Naive UTC time for trailing windows (default utcnow)
+        bypass (bool): Skip cache lookups
+        open_ttl (float): Result cache TTL for an unaligned query whose
+            window includes now
+        timeout (float): As for db.fetch_arrow_cached()
+        attach_cancel (callable): As for db.fetch_arrow_cached()
+
+    Returns:
+        tuple: (pyarrow.Table, cache_status) - columns time,
+        current_<series>, previous_<series>, previous_time; status is HIT, ROLLUP,
+        PARTIAL, MISS, BYPASS or SHARED
+    """
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    current, previous = period_ranges(spec, unit, count, now)
+    metric = spec.metrics[0]
+    name = series_name(metric)
+    spec = replace(spec, metrics=(replace(metric, name=name),), trailing=None)
+    first_bucket = truncate_time(current[0], spec.grain)
+
+    if is_aligned(spec.grain, unit, count) and is_bucket_aligned(current, spec.grain):
+        table, status, _ = fetch_series(spec, [previous, current], now=now, bypass=bypass,
+                                        timeout=timeout, attach_cancel=attach_cancel)
+        series = _series(table, name)
+        times = sorted(
+            {t for t in series if current[0] <= t < current[1]}
+            | {shift_time(t, unit, count) for t in series if previous[0] <= t < previous[1]}
+        )
+        return _build_table(
+            spec, unit, count, times,
+            [series.get(t) if current[0] <= t < current[1] else None for t in times],
+            [series.get(shift_time(t, unit, -count)) for t in times]
+        ), status
+
+    table, status = fetch_arrow_cached(
+        build_pop_query(spec, unit, count, current, previous),
+        bypass=bypass,
+        ttl=_ttl(current, now, open_ttl),
+        timeout=timeout,
+        attach_cancel=attach_cancel
+    )
+    current_series = _series(table, f'current_{name}')
+    previous_series = _series(table, f'previous_{name}')
+    times = sorted(t for t in current_series if first_bucket <= t < current[1])
+    return _build_table(spec, unit, count, times,
+                        [current_series[t] for t in times],
+                        [previous_series[t] for t in times]), status
@@ -0,0 +1,205 @@
+"""
+Table schema parsing and role inference
+Turns DESCRIBE TABLE / information_schema rows into typed column records
+"""
+
+import re
+from dataclasses import asdict, dataclass
+
+# catalog.schema.table, each part plain or `backtick quoted`
+_IDENTIFIER = r"(?:[A-Za-z0-9_\-]+|`(?:[^`]|``)+`)"
+_TABLE_NAME = re.compile(rf"^({_IDENTIFIER})\.({_IDENTIFIER})\.({_IDENTIFIER})$")
+
+TIME_TYPES = ('timestamp', 'timestamp_ntz', 'date')
+METRIC_TYPES = ('tinyint', 'smallint', 'int', 'integer', 'bigint', 'long',
+                'float', 'double', 'decimal', 'numeric')
+DIMENSION_TYPES = ('string', 'varchar', 'char', 'boolean')
+
+
+@dataclass(frozen=True)
+class ColumnInfo:
+    """One table column, ready for the explorer's role assignment"""
+    name: str
+    type: str
+    role: str
+    position: int
+    nullable: bool = True
+    comment: str = None
+
+    def to_dict(self):
+        return asdict(self)
+
+    def to_describe_row(self):
+        """The DESCRIBE TABLE row shape older clients expect"""
+        return {'col_name': self.name, 'data_type': self.type, 'comment': self.comment}
+
+
+def base_type(data_type):
+    """
+    Lower-cased type without parameters, e.g. "DECIMAL(10,2)" -> "decimal"
+    """
+    return re.split(r"[(<\s]", (data_type or '').strip().lower(), maxsplit=1)[0]
+
+
+def infer_role(data_type):
+    """
+    Default chart role for a column type
+
+    Returns:
+        str: "time", "metric", "dimension" or "unassigned"
+    """
+    kind = base_type(data_type)
+    if kind in TIME_TYPES:
+        return 'time'
+    if kind in METRIC_TYPES:
+        return 'metric'
+    if kind in DIMENSION_TYPES:
+        return 'dimension'
+    return 'unassigned'
+
+
+def make_column(name, data_type, position, nullable=True, comment=None):
+    data_type = (data_type or '').lower()
+    return ColumnInfo(
+        name=name,
+        type=data_type,
+        role=infer_role(data_type),
+        position=position,
+        nullable=nullable,
+        comment=comment or None,
+    )
+
+
+def parse_describe_rows(rows):
+    """
+    Parse DESCRIBE TABLE output into column records
+
+    Stops at the first blank or "# ..." row, where partitioning and detailed
+    table information begin.
+
+    Args:
+        rows (list): Dicts with col_name, data_type and comment
+
+    Returns:
+        list: ColumnInfo records in table order
+    """
+    columns = []
+    for row in rows:
+        name = (row.get('col_name') or '').strip()
+        if not name or name.startswith('#'):
+            break
+        columns.append(make_column(name, row.get('data_type'), len(columns) + 1,
+                                   comment=row.get('comment')))
+    return columns
+
+
+def _unquote(part):
+    if part.startswith('`'):
+        return part[1:-1].replace('``', '`')
+    return part
+
+
+def split_table_name(table_name):
+    """
+    Validate and split a fully qualified table name
+
+    Args:
+        table_name (str): catalog.schema.table (parts may be backtick quoted)
+
+    Returns:
+        tuple: (catalog, schema, table), unquoted and lower-cased
+
+    Raises:
+        ValueError: If the name is not a three-part identifier
+    """
+    match = _TABLE_NAME.match((table_name or '').strip())
+    if not match:
+        raise ValueError(f"Invalid table name '{table_name}': expected catalog.schema.table")
+    return tuple(_unquote(part).lower() for part in match.groups())
+
+
+def table_key(table_name):
+    """Canonical lower-case "catalog.schema.table" for cache keys and lookups"""
+    return '.'.join(split_table_name(table_name))
+
+
+def sql_literal(value):
+    """Single-quoted SQL string literal"""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def quote_identifier(identifier):
+    """Backtick-quoted SQL identifier"""
+    return '`' + identifier.replace('`', '``') + '`'
+
+
+def quote_table_name(table_name):
+    """
+    Validated, fully quoted `catalog`.`schema`.`table` for use in SQL
+
+    Raises:
+        ValueError: If the name is not a three-part identifier
+    """
+    return '.'.join(quote_identifier(part) for part in split_table_name(table_name))
+
+
+def build_columns_query(table_names):
+    """
+    One information_schema.columns query covering many tables
+
+    Each catalog has its own information_schema, so the per-catalog selects
+    are combined with UNION ALL into a single statement.
+
+    Args:
+        table_names (list): Fully qualified table names
+
+    Returns:
+        str: SQL returning table_catalog, table_schema, table_name,
+        column_name, full_data_type, is_nullable, ordinal_position, comment
+    """
+    by_catalog = {}
+    for name in table_names:
+        catalog, schema_name, table = split_table_name(name)
+        by_catalog.setdefault(catalog, set()).add((schema_name, table))
+
+    selects = []
+    for catalog in sorted(by_catalog):
+        conditions = " OR ".join(
+            f"(lower(table_schema) = {sql_literal(schema_name)} AND lower(table_name) = {sql_literal(table)})"
+            for schema_name, table in sorted(by_catalog[catalog])
+        )
+        selects.append(
+            "SELECT table_catalog, table_schema, table_name, column_name, full_data_type, "
+            "is_nullable, ordinal_position, comment "
+            f"FROM {quote_identifier(catalog)}.information_schema.columns WHERE {conditions}"
+        )
+    return "\nUNION ALL\n".join(selects)
+
+
+def parse_columns_rows(rows):
+    """
+    Group information_schema.columns rows into column records per table
+
+    Returns:
+        dict: {"catalog.schema.table": [ColumnInfo, ...]} ordered by position
+    """
+    tables = {}
+    for row in rows:
+        key = '.'.join(str(row[part]).lower() for part in
+                       ('table_catalog', 'table_schema', 'table_name'))
+        tables.setdefault(key, []).append(row)
+
+    parsed = {}
+    for key, table_rows in tables.items():
+        table_rows.sort(key=lambda row: row['ordinal_position'])
+        parsed[key] = [
+            make_column(
+                row['column_name'],
+                row['full_data_type'],
+                position,
+                nullable=str(row.get('is_nullable', 'YES')).upper() in ('YES', 'TRUE'),
+                comment=row.get('comment'),
+            )
+            for position, row in enumerate(table_rows, start=1)
+        ]
+    return parsed
@@ -0,0 +1,125 @@
+"""
+Single-flight coalescing of identical in-flight work
+Concurrent callers with the same key share one execution and its outcome
+"""
+
+import threading
+
+
+class TooManyWaiters(Exception):
+    """Raised when a key already has max_waiters callers queued on it"""
+
+
+class WaitTimeout(Exception):
+    """Raised when a caller gives up waiting; the execution keeps running"""
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key
+
+    The first caller for a key runs the work on its own thread, so the work
+    stays within whatever bounds that thread (e.g. the job executor's worker
+    count); later callers wait for it. A waiter that times out detaches and
+    the work continues for the others. Results are not kept after the work
+    finishes - pair this with a cache for that.
+
+    Args:
+        max_waiters (int): Callers allowed to wait on one key at once
+    """
+
+    def __init__(self, max_waiters=64):
+        self.max_waiters = max_waiters
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {'executions': 0, 'shared': 0, 'rejected': 0, 'detached': 0}
+
+    def do(self, key, fn, timeout=None):
+        """
+        Run fn once for all concurrent callers with this key
+
+        Args:
+            key: Hashable key identifying the work
+            fn (callable): Work to run, called with no arguments
+            timeout (float): Seconds a waiter will wait (None waits forever);
+                the caller that runs fn returns when fn does
+
+        Returns:
+            tuple: (result, shared) - shared is True if another caller started it
+
+        Raises:
+            TooManyWaiters: If the key already has max_waiters callers
+            WaitTimeout: If timeout passed before the work finished
+            Exception: Whatever fn raised, re-raised in every caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._stats['executions'] += 1
+            elif call.waiters >= self.max_waiters:
+                self._stats['rejected'] += 1
+                raise TooManyWaiters(
+                    f"{call.waiters} requests are already waiting on this query"
+                )
+            else:
+                self._stats['shared'] += 1
+            call.waiters += 1
+
+        if leader:
+            self._run(key, call, fn)
+            finished = True
+        else:
+            finished = call.done.wait(timeout)
+        with self._lock:
+            call.waiters -= 1
+            if not finished:
+                self._stats['detached'] += 1
+        if not finished:
+            raise WaitTimeout(f"Gave up waiting after {timeout}s; the query is still running")
+        if call.error is not None:
+            raise call.error
+        return call.result, not leader
+
+    def waiters(self, key):
+        """Number of callers currently waiting on key (0 if not in flight)"""
+        with self._lock:
+            call = self._calls.get(key)
+            return call.waiters if call is not None else 0
+
+    def _run(self, key, call, fn):
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        """
+        Coalescing counters
+
+        Returns:
+            dict: in_flight keys, waiters and cumulative counters
+        """
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'waiters': sum(call.waiters for call in self._calls.values()),
+                **self._stats,
+            }
@@ -0,0 +1,377 @@
+"""
+Slow-query log
+Records warehouse queries slower than a threshold - SQL fingerprint (literals
+replaced by ?), warehouse query id, duration, rows, bytes and the endpoint
+that ran them - in an append-only local SQLite file with size-based
+rotation, and reports the most expensive fingerprints
+"""
+
+import contextvars
+import hashlib
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Same tokens as cache._SQL_TOKEN: string literals and quoted identifiers
+_SQL_TOKEN = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.])")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+REPORT_ORDERS = ('total', 'p95', 'count', 'max')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS slow_queries (
+    recorded_at REAL NOT NULL,
+    fingerprint TEXT NOT NULL,
+    normalized_sql TEXT NOT NULL,
+    sample_sql TEXT NOT NULL,
+    query_id TEXT,
+    endpoint TEXT,
+    status TEXT NOT NULL,
+    duration_ms REAL NOT NULL,
+    row_count INTEGER,
+    bytes INTEGER
+)
+"""
+
+_INSERT = """
+INSERT INTO slow_queries (recorded_at, fingerprint, normalized_sql, sample_sql, query_id,
+                          endpoint, status, duration_ms, row_count, bytes)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# The API endpoint serving the current request (set per request by api.py)
+_endpoint = contextvars.ContextVar('slowlog_endpoint', default=None)
+
+
+def set_endpoint(endpoint):
+    """
+    Attribute queries run in this context to endpoint
+
+    Returns:
+        Token for reset_endpoint()
+    """
+    return _endpoint.set(endpoint)
+
+
+def reset_endpoint(token):
+    _endpoint.reset(token)
+
+
+def normalize_literals(query):
+    """
+    SQL with string and numeric literals replaced by ?
+
+    Quoted identifiers are kept, whitespace is collapsed and lists of
+    literals such as IN (1, 2, 3) shrink to a single ?, so queries that
+    differ only in their constants normalize alike.
+
+    Args:
+        query (str): SQL text
+
+    Returns:
+        str: Normalized SQL
+    """
+    parts = _SQL_TOKEN.split(query)
+    for i, part in enumerate(parts):
+        if i % 2:
+            if not part.startswith('`'):
+                parts[i] = '?'
+        else:
+            parts[i] = _WHITESPACE.sub(' ', _NUMBER.sub('?', part))
+    normalized = _PLACEHOLDER_LIST.sub('?', ''.join(parts)).strip()
+    while normalized.endswith(';'):
+        normalized = normalized[:-1].rstrip()
+    return normalized
+
+
+def fingerprint(query):
+    """
+    Short stable id of a query's shape
+
+    Returns:
+        tuple: (fingerprint, normalized SQL)
+    """
+    normalized = normalize_literals(query)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16], normalized
+
+
+class QueryRecord:
+    """
+    One warehouse query being timed; see SlowQueryLog.start()
+
+    Set rows and nbytes as results arrive, then call finish().
+    """
+
+    def __init__(self, log, query, cursor):
+        self.log = log
+        self.query = query
+        self.cursor = cursor
+        self.endpoint = _endpoint.get()
+        self.rows = None
+        self.nbytes = None
+        self.started = time.perf_counter()
+        self._finished = False
+
+    def add(self, rows=0, nbytes=None):
+        """Count a fetched batch"""
+        self.rows = (self.rows or 0) + rows
+        if nbytes is not None:
+            self.nbytes = (self.nbytes or 0) + nbytes
+
+    def finish(self, status='ok'):
+        """Stop the clock and log the query if it was slow (only the first call counts)"""
+        if self._finished:
+            return
+        self._finished = True
+        self.log.record(self, time.perf_counter() - self.started, status)
+
+
+class SlowQueryLog:
+    """
+    Append-only SQLite log of queries slower than threshold_ms
+
+    Records are queued and written in batches by a background thread, so the
+    query path never waits on the disk. When the file passes max_bytes it is
+    renamed to <path>.1 (older files shift up to <path>.<backups>) and a new
+    one is started; reports read the current file and its backups.
+
+    Args:
+        path (str): SQLite file
+        threshold_ms (float): Queries at least this slow are logged (0 logs all)
+        max_bytes (int): Size at which the file is rotated
+        backups (int): Rotated files kept
+        max_pending (int): Records buffered for the writer before new ones are dropped
+        flush_interval (float): Seconds between writer batches
+    """
+
+    def __init__(self, path, threshold_ms=250, max_bytes=16 * 1024 * 1024, backups=2,
+                 max_pending=10000, flush_interval=1.0):
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._wake = threading.Event()
+        # Rows written or given up on, for flush()
+        self._settled = 0
+        self._settled_changed = threading.Condition()
+        self._stats = {'recorded': 0, 'written': 0, 'dropped': 0, 'rotations': 0, 'write_errors': 0}
+
+    def start(self, query, cursor=None):
+        """
+        Begin timing a query; read the warehouse query id from cursor at the end
+
+        Returns:
+            QueryRecord
+        """
+        return QueryRecord(self, query, cursor)
+
+    @contextmanager
+    def track(self, query, cursor=None):
+        """
+        Time a with block that executes and fetches a query
+
+        Yields:
+            QueryRecord: add() fetched rows and bytes to it
+        """
+        entry = self.start(query, cursor)
+        try:
+            yield entry
+        except BaseException:
+            entry.finish('error')
+            raise
+        entry.finish()
+
+    def record(self, entry, seconds, status):
+        duration_ms = seconds * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        query_id = _query_id(entry.cursor)
+        fp, normalized = fingerprint(entry.query)
+        row = (time.time(), fp, normalized, entry.query, query_id, entry.endpoint, status,
+               duration_ms, entry.rows, entry.nbytes)
+        with self._lock:
+            try:
+                self._pending.put_nowait(row)
+            except queue.Full:
+                self._stats['dropped'] += 1
+                return
+            self._stats['recorded'] += 1
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="slow-query-log", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        connection = None
+        while True:
+            rows = [self._pending.get()]
+            # Let a batch build up unless someone is waiting in flush()
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            while True:
+                try:
+                    rows.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                connection = self._write(connection, rows)
+            except Exception as e:
+                print(f"Slow-query log write failed: {e}")
+                with self._lock:
+                    self._stats['write_errors'] += 1
+                connection = None
+            with self._settled_changed:
+                self._settled += len(rows)
+                self._settled_changed.notify_all()
+
+    def _write(self, connection, rows):
+        # Checked before (re)opening too, so a restart or a reset after an
+        # error doesn't keep appending to a full file
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            if connection is not None:
+                connection.close()
+                connection = None
+            self._rotate()
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.execute(_SCHEMA)
+        with connection:
+            connection.executemany(_INSERT, rows)
+        with self._lock:
+            self._stats['written'] += len(rows)
+        return connection
+
+    def _rotate(self):
+        for index in range(self.backups, 0, -1):
+            source = self.path if index == 1 else f"{self.path}.{index - 1}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index}")
+        if self.backups == 0 and os.path.exists(self.path):
+            os.remove(self.path)
+        with self._lock:
+            self._stats['rotations'] += 1
+
+    def flush(self, timeout=5):
+        """Wait until records logged so far are on disk"""
+        with self._lock:
+            target = self._stats['recorded']
+        self._wake.set()
+        with self._settled_changed:
+            self._settled_changed.wait_for(lambda: self._settled >= target, timeout)
+
+    def files(self):
+        """The current log file and its backups that exist, newest first"""
+        paths = [self.path] + [f"{self.path}.{index}" for index in range(1, self.backups + 1)]
+        return [path for path in paths if os.path.exists(path)]
+
+    def report(self, limit=20, order='total', since=None):
+        """
+        The most expensive query shapes
+
+        Args:
+            limit (int): Fingerprints to return
+            order (str): "total" (time summed over runs), "p95", "count" or "max"
+            since (float): Only queries logged in the last since seconds
+
+        Returns:
+            list: One dict per fingerprint - fingerprint, sql (normalized),
+            sample_sql, count, total_ms, avg_ms, p95_ms, max_ms, avg_rows,
+            avg_bytes, errors, endpoints ({name: count}), last_query_id and
+            last_seen (epoch seconds)
+        """
+        if order not in REPORT_ORDERS:
+            raise ValueError(f"order must be one of {', '.join(REPORT_ORDERS)}")
+        self.flush()
+        cutoff = time.time() - since if since else 0
+        groups = {}
+        for path in reversed(self.files()):
+            connection = sqlite3.connect(path)
+            try:
+                rows = connection.execute(
+                    "SELECT recorded_at, fingerprint, normalized_sql, sample_sql, query_id, endpoint, status,"
+                    " duration_ms, row_count, bytes FROM slow_queries WHERE recorded_at >= ?"
+                    " ORDER BY recorded_at", (cutoff,)
+                ).fetchall()
+            except sqlite3.Error:
+                rows = []
+            finally:
+                connection.close()
+            for recorded_at, fp, normalized, sample, query_id, endpoint, status, duration_ms, rows_, nbytes in rows:
+                group = groups.setdefault(fp, {
+                    'fingerprint': fp, 'sql': normalized, 'durations': [], 'rows': [], 'bytes': [],
+                    'errors': 0, 'endpoints': {}
+                })
+                group['durations'].append(duration_ms)
+                if rows_ is not None:
+                    group['rows'].append(rows_)
+                if nbytes is not None:
+                    group['bytes'].append(nbytes)
+                if status != 'ok':
+                    group['errors'] += 1
+                name = endpoint or 'unknown'
+                group['endpoints'][name] = group['endpoints'].get(name, 0) + 1
+                group.update(sample_sql=sample, last_query_id=query_id or group.get('last_query_id'),
+                             last_seen=recorded_at)
+
+        summaries = [_summarize(group) for group in groups.values()]
+        key = {'total': 'total_ms', 'p95': 'p95_ms', 'count': 'count', 'max': 'max_ms'}[order]
+        summaries.sort(key=lambda summary: summary[key], reverse=True)
+        return summaries[:limit]
+
+    def stats(self):
+        """
+        Returns:
+            dict: recorded/written/dropped/rotation counters, the threshold
+            and the log's size on disk
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._pending.qsize()
+        stats['threshold_ms'] = self.threshold_ms
+        stats['bytes_on_disk'] = sum(os.path.getsize(path) for path in self.files())
+        return stats
+
+
+def _query_id(cursor):
+    """The warehouse's id for the cursor's last statement, if the connector exposes it"""
+    if cursor is None:
+        return None
+    for name in ('query_id', 'active_query_id'):
+        try:
+            value = getattr(cursor, name, None)
+        except Exception:
+            continue
+        if value:
+            return str(value)
+    return None
+
+
+def _summarize(group):
+    durations = sorted(group['durations'])
+    count = len(durations)
+    total = sum(durations)
+    return {
+        'fingerprint': group['fingerprint'],
+        'sql': group['sql'],
+        'sample_sql': group['sample_sql'],
+        'count': count,
+        'total_ms': round(total, 1),
+        'avg_ms': round(total / count, 1),
+        'p95_ms': round(durations[min(int(count * 0.95), count - 1)], 1),
+        'max_ms': round(durations[-1], 1),
+        'avg_rows': round(sum(group['rows']) / len(group['rows']), 1) if group['rows'] else None,
+        'avg_bytes': round(sum(group['bytes']) / len(group['bytes'])) if group['bytes'] else None,
+        'errors': group['errors'],
+        'endpoints': group['endpoints'],
+        'last_query_id': group.get('last_query_id'),
+        'last_seen': group['last_seen'],
+    }
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Offline tests for admission control (admission.py and the query endpoints)
+"""
+
+import threading
+import time
+
+import pytest
+
+import api
+from admission import AdmissionController, AdmissionQueueFull, ClientLimitExceeded, QueueTimeout
+from conftest import TRIPS_TABLE
+from jobs import JobQueueFull, QueryTimeout
+
+
+def queue(controller, client, order):
+    """Start a thread that waits for a slot and records when it got one"""
+    def run():
+        ticket = controller.acquire(client)
+        order.append(client)
+        ticket.release()
+
+    queued = controller.stats()['queued']
+    thread = threading.Thread(target=run)
+    thread.start()
+    deadline = time.monotonic() + 1
+    while controller.stats()['queued'] == queued:
+        if time.monotonic() > deadline:
+            raise AssertionError("waiter was not queued")
+        time.sleep(0.001)
+    return thread
+
+
+def test_freed_slots_go_round_robin_across_clients():
+    controller = AdmissionController(max_concurrent=1, max_per_client=1)
+    held = controller.acquire('heavy')
+    order = []
+    threads = [queue(controller, client, order) for client in ['heavy', 'heavy', 'heavy', 'light', 'other']]
+
+    held.release()
+    for thread in threads:
+        thread.join(1)
+
+    assert order == ['heavy', 'light', 'other', 'heavy', 'heavy']
+    stats = controller.stats()
+    assert stats['running'] == 0 and stats['queued'] == 0
+    assert stats['admitted'] == 6 and stats['queued_total'] == 5
+
+
+def test_per_client_limit_leaves_room_for_others():
+    controller = AdmissionController(max_concurrent=3, max_per_client=2, max_client_queued=1, max_wait=0.05)
+    tickets = [controller.acquire('a'), controller.acquire('a')]
+
+    # 'a' is at its limit, but 'b' still gets the free slot straight away
+    assert controller.acquire('b').waited == 0.0
+    with pytest.raises(QueueTimeout):
+        controller.acquire('a')
+
+    for ticket in tickets:
+        ticket.release()
+        ticket.release()  # only the first release counts
+    assert controller.stats()['running'] == 1
+
+
+def test_rejects_when_client_or_queue_is_full():
+    controller = AdmissionController(max_concurrent=1, max_queued=2, max_client_queued=1, max_wait=1)
+    held = controller.acquire('a')
+    waiter = threading.Thread(target=lambda: controller.acquire('a').release())
+    waiter.start()
+    while controller.stats()['queued'] < 1:
+        time.sleep(0.001)
+
+    with pytest.raises(ClientLimitExceeded) as rejected:
+        controller.acquire('a')
+    assert rejected.value.status_code == 429 and rejected.value.retry_after >= 1
+
+    other = threading.Thread(target=lambda: controller.acquire('b').release())
+    other.start()
+    while controller.stats()['queued'] < 2:
+        time.sleep(0.001)
+    with pytest.raises(AdmissionQueueFull) as rejected:
+        controller.acquire('c')
+    assert rejected.value.status_code == 503
+
+    held.release()
+    waiter.join(1)
+    other.join(1)
+    stats = controller.stats()
+    assert stats['rejected_client'] == 1 and stats['rejected_full'] == 1
+    assert stats['queued'] == 0 and stats['running'] == 0
+
+
+def test_query_endpoint_answers_429_with_retry_after(warehouse, client, monkeypatch):
+    monkeypatch.setattr(api, 'admission', AdmissionController(max_concurrent=1, max_client_queued=0))
+    held = api.admission.acquire('alice@example.com')
+    headers = {'X-Forwarded-Email': 'alice@example.com'}
+
+    response = client.post('/api/query', json={'query': 'SELECT 1'}, headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+    held.release()
+    assert client.post('/api/query', json={'query': 'SELECT 1'}, headers=headers).status_code == 200
+    # Cache hits don't take a slot
+    api.admission.acquire('bob')
+    response = client.post('/api/query', json={'query': 'SELECT 1'}, headers=headers)
+    assert response.headers['X-Cache'] == 'HIT'
+
+    stats = client.get('/api/admission').get_json()['admission']
+    assert stats['running'] == 1 and stats['rejected_client'] == 1
+
+
+def test_streams_hold_their_slot_until_closed(warehouse, client):
+    response = client.post('/api/query', json={'query': 'SELECT 1', 'stream': True})
+    assert api.admission.stats()['running'] == 1
+
+    response.get_data()
+    response.close()
+    assert api.admission.stats()['running'] == 0
+
+
+def test_job_chart_and_topn_endpoints_are_admitted(warehouse, trips, client, monkeypatch):
+    monkeypatch.setattr(api, 'admission', AdmissionController(max_concurrent=1, max_client_queued=0))
+    held = api.admission.acquire('alice@example.com')
+    headers = {'X-Forwarded-Email': 'alice@example.com'}
+    requests = [
+        ('/api/jobs', {'query': 'SELECT 2'}),
+        ('/api/chart', {'table': TRIPS_TABLE, 'grain': 'day',
+                        'metrics': [{'column': 'fare_amount', 'aggregation': 'sum'}]}),
+        ('/api/topn', {'table': TRIPS_TABLE, 'dimension': 'vendor', 'metric': 'fare_amount',
+                       'aggregation': 'sum', 'limit': 2}),
+    ]
+
+    for path, body in requests:
+        response = client.post(path, json=body, headers=headers)
+        assert response.status_code == 429, path
+        assert int(response.headers['Retry-After']) >= 1
+    assert api.job_store.stats()['submitted'] == 0
+
+    held.release()
+    job_id = client.post('/api/jobs', json={'query': 'SELECT 2'}, headers=headers).get_json()['job']['job_id']
+    assert api.job_store.get(job_id).wait(2)
+    # The slot is held until the job ends, then handed back
+    deadline = time.monotonic() + 1
+    while api.admission.stats()['running'] and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert api.admission.stats()['running'] == 0 and api.admission.stats()['admitted'] == 2
+
+
+def test_slot_is_held_until_a_timed_out_leader_stops_running(warehouse, client):
+    warehouse.execute_latency = 1
+    leader = []
+    thread = threading.Thread(target=lambda: leader.append(
+        client.post('/api/query', json={'query': 'SELECT 1', 'timeout': 0.2})))
+    thread.start()
+    while not warehouse.cursors:
+        time.sleep(0.005)
+    waiter = threading.Thread(target=client.post, args=('/api/query',),
+                              kwargs={'json': {'query': 'SELECT 1', 'timeout': 3}})
+    waiter.start()
+
+    thread.join(2)
+    assert leader[0].status_code == 504
+    # The waiter keeps the leader's query running, so its slot stays taken
+    assert api.admission.stats()['running'] == 2 and not warehouse.cursors[0].cancelled
+
+    waiter.join(3)
+    deadline = time.monotonic() + 1
+    while api.admission.stats()['running'] and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert api.admission.stats()['running'] == 0
+
+
+def test_query_endpoints_share_error_responses():
+    with api.app.test_request_context():
+        for error, status_code, retry_after in [
+            (ValueError("bad"), 400, None),
+            (ClientLimitExceeded("busy", retry_after=3), 429, '3'),
+            (JobQueueFull("full"), 503, '1'),
+            (QueryTimeout("slow"), 504, None),
+            (RuntimeError("boom"), 500, None),
+        ]:
+            response, code = api._query_error_response(error)
+            assert code == status_code
+            assert response.headers.get('Retry-After') == retry_after
+            assert response.get_json() == {'status': 'error', 'message': str(error)}
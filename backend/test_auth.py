@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the cached token provider in auth.py
+Uses FakeClock so refresh timing is checked without waiting or a workspace
+"""
+
+import threading
+import time
+
+import pytest
+
+from auth import FakeClock, TokenProvider
+
+
+class FakeTokenEndpoint:
+    """Stands in for cfg.authenticate(); returns numbered tokens"""
+
+    def __init__(self, lifetime=3600, delay=0):
+        self.lifetime = lifetime
+        self.delay = delay
+        self.calls = 0
+        self.fail = False
+
+    def __call__(self):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            raise Exception("OAuth endpoint unavailable")
+        return f"token-{self.calls}", self.lifetime
+
+
+def test_token_is_cached_until_refresh_margin():
+    clock = FakeClock()
+    endpoint = FakeTokenEndpoint(lifetime=3600)
+    provider = TokenProvider(endpoint, clock=clock, refresh_margin=300, background=False)
+
+    assert provider.get_token() == "token-1"
+    clock.advance(3000)
+    assert provider.get_token() == "token-1"
+    assert endpoint.calls == 1
+
+    # Inside the refresh margin: fetch a new token
+    clock.advance(301)
+    assert provider.get_token() == "token-2"
+    assert provider.expires_at == pytest.approx(3301 + 3600)
+
+
+def test_default_lifetime_when_expiry_unknown():
+    clock = FakeClock()
+    provider = TokenProvider(lambda: ("pat", None), clock=clock,
+                             refresh_margin=10, default_lifetime=100, background=False)
+
+    provider.get_token()
+    assert provider.expires_at == 100
+
+
+def test_concurrent_callers_share_one_refresh():
+    endpoint = FakeTokenEndpoint(delay=0.05)
+    provider = TokenProvider(endpoint, clock=FakeClock(), background=False)
+    tokens = []
+
+    threads = [threading.Thread(target=lambda: tokens.append(provider.get_token()))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(1)
+
+    assert endpoint.calls == 1
+    assert tokens == ["token-1"] * 8
+
+
+def test_failed_refresh_keeps_valid_token():
+    clock = FakeClock()
+    endpoint = FakeTokenEndpoint(lifetime=100)
+    provider = TokenProvider(endpoint, clock=clock, refresh_margin=20, background=False)
+    provider.get_token()
+
+    endpoint.fail = True
+    clock.advance(90)
+    assert provider.get_token() == "token-1"
+
+    endpoint.fail = False
+    assert provider.get_token() == "token-3"
+    assert provider.stats()['failures'] == 1
+
+
+def test_expired_token_refresh_failure_raises():
+    clock = FakeClock()
+    endpoint = FakeTokenEndpoint(lifetime=100)
+    provider = TokenProvider(endpoint, clock=clock, refresh_margin=20, background=False)
+    provider.get_token()
+
+    endpoint.fail = True
+    clock.advance(101)
+    with pytest.raises(Exception, match="unavailable"):
+        provider.get_token()
+
+
+def test_empty_token_is_an_error():
+    provider = TokenProvider(lambda: ("", None), clock=FakeClock(), background=False)
+
+    with pytest.raises(Exception, match="Could not get authentication token"):
+        provider.get_token()
+
+
+def test_background_refresh_before_expiry():
+    endpoint = FakeTokenEndpoint(lifetime=0.2)
+    provider = TokenProvider(endpoint, refresh_margin=0.1, background=True)
+    try:
+        assert provider.get_token() == "token-1"
+        time.sleep(0.3)
+        # Refreshed by the background thread, not by this call
+        calls_before = endpoint.calls
+        assert calls_before >= 2
+        provider.get_token()
+    finally:
+        provider.stop()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Offline tests for batched requests (batch.py and /api/batch)
+"""
+
+import json
+import time
+
+import pytest
+
+from batch import parse_batch, run_batch
+from conftest import TRIPS_TABLE
+
+
+def test_parse_batch_validates_members():
+    members = parse_batch([
+        {'name': 'cols', 'type': 'schema', 'table': TRIPS_TABLE, 'refresh': True},
+        {'name': 'rows', 'type': 'query', 'query': 'SELECT 1'},
+    ], max_members=5)
+
+    assert [(m.name, m.method, m.path) for m in members] == [
+        ('cols', 'GET', f'/api/schema/{TRIPS_TABLE}'), ('rows', 'POST', '/api/query')]
+    assert members[1].body == {'query': 'SELECT 1'}
+
+    for bad in ([], [{'name': 'a', 'type': 'query'}] * 2, [{'name': 'a', 'type': 'drop'}],
+                [{'name': 'a', 'type': 'query', 'stream': True}], [{'name': 'a', 'type': 'schema'}],
+                [{'type': 'query'}] * 6):
+        with pytest.raises(ValueError):
+            parse_batch(bad, max_members=5)
+
+
+def test_run_batch_reports_slow_members_without_waiting():
+    members = parse_batch([{'name': name, 'type': 'test_connection'} for name in ('fast', 'slow', 'boom')], 5)
+
+    def run_member(member):
+        if member.name == 'slow':
+            time.sleep(1)
+        if member.name == 'boom':
+            raise Exception("exploded")
+        return 200, {'status': 'success'}
+
+    started = time.monotonic()
+    results = {member.name: (status_code, body) for member, status_code, body, _ in
+               run_batch(members, run_member, max_concurrency=3, timeout=0.2)}
+
+    assert time.monotonic() - started < 0.5
+    assert results['fast'] == (200, {'status': 'success'})
+    assert results['boom'] == (500, {'status': 'error', 'message': 'exploded'})
+    assert results['slow'][0] == 504
+
+
+def test_batch_endpoint_returns_partial_results(warehouse, trips, client):
+    warehouse.result = (['name', 'name_rank', 'name_other', '_sum', 'groups'], [('CMT', 1, False, 10.0, 1)])
+    body = client.post('/api/batch', json={'requests': [
+        {'name': 'cols', 'type': 'schema', 'table': TRIPS_TABLE},
+        {'name': 'top', 'type': 'topn', 'table': TRIPS_TABLE, 'dimension': 'vendor',
+         'metric': 'fare_amount', 'aggregation': 'sum', 'limit': 2},
+        {'name': 'bad', 'type': 'topn', 'table': TRIPS_TABLE, 'dimension': 'nope',
+         'metric': 'fare_amount', 'aggregation': 'sum'},
+        {'name': 'ping', 'type': 'test_connection'},
+    ]}).get_json()
+
+    results = body['results']
+    assert list(results) == ['cols', 'top', 'bad', 'ping']
+    assert results['cols']['status_code'] == 200
+    assert results['cols']['columns'][0]['name'] == 'tpep_pickup_datetime'
+    assert results['top']['status_code'] == 200 and results['top']['data'][0]['name'] == 'CMT'
+    assert results['top']['cache'] == 'MISS'
+    assert results['bad']['status_code'] == 400 and results['bad']['status'] == 'error'
+    assert results['ping']['status_code'] == 200
+    assert body['failed'] == ['bad']
+
+
+def test_batch_runs_queries_in_parallel(warehouse, client):
+    warehouse.execute_latency = 0.3
+    requests = [{'name': f'q{i}', 'type': 'query', 'query': f'SELECT {i}'} for i in range(2)]
+
+    started = time.monotonic()
+    body = client.post('/api/batch', json={'requests': requests, 'max_concurrency': 2}).get_json()
+
+    assert time.monotonic() - started < 0.55
+    assert [body['results'][f'q{i}']['row_count'] for i in range(2)] == [25, 25]
+
+
+def test_batch_streams_members_as_they_finish(warehouse, client):
+    response = client.post('/api/batch', json={'stream': True, 'requests': [
+        {'name': 'rows', 'type': 'query', 'query': 'SELECT 1'},
+        {'name': 'broken', 'type': 'query', 'query': 'bad sql'},
+    ]})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert response.mimetype == 'application/x-ndjson'
+    assert {line['name']: line['status_code'] for line in lines[:-1]} == {'rows': 200, 'broken': 500}
+    assert lines[-1] == {'type': 'end', 'status': 'success', 'failed': ['broken']}
+
+
+def test_batch_rejects_bad_requests(client):
+    assert client.post('/api/batch', json={'requests': 'SELECT 1'}).status_code == 400
+    response = client.post('/api/batch', json={'requests': [{'name': 'a', 'type': 'test_connection'}],
+                                               'max_concurrency': 1000})
+    assert response.status_code == 400
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the query result cache (cache.py and /api/query caching)
+"""
+
+from auth import FakeClock
+from cache import ResultCache, is_read_only, normalize_sql
+
+
+def test_normalize_sql_collapses_whitespace_outside_literals():
+    assert normalize_sql("SELECT  *\n  FROM t\tWHERE x = 'a  b' ;") == "SELECT * FROM t WHERE x = 'a  b'"
+    assert normalize_sql("SELECT `my  col` FROM t") == "SELECT `my  col` FROM t"
+    assert normalize_sql("SELECT 1") == normalize_sql("  SELECT   1;;")
+
+
+def test_lru_eviction_under_byte_budget():
+    cache = ResultCache(max_bytes=100, max_entry_bytes=100)
+    cache.put('a', 'A', 40)
+    cache.put('b', 'B', 40)
+    cache.get('a')  # 'b' is now least recently used
+    cache.put('c', 'C', 40)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] == 80
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = ResultCache(max_bytes=100, default_ttl=10, clock=clock)
+    cache.put('short', 1, 1, ttl=5)
+    cache.put('default', 2, 1)
+
+    clock.advance(6)
+    assert cache.get('short') is None
+    assert cache.get('default') == 2
+    clock.advance(5)
+    assert cache.get('default') is None
+    assert cache.stats()['expirations'] == 2
+
+
+def test_oversized_and_zero_ttl_values_are_not_cached():
+    cache = ResultCache(max_bytes=100)
+
+    assert not cache.put('big', 'x', 26)
+    assert not cache.put('off', 'x', 1, ttl=0)
+    assert cache.stats()['rejected'] == 2
+
+
+def test_query_is_served_from_cache(warehouse, client):
+    first = client.post('/api/query', json={'query': 'SELECT * FROM t'})
+    second = client.post('/api/query', json={'query': 'SELECT *\n  FROM t;'})
+
+    assert first.headers['X-Cache'] == 'MISS'
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.get_json() == first.get_json()
+    assert len(warehouse.cursors) == 1
+
+
+def test_bypass_flag_and_header_rerun_query(warehouse, client):
+    client.post('/api/query', json={'query': 'SELECT 1'})
+    by_flag = client.post('/api/query', json={'query': 'SELECT 1', 'cache': False})
+    by_header = client.post('/api/query', json={'query': 'SELECT 1'}, headers={'Cache-Control': 'no-cache'})
+
+    assert by_flag.headers['X-Cache'] == 'BYPASS'
+    assert by_header.headers['X-Cache'] == 'BYPASS'
+    assert len(warehouse.cursors) == 3
+
+
+def test_cache_stats_and_clear_endpoint(warehouse, client):
+    client.post('/api/query', json={'query': 'SELECT 1'})
+    client.post('/api/query', json={'query': 'SELECT 1'})
+
+    stats = client.get('/api/cache').get_json()['cache']
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['entries'] == 1
+
+    assert client.delete('/api/cache').get_json()['removed'] == 1
+    client.post('/api/query', json={'query': 'SELECT 1'})
+    assert len(warehouse.cursors) == 2
+
+
+def test_cache_ttl_is_validated_and_capped(warehouse, client, monkeypatch):
+    import api
+    import db
+
+    for ttl in ('soon', -1, [60]):
+        response = client.post('/api/query', json={'query': 'SELECT 1', 'cache_ttl': ttl})
+        assert response.status_code == 400
+    assert client.post('/api/jobs', json={'query': 'SELECT 1', 'cache_ttl': 'soon'}).status_code == 400
+
+    ttls = []
+    put = db._result_cache.put
+
+    def recording_put(key, value, nbytes, ttl=None):
+        ttls.append(ttl)
+        return put(key, value, nbytes, ttl)
+
+    monkeypatch.setattr(db._result_cache, 'put', recording_put)
+    monkeypatch.setattr(api, 'CACHE_TTL_MAX', 60)
+    assert client.post('/api/query', json={'query': 'SELECT 1', 'cache_ttl': '30'}).status_code == 200
+    assert client.post('/api/query', json={'query': 'SELECT 2', 'cache_ttl': 10 ** 9}).status_code == 200
+    assert ttls == [30, 60]
+
+
+def test_only_read_only_statements_are_cacheable():
+    for query in ("SELECT 1", "  (select * from t);", "-- latest\nWITH x AS (SELECT 1) SELECT * FROM x",
+                  "SHOW TABLES", "DESCRIBE TABLE t", "SELECT 'a; DELETE FROM t'", "SELECT `delete` FROM t"):
+        assert is_read_only(query), query
+    for query in ("DELETE FROM t WHERE id = 1", "INSERT INTO t VALUES (1)", "CREATE TABLE t (id INT)",
+                  "WITH x AS (SELECT 1) INSERT INTO t SELECT * FROM x", "SELECT 1; DROP TABLE t",
+                  "/* SELECT */ UPDATE t SET a = 1", ""):
+        assert not is_read_only(query), query
+
+
+def test_writes_always_reach_the_warehouse(warehouse, client):
+    first = client.post('/api/query', json={'query': 'DELETE FROM t WHERE id = 1'})
+    second = client.post('/api/query', json={'query': 'DELETE FROM t WHERE id = 1'})
+
+    assert first.headers['X-Cache'] == second.headers['X-Cache'] == 'BYPASS'
+    assert len(warehouse.cursors) == 2
+    assert client.get('/api/cache').get_json()['cache']['entries'] == 0
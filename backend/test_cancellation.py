@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Offline tests for query timeouts and client-disconnect cancellation
+(jobs.py, disconnect.py and /api/query)
+"""
+
+import socket
+import threading
+import time
+
+import pytest
+
+import api
+import db
+from conftest import TRIPS_TABLE
+from disconnect import DisconnectWatcher, is_disconnected
+from jobs import TIMED_OUT, JobStore, QueryTimeout
+
+
+@pytest.fixture
+def slow_warehouse(warehouse, monkeypatch):
+    warehouse.execute_latency = 5
+    monkeypatch.setattr(api, 'DISCONNECT_POLL_INTERVAL', 0.01)
+    return warehouse
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+@pytest.fixture
+def gone_client():
+    """A request socket whose client has already hung up"""
+    server, peer = socket.socketpair()
+    peer.close()
+    yield {'werkzeug.socket': server}
+    server.close()
+
+
+def test_job_store_times_out_running_jobs():
+    store = JobStore(max_workers=1, query_timeout=0.05)
+    stopped = threading.Event()
+
+    def work(job):
+        job.attach_cancel(stopped.set)
+        stopped.wait(5)
+        return 'late'
+
+    job = store.submit('SELECT 1', work)
+    assert job.wait(1)
+    assert job.status == TIMED_OUT and stopped.is_set()
+    assert isinstance(job.error, QueryTimeout) and job.result is None
+    assert store.stats()['timed_out'] == 1
+
+    # A per-job timeout overrides the store's default
+    fast = store.submit('SELECT 2', lambda job: time.sleep(0.1) or 'ok', timeout=1)
+    assert fast.wait(1) and fast.result == 'ok'
+
+
+def test_is_disconnected_peeks_without_consuming():
+    server, peer = socket.socketpair()
+    try:
+        assert not is_disconnected(server)
+        peer.sendall(b'G')
+        assert not is_disconnected(server)
+        assert server.recv(1) == b'G'
+        peer.close()
+        assert is_disconnected(server)
+        assert not is_disconnected(None)
+    finally:
+        server.close()
+
+
+def test_watcher_cancels_once_client_leaves():
+    server, peer = socket.socketpair()
+    cancelled = threading.Event()
+    try:
+        with DisconnectWatcher(server, cancelled.set, interval=0.01) as watcher:
+            assert not cancelled.wait(0.05)
+            peer.close()
+            assert cancelled.wait(1)
+        assert watcher.disconnected
+    finally:
+        server.close()
+
+
+def test_query_timeout_cancels_cursor_and_frees_connection(slow_warehouse, client):
+    started = time.monotonic()
+    response = client.post('/api/query', json={'query': 'SELECT 1', 'timeout': 0.1})
+
+    assert response.status_code == 504
+    assert 'timeout and was cancelled' in response.get_json()['message']
+    assert time.monotonic() - started < 2
+    # The job answers at the deadline; its worker closes the cursor right after
+    wait_until(lambda: slow_warehouse.cursors[0].closed and db.get_pool_stats()['in_use'] == 0)
+    assert slow_warehouse.cursors[0].cancelled
+    assert api.job_store.stats()['timed_out'] == 1
+
+
+def test_shared_query_waiter_times_out_on_its_own_deadline(slow_warehouse, client):
+    leader = threading.Thread(target=client.post, args=('/api/query',),
+                              kwargs={'json': {'query': 'SELECT 1', 'timeout': 1.5}})
+    leader.start()
+    wait_until(lambda: slow_warehouse.cursors)
+
+    detached = db.get_singleflight_stats()['detached']
+    started = time.monotonic()
+    response = client.post('/api/query', json={'query': 'SELECT 1', 'timeout': 0.3})
+
+    assert response.status_code == 504
+    assert time.monotonic() - started < 1
+    assert 'other requests sharing it' in response.get_json()['message']
+    # The waiter let go of the flight (and its job worker); the leader's query goes on
+    wait_until(lambda: db.get_singleflight_stats()['detached'] == detached + 1)
+    assert not slow_warehouse.cursors[0].cancelled
+
+    leader.join(3)
+    assert slow_warehouse.cursors[0].cancelled
+    assert api.job_store.stats()['timed_out'] == 2
+
+
+@pytest.mark.parametrize('extra', [
+    {'metrics': [{'column': 'fare_amount', 'aggregation': 'sum'}]},
+    {'chart_type': 'period-over-period',
+     'pop': {'metric': 'fare_amount', 'aggregation': 'sum', 'compare_unit': 'week', 'compare_count': 1}},
+])
+def test_bucket_aligned_charts_time_out(slow_warehouse, trips, client, extra):
+    body = {'table': TRIPS_TABLE, 'grain': 'day', 'timeout': 0.1,
+            'date_range': {'start': '2016-01-08', 'end': '2016-01-14'}, **extra}
+    started = time.monotonic()
+    response = client.post('/api/chart', json=body)
+
+    assert response.status_code == 504
+    assert time.monotonic() - started < 2
+    wait_until(lambda: slow_warehouse.cursors[0].closed and db.get_pool_stats()['in_use'] == 0)
+    assert slow_warehouse.cursors[0].cancelled
+    assert api.job_store.stats()['timed_out'] == 1
+
+
+def test_timeout_must_be_in_range(warehouse, client):
+    for timeout in (0, -1, 'soon', api.QUERY_TIMEOUT_MAX + 1):
+        response = client.post('/api/query', json={'query': 'SELECT 1', 'timeout': timeout})
+        assert response.status_code == 400
+    assert client.post('/api/jobs', json={'query': 'SELECT 1', 'timeout': 0}).status_code == 400
+
+
+def test_disconnect_cancels_buffered_query(slow_warehouse, client, gone_client):
+    response = client.post('/api/query', json={'query': 'SELECT 1'}, environ_overrides=gone_client)
+
+    assert response.status_code == 499
+    cursor = slow_warehouse.cursors[0]
+    deadline = time.monotonic() + 1
+    while not cursor.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cursor.cancelled and cursor.closed
+    assert api.job_store.stats()['disconnected'] == 1
+
+
+def test_stream_timeout_cancels_before_first_batch(slow_warehouse, client):
+    body = {'query': 'SELECT 1', 'stream': True, 'timeout': 0.1}
+    assert client.post('/api/query', json=body).status_code == 504
+
+    assert slow_warehouse.cursors[0].cancelled
+    assert client.get('/api/jobs').get_json()['streams'] == {'timed_out': 1, 'disconnected': 0}
+
+
+def test_stream_disconnect_cancels_before_first_batch(slow_warehouse, client, gone_client):
+    started = time.monotonic()
+    response = client.post('/api/query', json={'query': 'SELECT 1', 'stream': True}, environ_overrides=gone_client)
+
+    assert response.status_code == 500
+    assert time.monotonic() - started < 2
+    assert slow_warehouse.cursors[0].cancelled and slow_warehouse.cursors[0].closed
+    # The client was gone before the query started, so it never ran
+    assert not hasattr(slow_warehouse.cursors[0], 'query')
+    assert client.get('/api/jobs').get_json()['streams'] == {'timed_out': 0, 'disconnected': 1}
+    assert api.admission.stats()['running'] == 0
+
+
+def test_job_cancelled_while_waiting_for_a_connection_never_runs(warehouse, client):
+    held = [db.get_connection(), db.get_connection()]
+    for connection in held:
+        connection.__enter__()
+    job_id = client.post('/api/jobs', json={'query': 'SELECT 1'}).get_json()['job']['job_id']
+    wait_until(lambda: api.job_store.get(job_id).status == 'running')
+
+    client.delete(f'/api/jobs/{job_id}')
+    for connection in held:
+        connection.__exit__(None, None, None)
+
+    wait_until(lambda: warehouse.cursors and warehouse.cursors[0].closed)
+    assert not hasattr(warehouse.cursors[0], 'query')
+    assert api.job_store.get(job_id).status == 'cancelled'
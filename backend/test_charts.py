@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Offline tests for chart spec compilation (charts.py) and /api/chart
+"""
+
+from datetime import datetime
+
+import pytest
+
+import api
+from charts import build_series_query, interval_sql, parse_chart_spec, parse_time_bound
+from conftest import TRIPS_TABLE
+
+
+def spec_body(**overrides):
+    body = {
+        'table': TRIPS_TABLE,
+        'grain': 'day',
+        'metrics': [{'column': 'fare_amount', 'aggregation': 'sum', 'name': 'Fare'}],
+    }
+    body.update(overrides)
+    return body
+
+
+def test_series_query_is_pushed_down(trips):
+    spec = parse_chart_spec(spec_body(
+        filters=[{'column': 'vendor', 'operator': 'in', 'value': "CMT, O'Hare"},
+                 {'column': 'pickup_zip', 'operator': '>=', 'value': '10001'}],
+        trailing={'unit': 'week', 'count': 2},
+    ), trips)
+    sql = build_series_query(spec, limit=100)
+
+    assert sql.startswith("SELECT DATE_TRUNC('DAY', `tpep_pickup_datetime`) AS `time`, SUM(`fare_amount`) AS `Fare`")
+    assert "FROM `samples`.`nyctaxi`.`trips`" in sql
+    assert "`vendor` IN ('CMT', 'O\\'Hare')" in sql
+    assert "`pickup_zip` >= 10001" in sql
+    assert "current_timestamp() - INTERVAL '14' DAY" in sql
+    assert sql.endswith("GROUP BY 1\nORDER BY 1\nLIMIT 100")
+
+
+def test_identifiers_are_validated_against_schema(trips):
+    with pytest.raises(ValueError, match="Unknown metric column"):
+        parse_chart_spec(spec_body(metrics=[{'column': 'fare; DROP TABLE x', 'aggregation': 'sum'}]), trips)
+    with pytest.raises(ValueError, match="non-numeric"):
+        parse_chart_spec(spec_body(metrics=[{'column': 'vendor', 'aggregation': 'avg'}]), trips)
+    with pytest.raises(ValueError, match="needs a number"):
+        parse_chart_spec(spec_body(filters=[{'column': 'pickup_zip', 'operator': '=', 'value': '1 OR 1=1'}]), trips)
+    with pytest.raises(ValueError, match="operator"):
+        parse_chart_spec(spec_body(filters=[{'column': 'vendor', 'operator': '; --', 'value': 'x'}]), trips)
+    with pytest.raises(ValueError, match="grain"):
+        parse_chart_spec(spec_body(grain='minute'), trips)
+
+
+def test_date_range_bounds():
+    assert parse_time_bound('2016-01-31', end=True) == datetime(2016, 2, 1)
+    assert parse_time_bound('2016-01-01T05:00:00.000Z') == datetime(2016, 1, 1, 5)
+    assert interval_sql('quarter', 1) == "INTERVAL '3' MONTH"
+    with pytest.raises(ValueError):
+        parse_time_bound('last tuesday')
+
+
+def test_chart_endpoint_returns_only_buckets(warehouse, trips, client):
+    warehouse.result = (['time', '_m0_sum'], [(datetime(2016, 1, d), 10.0 * d) for d in (1, 2)])
+    response = client.post('/api/chart', json=spec_body(date_range={'start': '2016-01-01', 'end': '2016-01-02'}))
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body['data'] == [{'time': '2016-01-01T00:00:00', 'Fare': 10.0},
+                            {'time': '2016-01-02T00:00:00', 'Fare': 20.0}]
+    assert body['truncated'] is False
+    assert "`tpep_pickup_datetime` < TIMESTAMP '2016-01-03 00:00:00'" in warehouse.cursors[-1].query
+
+
+def test_chart_endpoint_rejects_unknown_columns(warehouse, trips, client):
+    response = client.post('/api/chart', json=spec_body(time_column='vendor'))
+
+    assert response.status_code == 400
+    assert warehouse.cursors == []
+
+
+def test_aligned_chart_scans_at_most_max_buckets(warehouse, trips, client, monkeypatch):
+    monkeypatch.setattr(api, 'CHART_MAX_BUCKETS', 5)
+    warehouse.result = (['time', '_m0_sum'], [(datetime(2016, 1, 1, h), 1.0) for h in range(6)])
+    response = client.post('/api/chart', json=spec_body(
+        grain='hour', date_range={'start': '2016-01-01', 'end': '2016-12-31'}))
+    body = response.get_json()
+
+    assert body['row_count'] == 5 and body['truncated'] is True
+    assert "`tpep_pickup_datetime` < TIMESTAMP '2016-01-01 06:00:00'" in warehouse.cursors[-1].query
+    assert body['sql'].endswith('LIMIT 6')
+
+
+def test_malformed_window_is_rejected(warehouse, trips, client):
+    for window in ({'trailing': 7}, {'trailing': 'day'}, {'date_range': '2016-01-01'}):
+        response = client.post('/api/chart', json=spec_body(**window))
+        assert response.status_code == 400, window
+    assert warehouse.cursors == []
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Offline tests for negotiated response compression (compression.py)
+"""
+
+import gzip
+import json
+import zlib
+
+import pytest
+
+import compression
+from compression import StreamCompressor, compress, level_for, negotiate
+
+
+def test_negotiate_honours_q_values_then_server_preference():
+    available = ['zstd', 'br', 'gzip']
+
+    assert negotiate('gzip, deflate, br', available) == 'br'
+    assert negotiate('gzip;q=1.0, br;q=0.5', available) == 'gzip'
+    assert negotiate('*', available) == 'zstd'
+    assert negotiate('br;q=0, *;q=0.1', available) == 'zstd'
+    assert negotiate('identity', available) is None
+    assert negotiate('', available) is None
+
+
+def test_level_drops_as_payloads_grow():
+    assert level_for('gzip', 10 * 1024) > level_for('gzip', 1024 * 1024) > level_for('gzip', 64 * 1024 * 1024)
+
+
+@pytest.mark.parametrize('encoding', compression.available_encodings())
+def test_stream_chunks_decode_as_they_arrive(encoding):
+    compressor = StreamCompressor(encoding)
+    first = compressor.compress(b'{"type": "meta"}\n')
+
+    if encoding == 'gzip':
+        decoder = zlib.decompressobj(31)
+        assert decoder.decompress(first) == b'{"type": "meta"}\n'
+    elif encoding == 'br':
+        decoder = compression.brotli.Decompressor()
+        assert decoder.process(first) == b'{"type": "meta"}\n'
+    else:
+        decoder = compression.zstandard.ZstdDecompressor().decompressobj()
+        assert decoder.decompress(first) == b'{"type": "meta"}\n'
+    assert compress(b'x' * 5000, encoding) != b'x' * 5000
+
+
+def test_large_json_is_gzipped_and_small_json_is_not(warehouse, client, monkeypatch):
+    monkeypatch.setattr(compression, 'COMPRESSION_MIN_BYTES', 200)
+    response = client.post('/api/query', json={'query': 'SELECT *'}, headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    body = json.loads(gzip.decompress(response.get_data()))
+    assert body['row_count'] == 25
+
+    small = client.get('/api/health', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+
+def test_ndjson_stream_is_compressed_incrementally(warehouse, client):
+    response = client.post('/api/query', json={'query': 'SELECT *', 'stream': True},
+                           headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+    assert json.loads(lines[-1])['row_count'] == 25
+
+
+def test_error_responses_are_not_compressed(warehouse, client, monkeypatch):
+    monkeypatch.setattr(compression, 'COMPRESSION_MIN_BYTES', 0)
+    response = client.post('/api/query', json={'query': 'bad ' + 'x' * 500}, headers={'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 500
+    assert 'Content-Encoding' not in response.headers
+    assert 'PARSE_SYNTAX_ERROR' in response.get_json()['message']
@@ -123,6 +123,34 @@ def test_samples_table_query(connection):
         return False
 
 
+def test_pooled_connection():
+    """Test that the db.py connection pool reuses connections"""
+    print("\n" + "=" * 60)
+    print("TEST 6: Pooled Connection Reuse")
+    print("=" * 60)
+    
+    try:
+        from db import get_connection, get_pool_stats
+        
+        for _ in range(3):
+            with get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT 1 as test")
+                cursor.fetchall()
+                cursor.close()
+        
+        stats = get_pool_stats()
+        print(f"Pool stats: opened={stats['opened']} reused={stats['reused']} idle={stats['idle']}")
+        if stats['reused'] < 2:
+            print("❌ FAIL: Connections were not reused")
+            return False
+        print("✅ PASS: Pooled connections reused")
+        return True
+    except Exception as e:
+        print(f"❌ FAIL: Pooled query failed: {str(e)}")
+        return False
+
+
 def main():
     """Run all tests"""
     print("\n" + "🔍 DATABRICKS CONNECTION TEST SUITE")
@@ -159,6 +187,9 @@ def main():
     # Test 5: Sample table query
     results.append(test_samples_table_query(connection))
     
+    # Test 6: Connection pool
+    results.append(test_pooled_connection())
+    
     # Summary
     print("\n" + "=" * 60)
     print("TEST SUMMARY")
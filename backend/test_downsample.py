@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Offline tests for server-side down-sampling (downsample.py and the
+max_points option of /api/query and /api/chart)
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from conftest import TRIPS_TABLE
+from downsample import downsample, lttb_indices, minmax_indices, parse_max_points
+
+
+def hourly(hours, spike_at=None):
+    times = [datetime(2016, 1, 1) + timedelta(hours=h) for h in range(hours)]
+    values = [float(h % 24) for h in range(hours)]
+    if spike_at is not None:
+        values[spike_at] = 1000.0
+    return times, values
+
+
+def test_lttb_keeps_ends_and_follows_shape():
+    x = np.arange(10, dtype=float)
+
+    assert lttb_indices(x, x ** 2, 5).tolist() == [0, 2, 5, 7, 9]
+    assert lttb_indices(x, x, 20).tolist() == list(range(10))
+
+
+@pytest.mark.parametrize('select', [
+    lambda x, y, n: lttb_indices(x, y, n),
+    lambda x, y, n: minmax_indices(y, n),
+])
+def test_peaks_survive_reduction(select):
+    y = np.zeros(5000)
+    y[1234], y[4321] = 50.0, -50.0
+    kept = select(np.arange(5000, dtype=float), y, 100)
+
+    assert len(kept) <= 100
+    assert 1234 in kept and 4321 in kept
+
+
+def test_downsample_shares_budget_across_series_and_describes_it():
+    times, values = hourly(8760, spike_at=5000)
+    table = pa.table({'time': pa.array(times, pa.timestamp('us')), 'a': values,
+                      'b': pa.array(range(8760)), 'label': ['x'] * 8760})
+
+    reduced, info = downsample(table, 1000)
+
+    assert reduced.num_rows <= 1000
+    assert reduced.column_names == table.column_names
+    assert 1000.0 in reduced.column('a').to_pylist()
+    assert info == {'method': 'lttb', 'max_points': 1000, 'original_rows': 8760,
+                    'rows': reduced.num_rows, 'x_column': 'time', 'series': ['a', 'b'], 'applied': True}
+    assert downsample(table.slice(0, 10), 1000)[1]['applied'] is False
+
+
+def test_invalid_requests_raise_value_error():
+    with pytest.raises(ValueError):
+        parse_max_points(2)
+    with pytest.raises(ValueError):
+        downsample(pa.table({'label': ['a', 'b']}), 10)
+
+
+def test_query_endpoint_downsamples_records(warehouse, client):
+    warehouse.result = (['time', 'value'], list(zip(*hourly(2000, spike_at=700))))
+
+    body = client.post('/api/query', json={'query': 'SELECT 1', 'max_points': 100, 'downsample': 'minmax'}).get_json()
+
+    assert body['row_count'] <= 100
+    assert body['downsampling']['original_rows'] == 2000
+    assert 1000.0 in [row['value'] for row in body['data']]
+
+
+def test_query_endpoint_rejects_max_points_when_paging(warehouse, client):
+    response = client.post('/api/query', json={'query': 'SELECT 1', 'max_points': 100, 'page_size': 10})
+
+    assert response.status_code == 400
+
+
+def test_chart_endpoint_downsamples_series(warehouse, trips, client):
+    times, values = hourly(24 * 31)
+    warehouse.result = (['time', '_m0_sum'], list(zip(times, values)))
+    response = client.post('/api/chart', json={
+        'table': TRIPS_TABLE,
+        'grain': 'hour',
+        'metrics': [{'column': 'fare_amount', 'aggregation': 'sum', 'name': 'Fare'}],
+        'date_range': {'start': '2016-01-01', 'end': '2016-01-31'},
+        'max_points': 200,
+    })
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body['row_count'] <= 200
+    assert body['downsampling']['series'] == ['Fare']
+    assert body['data'][0]['time'] == '2016-01-01T00:00:00'
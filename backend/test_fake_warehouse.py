@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the hermetic fake warehouse (fake_warehouse.py) and the API
+served from it end to end
+"""
+
+import json
+import threading
+import time
+
+import pyarrow as pa
+import pytest
+
+import db
+from fake_warehouse import TRIPS_SCHEMA, FakeWarehouse, FakeWarehouseError, install
+
+TRIPS_COLUMNS = [name for name, _, _, _ in TRIPS_SCHEMA]
+
+
+@pytest.fixture
+def nyctaxi(warehouse, monkeypatch):
+    """The conftest fixtures, with the pool pointed at a small FakeWarehouse"""
+    fake = FakeWarehouse(rows=500)
+    # Registered first so monkeypatch puts the conftest pool back afterwards
+    monkeypatch.setattr(db, '_pool', db._pool)
+    install(fake, max_size=2)
+    return fake
+
+
+def test_trips_shape_and_limit():
+    cursor = FakeWarehouse(rows=100).connect().cursor()
+
+    cursor.execute("SELECT * FROM samples.nyctaxi.trips LIMIT 10")
+    assert [desc[:2] for desc in cursor.description] == [(name, kind) for name, kind, _, _ in TRIPS_SCHEMA]
+    table = cursor.fetchmany_arrow(4)
+    assert table.num_rows == 4 and table.schema.field('pickup_zip').type == pa.int32()
+    assert len(cursor.fetchall()) == 6
+
+    cursor.execute("SELECT fare_amount, `pickup_zip` FROM samples.nyctaxi.trips WHERE pickup_zip > 0")
+    rows = cursor.fetchall()
+    assert [desc[0] for desc in cursor.description] == ['fare_amount', 'pickup_zip']
+    assert len(rows) == 100 and isinstance(rows[0][0], float)
+
+    cursor.execute("SELECT 1 as test")
+    assert cursor.fetchall() == [(1,)] and cursor.description[0][0] == 'test'
+
+
+def test_same_seed_same_data():
+    assert FakeWarehouse(rows=50).trips.equals(FakeWarehouse(rows=50).trips)
+    assert not FakeWarehouse(rows=50).trips.equals(FakeWarehouse(rows=50, seed=7).trips)
+
+
+def test_latency_and_row_cost():
+    fake = FakeWarehouse(rows=200, connect_latency=0.02, execute_latency=0.02, row_cost=0.0002)
+
+    started = time.perf_counter()
+    cursor = fake.connect().cursor()
+    cursor.execute("SELECT * FROM samples.nyctaxi.trips")
+    cursor.fetchall()
+
+    assert time.perf_counter() - started >= 0.08
+    assert fake.stats()['rows_fetched'] == 200
+
+
+def test_cancel_interrupts_execute():
+    cursor = FakeWarehouse(rows=10, execute_latency=5).connect().cursor()
+    started = time.perf_counter()
+    threading.Timer(0.05, cursor.cancel).start()
+
+    with pytest.raises(FakeWarehouseError, match="cancelled"):
+        cursor.execute("SELECT * FROM samples.nyctaxi.trips")
+    assert time.perf_counter() - started < 1
+
+
+def test_error_injection():
+    fake = FakeWarehouse(rows=10, execute_error_rate=1.0)
+    with pytest.raises(FakeWarehouseError, match="execute"):
+        fake.connect().cursor().execute("SELECT 1")
+
+    assert FakeWarehouse(rows=10, connect_error_rate=1.0).connection_factory()[0] is None
+    assert fake.stats()['execute_errors'] == 1
+
+
+def test_query_and_schema_endpoints(nyctaxi, client):
+    body = client.post('/api/query', json={'query': 'SELECT * FROM samples.nyctaxi.trips LIMIT 25'}).get_json()
+    assert body['row_count'] == 25 and body['columns'] == TRIPS_COLUMNS
+
+    schema = client.get('/api/schema/samples.nyctaxi.trips').get_json()
+    assert [column['name'] for column in schema['columns']] == TRIPS_COLUMNS
+    assert [column['role'] for column in schema['columns']][:3] == ['time', 'time', 'metric']
+
+
+def test_stream_modes(nyctaxi, client):
+    query = {'query': 'SELECT * FROM samples.nyctaxi.trips', 'stream': True}
+    lines = client.post('/api/query', json=query).get_data(as_text=True).splitlines()
+    assert json.loads(lines[-1])['row_count'] == 500
+
+    response = client.post('/api/query', json={'query': query['query']},
+                           headers={'Accept': 'application/vnd.apache.arrow.stream'})
+    assert pa.ipc.open_stream(response.get_data()).read_all().num_rows == 500
+
+
+def test_injected_failures_surface_as_errors(nyctaxi, client):
+    nyctaxi.error_rates['fetch'] = 1.0
+
+    response = client.post('/api/query', json={'query': 'SELECT * FROM samples.nyctaxi.trips'})
+
+    assert response.status_code == 500
+    assert 'Injected fetch failure' in response.get_json()['message']
+
+
+def test_canned_result_and_failures():
+    fake = FakeWarehouse(rows=10)
+    fake.result = (['id'], [(i,) for i in range(25)])
+    fake.fail_after = 10
+    cursor = fake.connect().cursor()
+
+    cursor.execute("SELECT * FROM samples.nyctaxi.trips")
+    assert cursor.fetchmany(10) == [(i,) for i in range(10)]
+    with pytest.raises(FakeWarehouseError, match="connection reset"):
+        cursor.fetchmany(10)
+    with pytest.raises(FakeWarehouseError, match="PARSE_SYNTAX_ERROR"):
+        cursor.execute("bad sql")
+
+    fake.connections[0].broken = True
+    with pytest.raises(FakeWarehouseError, match="connection reset"):
+        fake.connections[0].cursor().execute("SELECT 1")
+    assert len(fake.cursors) == 2
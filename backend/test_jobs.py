@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Offline tests for asynchronous query jobs (jobs.py and /api/jobs)
+"""
+
+import time
+
+from jobs import CANCELLED, FAILED, SUCCEEDED, JobQueueFull, JobStore
+
+
+def wait_for(client, job_id, timeout=2):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()['job']
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_job_store_runs_and_expires_jobs():
+    store = JobStore(max_workers=1, result_ttl=0.05)
+    job = store.submit('SELECT 1', lambda job: 42)
+
+    assert job.wait(1)
+    assert job.status == SUCCEEDED and job.result == 42
+    time.sleep(0.06)
+    assert store.get(job.id) is None
+    assert store.stats()['expired'] == 1
+
+
+def test_job_store_records_failures():
+    store = JobStore(max_workers=1)
+
+    def work(job):
+        raise Exception("Query Error: boom")
+
+    job = store.submit('SELECT 1', work)
+    job.wait(1)
+    assert job.status == FAILED
+    assert 'boom' in job.to_dict()['message']
+
+
+def test_job_store_bounds_queue():
+    store = JobStore(max_workers=1, max_queued=1)
+    store.submit('a', lambda job: time.sleep(0.1))
+    time.sleep(0.02)  # first job is running, not queued
+    store.submit('b', lambda job: None)
+
+    try:
+        store.submit('c', lambda job: None)
+        raise AssertionError("expected JobQueueFull")
+    except JobQueueFull:
+        pass
+    assert store.stats()['rejected'] == 1
+
+
+def test_drain_finishes_fast_jobs_and_cancels_slow_ones():
+    store = JobStore(max_workers=2)
+    fast = store.submit('fast', lambda job: time.sleep(0.05) or 'done')
+    stopped = []
+
+    def slow(job):
+        job.attach_cancel(lambda: stopped.append(True))
+        time.sleep(0.5)
+
+    slow_job = store.submit('slow', slow)
+    time.sleep(0.02)
+
+    assert store.drain(timeout=0.2) == {'finished': 1, 'cancelled': 1}
+    assert fast.result == 'done'
+    assert slow_job.status == CANCELLED and stopped == [True]
+    try:
+        store.submit('late', lambda job: None)
+        raise AssertionError("expected JobQueueFull")
+    except JobQueueFull:
+        pass
+
+
+def test_cancel_queued_job_never_runs():
+    store = JobStore(max_workers=1)
+    ran = []
+    store.submit('slow', lambda job: time.sleep(0.1))
+    queued = store.submit('next', lambda job: ran.append(1))
+
+    store.cancel(queued.id)
+    queued.wait(1)
+    assert queued.status == CANCELLED
+    assert ran == []
+
+
+def test_submit_poll_and_page_results(warehouse, client):
+    response = client.post('/api/jobs', json={'query': 'SELECT * FROM trips'})
+    assert response.status_code == 202
+    job_id = response.get_json()['job']['job_id']
+
+    job = wait_for(client, job_id)
+    assert job['status'] == 'succeeded'
+    assert job['row_count'] == 25
+
+    page = client.get(f'/api/jobs/{job_id}/results?offset=20&limit=10').get_json()
+    assert page['row_count'] == 5
+    assert page['data'][0] == {'id': 20, 'name': 'row-20'}
+    assert page['next_offset'] is None
+
+    first = client.get(f'/api/jobs/{job_id}/results?limit=10&format=columnar').get_json()
+    assert first['data'][0] == list(range(10))
+    assert first['next_offset'] == 10
+
+
+def test_delete_cancels_running_cursor(warehouse, client):
+    warehouse.execute_latency = 5
+    job_id = client.post('/api/jobs', json={'query': 'SELECT * FROM big'}).get_json()['job']['job_id']
+    time.sleep(0.05)
+
+    cancelled = client.delete(f'/api/jobs/{job_id}').get_json()['job']
+    assert cancelled['status'] == 'cancelled'
+
+    job = wait_for(client, job_id)
+    assert job['status'] == 'cancelled'
+    assert warehouse.cursors[0].cancelled
+    assert client.get(f'/api/jobs/{job_id}/results').status_code == 410
+
+
+def test_unknown_job_is_404(warehouse, client):
+    assert client.get('/api/jobs/nope').status_code == 404
+    assert client.delete('/api/jobs/nope').status_code == 404
+
+
+def test_sync_query_times_out_with_job_id(warehouse, client, monkeypatch):
+    import api
+
+    monkeypatch.setattr(api, 'SYNC_QUERY_TIMEOUT', 0.05)
+    warehouse.execute_latency = 0.3
+    response = client.post('/api/query', json={'query': 'SELECT * FROM slow'})
+
+    assert response.status_code == 504
+    job = wait_for(client, response.get_json()['job_id'])
+    assert job['status'] == 'succeeded'
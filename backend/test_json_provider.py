@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the JSON provider (json_provider.py)
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import json_provider
+from api import app
+from json_provider import FastJSONProvider, register_type
+
+ENCODERS = ['stdlib'] + (['orjson'] if json_provider.orjson is not None else [])
+
+
+@pytest.mark.parametrize('encoder', ENCODERS)
+def test_warehouse_types_have_handlers(encoder):
+    provider = FastJSONProvider(app, encoder=encoder)
+    row = {
+        'ts': pd.Timestamp('2016-01-01 05:30'),
+        'missing': pd.NaT,
+        'day': date(2016, 1, 2),
+        'amount': Decimal('12.50'),
+        'count': np.int64(7),
+        'ratio': np.float32(0.5),
+        'values': np.arange(3),
+        'name': 'café',
+    }
+
+    assert json.loads(provider.dumps(row)) == {
+        'ts': '2016-01-01T05:30:00', 'missing': None, 'day': '2016-01-02', 'amount': 12.5,
+        'count': 7, 'ratio': 0.5, 'values': [0, 1, 2], 'name': 'café',
+    }
+    assert list(json.loads(provider.dumps({'b': 1, 'a': 2}))) == ['b', 'a']
+    with pytest.raises(TypeError):
+        provider.dumps({'bad': object()})
+
+
+def test_registered_handler_covers_subclasses(monkeypatch):
+    class Money(Decimal):
+        pass
+
+    monkeypatch.setattr(json_provider, 'TYPE_HANDLERS', dict(json_provider.TYPE_HANDLERS))
+    monkeypatch.setattr(json_provider, '_resolved', dict(json_provider.TYPE_HANDLERS))
+    register_type(Decimal, str)
+
+    assert FastJSONProvider(app, encoder='stdlib').dumps([Money('1.10')]) == '["1.10"]'
+
+
+def test_app_responses_use_the_provider(warehouse, client):
+    warehouse.result = (['at', 'fare'], [(datetime(2016, 1, 1, 8), Decimal('9.75'))])
+
+    body = client.post('/api/query', json={'query': 'SELECT 1'}).get_json()
+
+    assert isinstance(app.json, FastJSONProvider)
+    assert body['data'] == [{'at': '2016-01-01T08:00:00', 'fare': 9.75}]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Offline tests for phase metrics (metrics.py, Server-Timing and /api/metrics)
+"""
+
+import time
+
+import metrics
+from metrics import Histogram, Timings
+
+
+def test_histogram_renders_cumulative_prometheus_buckets():
+    histogram = Histogram('test_seconds', 'Test', (0.1, 1), 'phase')
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe('execute', value)
+    histogram.observe('say "hi"', 0.01)
+
+    lines = histogram.render()
+    assert lines[:2] == ['# HELP query_api_test_seconds Test', '# TYPE query_api_test_seconds histogram']
+    assert 'query_api_test_seconds_bucket{phase="execute",le="0.1"} 1' in lines
+    assert 'query_api_test_seconds_bucket{phase="execute",le="1"} 3' in lines
+    assert 'query_api_test_seconds_bucket{phase="execute",le="+Inf"} 4' in lines
+    assert 'query_api_test_seconds_sum{phase="execute"} 6.05' in lines
+    assert 'query_api_test_seconds_count{phase="execute"} 4' in lines
+    assert 'query_api_test_seconds_count{phase="say \\"hi\\""} 1' in lines
+
+
+def test_timings_header_sums_repeated_phases():
+    timings = Timings()
+    timings.add('execute', 0.8124)
+    timings.add('fetch', 0.01)
+    timings.add('fetch', 0.025)
+
+    assert timings.header(total=0.9) == 'execute;dur=812.4, fetch;dur=35.0;desc="2x", total;dur=900.0'
+
+
+def test_recording_overhead_is_small():
+    count = 20000
+    started = time.perf_counter()
+    for _ in range(count):
+        with metrics.phase('overhead_test'):
+            pass
+    per_call = (time.perf_counter() - started) / count
+
+    assert per_call < 50e-6
+    assert metrics.PHASE_SECONDS.snapshot()['overhead_test']['count'] >= count
+
+
+def test_query_response_carries_server_timing(warehouse, client):
+    response = client.post('/api/query', json={'query': 'SELECT 1'})
+
+    phases = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+    # execute and fetch ran on a job thread
+    for phase in ('admission', 'acquire', 'execute', 'fetch', 'convert', 'serialize', 'total'):
+        assert phase in phases
+    assert phases[-1] == 'total'
+
+
+def test_metrics_endpoint_exports_histograms_and_stats(warehouse, client):
+    client.post('/api/query', json={'query': 'SELECT 1'})
+
+    response = client.get('/api/metrics')
+    text = response.get_data(as_text=True)
+
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert 'query_api_phase_seconds_bucket{phase="execute",le="+Inf"}' in text
+    assert 'query_api_request_seconds_count{endpoint="run_query"}' in text
+    assert 'query_api_result_rows_count{stage="fetch"}' in text
+    assert 'query_api_pool_opened 1' in text
+    assert 'query_api_jobs_succeeded 1' in text
+    assert 'query_api_admission_admitted 1' in text
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Offline tests for paged query results (pagination.py and /api/query paging)
+"""
+
+import threading
+import time
+
+import pytest
+
+import api
+import db
+from pagination import PagedResultStore, PageTokenExpired, decode_page_token, encode_page_token
+
+
+def page(client, **body):
+    return client.post('/api/query', json=body)
+
+
+def test_page_token_round_trips():
+    token = encode_page_token('abc', 20)
+    assert decode_page_token(token) == ('abc', 20)
+    with pytest.raises(PageTokenExpired):
+        decode_page_token('not-a-token')
+
+
+def test_pages_read_one_cursor_without_rerunning(warehouse, client):
+    first = page(client, query='SELECT * FROM t', page_size=10).get_json()
+    assert first['data'][0] == {'id': 0, 'name': 'row-0'}
+    assert first['row_count'] == 10
+    assert first['total_rows'] is None
+    assert first['page_token']
+
+    cursor = warehouse.cursors[0]
+    assert cursor.fetched == 10
+
+    rows = first['data']
+    token = first['page_token']
+    while token:
+        body = page(client, page_token=token, page_size=10).get_json()
+        rows += body['data']
+        token = body['page_token']
+
+    assert [row['id'] for row in rows] == list(range(25))
+    assert body['total_rows'] == 25
+    assert len(warehouse.cursors) == 1
+    assert cursor.closed
+    assert db.get_pool_stats()['in_use'] == 0
+
+
+def test_first_page_served_from_result_cache(warehouse, client):
+    client.post('/api/query', json={'query': 'SELECT * FROM t'})
+    response = page(client, query='SELECT * FROM t', page_size=20)
+
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.get_json()['total_rows'] == 25
+    assert len(warehouse.cursors) == 1
+
+
+def test_unknown_token_is_gone(warehouse, client):
+    response = page(client, page_token=encode_page_token('missing', 10))
+
+    assert response.status_code == 410
+    assert 're-run' in response.get_json()['message']
+
+
+def test_opening_past_max_open_evicts_oldest_cursor(warehouse, client):
+    first = page(client, query='SELECT * FROM a', page_size=5).get_json()
+    page(client, query='SELECT * FROM b', page_size=5)
+
+    assert warehouse.cursors[0].closed
+    assert page(client, page_token=first['page_token']).status_code == 410
+    assert api.paged_results.stats()['open_cursors'] == 1
+
+
+def test_idle_result_sets_are_evicted(warehouse, client, monkeypatch):
+    first = page(client, query='SELECT * FROM t', page_size=5).get_json()
+    monkeypatch.setattr(api.paged_results, 'idle_timeout', 0)
+
+    assert page(client, page_token=first['page_token']).status_code == 410
+    assert warehouse.cursors[0].closed
+    assert db.get_pool_stats()['in_use'] == 0
+    assert api.paged_results.stats()['evicted_idle'] == 1
+
+
+def test_abandoned_cursor_is_closed_without_other_paging(warehouse, client, monkeypatch):
+    store = PagedResultStore(db.open_result, idle_timeout=0.05, reap_interval=0.01)
+    monkeypatch.setattr(api, 'paged_results', store)
+    page(client, query='SELECT * FROM t', page_size=5)
+
+    deadline = time.monotonic() + 2
+    while not warehouse.cursors[0].closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert warehouse.cursors[0].closed
+    assert db.get_pool_stats()['in_use'] == 0
+    assert store.stats()['evicted_idle'] == 1
+    store.close()
+
+
+def test_first_page_execute_times_out(warehouse, client):
+    warehouse.execute_latency = 5
+    started = time.monotonic()
+    response = page(client, query='SELECT * FROM t', page_size=5, timeout=0.1)
+
+    assert response.status_code == 504
+    assert time.monotonic() - started < 2
+    assert warehouse.cursors[0].cancelled and warehouse.cursors[0].closed
+    assert db.get_pool_stats()['in_use'] == 0
+
+
+def test_dropping_a_result_waits_for_its_read(warehouse, client):
+    first = page(client, query='SELECT * FROM t', page_size=5).get_json()
+    result_id, _ = decode_page_token(first['page_token'])
+    result = api.paged_results._results[result_id]
+
+    with result.lock:
+        closer = threading.Thread(target=api.paged_results.close)
+        closer.start()
+        closer.join(0.1)
+        assert closer.is_alive() and not warehouse.cursors[0].closed
+    closer.join(1)
+    assert warehouse.cursors[0].closed
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the connection pool in db.py
+Uses the fake warehouse's connections, so no workspace or warehouse is needed
+"""
+
+import threading
+import time
+
+import pytest
+
+from db import ConnectionPool, recommended_pool_size
+from fake_warehouse import FakeWarehouse
+
+
+def make_warehouse(**kwargs):
+    return FakeWarehouse(rows=10, **kwargs)
+
+
+def make_pool(warehouse, **kwargs):
+    options = dict(max_size=2, acquire_timeout=0.2, health_check_interval=60,
+                   token_lifetime=3600, refresh_margin=300)
+    options.update(kwargs)
+    return ConnectionPool(warehouse.connection_factory, **options)
+
+
+def test_connections_are_reused():
+    warehouse = make_warehouse()
+    pool = make_pool(warehouse)
+
+    for _ in range(5):
+        with pool.connection() as connection:
+            assert connection.open
+
+    stats = pool.stats()
+    assert len(warehouse.connections) == 1
+    assert stats['opened'] == 1
+    assert stats['reused'] == 4
+    assert stats['idle'] == 1 and stats['in_use'] == 0
+
+
+def test_max_size_blocks_then_times_out():
+    pool = make_pool(make_warehouse(), max_size=1, acquire_timeout=0.05)
+    entry = pool.acquire()
+
+    with pytest.raises(Exception, match="timed out"):
+        pool.acquire()
+
+    pool.release(entry)
+    assert pool.stats()['wait_timeouts'] == 1
+
+
+def test_waiter_gets_released_connection():
+    pool = make_pool(make_warehouse(), max_size=1, acquire_timeout=2)
+    entry = pool.acquire()
+    borrowed = []
+
+    def borrow():
+        with pool.connection() as connection:
+            borrowed.append(connection)
+
+    worker = threading.Thread(target=borrow)
+    worker.start()
+    time.sleep(0.05)
+    pool.release(entry)
+    worker.join(1)
+
+    assert borrowed == [entry.connection]
+    assert pool.stats()['waits'] >= 1
+
+
+def test_idle_connections_are_closed():
+    warehouse = make_warehouse()
+    pool = make_pool(warehouse, idle_timeout=0.01)
+
+    with pool.connection():
+        pass
+    time.sleep(0.02)
+    with pool.connection():
+        pass
+
+    assert len(warehouse.connections) == 2
+    assert not warehouse.connections[0].open
+    assert pool.stats()['expired_idle'] == 1
+
+
+def test_connections_recycled_before_token_expiry():
+    warehouse = make_warehouse()
+    pool = make_pool(warehouse, token_lifetime=1, refresh_margin=1)
+
+    with pool.connection():
+        pass
+    with pool.connection():
+        pass
+
+    assert len(warehouse.connections) == 2
+    assert pool.stats()['recycled'] == 1
+
+
+def test_failed_health_check_replaces_connection():
+    warehouse = make_warehouse()
+    pool = make_pool(warehouse)
+
+    with pytest.raises(RuntimeError):
+        with pool.connection() as connection:
+            connection.broken = True
+            raise RuntimeError("query failed")
+
+    # The connection is flagged suspect, pinged on borrow and replaced
+    with pool.connection() as connection:
+        assert connection is warehouse.connections[1]
+    assert pool.stats()['health_check_failures'] == 1
+
+
+def test_connect_error_frees_slot():
+    warehouse = make_warehouse(connect_error_rate=1.0)
+    pool = make_pool(warehouse, max_size=1)
+
+    with pytest.raises(Exception, match="Connection Error: .*Injected connect failure"):
+        pool.acquire()
+
+    warehouse.error_rates['connect'] = 0.0
+    with pool.connection() as connection:
+        assert connection.open
+
+
+def test_warm_opens_min_size():
+    warehouse = make_warehouse()
+    pool = make_pool(warehouse, min_size=2, max_size=4)
+    pool.warm()
+
+    stats = pool.stats()
+    assert stats['idle'] == 2
+    assert stats['opened'] == 2
+
+    # Idle connections count toward min_size; only the shortfall is opened
+    pool.min_size = 4
+    pool.warm()
+    stats = pool.stats()
+    assert stats['idle'] == 4 and stats['opened'] == 4
+    pool.warm()
+    assert pool.stats()['opened'] == 4
+
+
+def test_startup_warns_below_recommended_pool_size(monkeypatch, capsys):
+    import api
+    monkeypatch.setattr(api, 'warm_pool', lambda: None)
+    monkeypatch.setattr(api, 'ADMISSION_MAX_CONCURRENT', 8)
+    monkeypatch.setattr(api, 'PAGED_RESULTS_MAX_OPEN', 4)
+    assert recommended_pool_size(8, 4) == 14
+
+    monkeypatch.setattr(api, 'POOL_MAX_SIZE', 13)
+    api.startup()
+    assert 'below 14' in capsys.readouterr().out
+
+    monkeypatch.setattr(api, 'POOL_MAX_SIZE', 14)
+    api.startup()
+    assert capsys.readouterr().out == ''
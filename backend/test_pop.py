@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Offline tests for period-over-period series (pop.py and /api/chart)
+"""
+
+import time
+from datetime import datetime
+
+import pytest
+
+import api
+from charts import shift_time, truncate_time
+from conftest import TRIPS_TABLE
+from pop import is_aligned, parse_compare
+
+
+def pop_body(compare_unit='week', compare_count=1, **overrides):
+    body = {
+        'table': TRIPS_TABLE,
+        'chart_type': 'period-over-period',
+        'grain': 'day',
+        'pop': {'metric': 'fare_amount', 'aggregation': 'sum',
+                'compare_unit': compare_unit, 'compare_count': compare_count},
+    }
+    body.update(overrides)
+    return body
+
+
+def daily(first, last):
+    return (['time', '_m0_sum'], [(datetime(2016, 1, d), float(d)) for d in range(first, last + 1)])
+
+
+def test_calendar_helpers_match_date_trunc():
+    t = datetime(2016, 1, 31, 13, 45)
+    assert truncate_time(t, 'week') == datetime(2016, 1, 25)
+    assert truncate_time(t, 'quarter') == datetime(2016, 1, 1)
+    assert shift_time(t, 'month', 1) == datetime(2016, 2, 29, 13, 45)
+    assert shift_time(t, 'quarter', -1) == datetime(2015, 10, 31, 13, 45)
+
+
+def test_alignment_rules():
+    assert is_aligned('day', 'week', 1)
+    assert is_aligned('month', 'year', 1)
+    assert is_aligned('week', 'day', 14)
+    assert not is_aligned('day', 'month', 1)
+    assert not is_aligned('week', 'month', 1)
+    assert not is_aligned('quarter', 'month', 1)
+    with pytest.raises(ValueError):
+        parse_compare('fortnight', 1)
+
+
+def test_week_over_week_reads_both_periods_in_one_scan(warehouse, trips, client):
+    warehouse.result = daily(1, 14)
+    response = client.post('/api/chart', json=pop_body(date_range={'start': '2016-01-08', 'end': '2016-01-14'}))
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'MISS'
+    assert len(warehouse.cursors) == 1
+    assert body['data'][0] == {'time': '2016-01-08T00:00:00', 'current_sum_fare_amount': 8.0,
+                               'previous_sum_fare_amount': 1.0, 'previous_time': '2016-01-01T00:00:00'}
+    assert body['row_count'] == 7
+
+
+def test_current_period_is_reused_as_next_previous_period(warehouse, trips, client):
+    warehouse.result = daily(1, 14)
+    client.post('/api/chart', json=pop_body(date_range={'start': '2016-01-08', 'end': '2016-01-14'}))
+
+    warehouse.result = daily(15, 21)
+    response = client.post('/api/chart', json=pop_body(date_range={'start': '2016-01-15', 'end': '2016-01-21'}))
+    body = response.get_json()
+
+    assert response.headers['X-Cache'] == 'PARTIAL'
+    assert len(warehouse.cursors) == 2
+    assert "TIMESTAMP '2016-01-08" not in warehouse.cursors[-1].query
+    assert body['data'][0]['current_sum_fare_amount'] == 15.0
+    assert body['data'][0]['previous_sum_fare_amount'] == 8.0
+
+
+def test_unaligned_shift_uses_conditional_aggregation(warehouse, trips, client):
+    warehouse.result = (['time', 'current_sum_fare_amount', 'previous_sum_fare_amount'],
+                        [(datetime(2016, 2, 1), 5.0, 3.0)])
+    response = client.post('/api/chart', json=pop_body(
+        'month', 1, date_range={'start': '2016-02-01', 'end': '2016-02-29'}))
+
+    query = warehouse.cursors[-1].query
+    assert "CROSS JOIN (VALUES (false), (true)) AS p(shifted)" in query
+    assert "`tpep_pickup_datetime` + INTERVAL '1' MONTH" in query
+    assert response.get_json()['data'][0]['previous_sum_fare_amount'] == 3.0
+
+
+def test_pop_requires_a_bounded_window(warehouse, trips, client):
+    response = client.post('/api/chart', json=pop_body(date_range={'start': '2016-01-01'}))
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('compare_unit', ['week', 'month'])
+def test_cancelling_a_pop_job_cancels_its_scan(warehouse, trips, compare_unit):
+    warehouse.execute_latency = 5
+    body = pop_body(compare_unit, 1, date_range={'start': '2016-02-01', 'end': '2016-02-29'})
+    with api.app.test_request_context(json=body):
+        job = api._submit_pop_job(body, trips)
+    deadline = time.monotonic() + 2
+    while not warehouse.cursors and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    api.job_store.cancel(job.id)
+
+    assert job.wait(1)
+    deadline = time.monotonic() + 2
+    while not warehouse.cursors[0].closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert warehouse.cursors[0].cancelled and warehouse.cursors[0].closed
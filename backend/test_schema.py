@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Offline tests for schema parsing (schema.py) and the schema cache endpoints
+"""
+
+import pytest
+
+from schema import (
+    build_columns_query, infer_role, parse_columns_rows, parse_describe_rows,
+    split_table_name,
+)
+
+DESCRIBE_COLUMNS = ['col_name', 'data_type', 'comment']
+DESCRIBE_ROWS = [
+    ('tpep_pickup_datetime', 'timestamp', None),
+    ('trip_distance', 'double', None),
+    ('fare_amount', 'decimal(10,2)', 'USD'),
+    ('pickup_zip', 'int', None),
+    ('vendor', 'string', None),
+    ('', '', ''),
+    ('# Partition Information', '', ''),
+    ('# col_name', 'data_type', 'comment'),
+]
+
+INFO_COLUMNS = ['table_catalog', 'table_schema', 'table_name', 'column_name',
+                'full_data_type', 'is_nullable', 'ordinal_position', 'comment']
+INFO_ROWS = [
+    ('samples', 'nyctaxi', 'trips', 'trip_distance', 'double', 'YES', 1, None),
+    ('samples', 'nyctaxi', 'trips', 'tpep_pickup_datetime', 'timestamp', 'YES', 0, None),
+    ('main', 'sales', 'orders', 'region', 'string', 'NO', 0, 'Sales region'),
+]
+
+
+def test_infer_role_by_type():
+    assert infer_role('TIMESTAMP') == 'time'
+    assert infer_role('date') == 'time'
+    assert infer_role('decimal(10,2)') == 'metric'
+    assert infer_role('bigint') == 'metric'
+    assert infer_role('string') == 'dimension'
+    assert infer_role('array<int>') == 'unassigned'
+
+
+def test_parse_describe_stops_at_partition_info():
+    rows = [dict(zip(DESCRIBE_COLUMNS, row)) for row in DESCRIBE_ROWS]
+    columns = parse_describe_rows(rows)
+
+    assert [c.name for c in columns] == [
+        'tpep_pickup_datetime', 'trip_distance', 'fare_amount', 'pickup_zip', 'vendor']
+    assert [c.role for c in columns] == ['time', 'metric', 'metric', 'metric', 'dimension']
+    assert columns[2].comment == 'USD'
+    assert columns[4].position == 5
+
+
+def test_split_table_name_validates():
+    assert split_table_name('Samples.NYCTaxi.trips') == ('samples', 'nyctaxi', 'trips')
+    assert split_table_name('main.`my schema`.t') == ('main', 'my schema', 't')
+    with pytest.raises(ValueError):
+        split_table_name('trips; DROP TABLE x')
+    with pytest.raises(ValueError):
+        split_table_name('nyctaxi.trips')
+
+
+def test_bulk_query_is_one_statement_per_catalog():
+    query = build_columns_query(['samples.nyctaxi.trips', 'main.sales.orders', 'main.sales.items'])
+
+    assert query.count('SELECT') == 2
+    assert query.count('UNION ALL') == 1
+    assert '`main`.information_schema.columns' in query
+    assert "lower(table_name) = 'items'" in query
+
+
+def test_parse_columns_rows_groups_and_orders():
+    rows = [dict(zip(INFO_COLUMNS, row)) for row in INFO_ROWS]
+    parsed = parse_columns_rows(rows)
+
+    assert [c.name for c in parsed['samples.nyctaxi.trips']] == ['tpep_pickup_datetime', 'trip_distance']
+    assert parsed['main.sales.orders'][0].nullable is False
+
+
+def test_schema_endpoint_caches_parsed_columns(warehouse, client):
+    warehouse.result = (DESCRIBE_COLUMNS, DESCRIBE_ROWS)
+    first = client.get('/api/schema/samples.nyctaxi.trips').get_json()
+    second = client.get('/api/schema/samples.nyctaxi.trips').get_json()
+
+    assert len(warehouse.cursors) == 1
+    assert first == second
+    assert first['columns'][0]['role'] == 'time'
+    assert first['schema'][0] == {'col_name': 'tpep_pickup_datetime', 'data_type': 'timestamp',
+                                  'comment': None}
+
+    client.delete('/api/schema/samples.nyctaxi.trips')
+    client.get('/api/schema/samples.nyctaxi.trips')
+    assert len(warehouse.cursors) == 2
+
+
+def test_bulk_endpoint_uses_one_query_and_reports_missing(warehouse, client):
+    warehouse.result = (INFO_COLUMNS, INFO_ROWS)
+    data = client.post('/api/schemas', json={
+        'tables': ['samples.nyctaxi.trips', 'main.sales.orders', 'main.sales.gone']
+    }).get_json()
+
+    assert len(warehouse.cursors) == 1
+    assert 'information_schema.columns' in warehouse.cursors[0].query
+    assert set(data['schemas']) == {'samples.nyctaxi.trips', 'main.sales.orders'}
+    assert data['missing'] == ['main.sales.gone']
+
+    # Cached tables are not looked up again
+    client.post('/api/schemas', json={'tables': ['samples.nyctaxi.trips']})
+    assert len(warehouse.cursors) == 1
+
+
+def test_bulk_endpoint_rejects_bad_names(warehouse, client):
+    response = client.post('/api/schemas', json={'tables': ["x'; DROP TABLE y; --"]})
+
+    assert response.status_code == 400
+    assert len(warehouse.cursors) == 0
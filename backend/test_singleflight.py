@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Offline tests for single-flight query coalescing (singleflight.py)
+"""
+
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight, TooManyWaiters, WaitTimeout
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+
+    def worker(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(2)
+    return results
+
+
+def test_concurrent_callers_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'result'
+
+    results = run_concurrently(5, lambda: flights.do('q', work, timeout=2))
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(value == 'result' for value, _ in results)
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_error_is_shared_by_all_waiters():
+    flights = SingleFlight()
+
+    def work():
+        time.sleep(0.05)
+        raise Exception("Query Error: table not found")
+
+    results = run_concurrently(3, lambda: flights.do('q', work, timeout=2))
+
+    assert all(isinstance(result, Exception) for result in results)
+    assert flights.stats()['executions'] == 1
+
+
+def test_waiter_cap_rejects_extra_callers():
+    flights = SingleFlight(max_waiters=2)
+    release = threading.Event()
+    results = run_concurrently(4, lambda: flights.do('q', lambda: release.wait(1), timeout=0.2))
+
+    assert sum(isinstance(result, TooManyWaiters) for result in results) == 2
+    release.set()
+
+
+def test_detached_waiter_does_not_cancel_work():
+    flights = SingleFlight()
+    started = threading.Event()
+
+    def work():
+        started.set()
+        time.sleep(0.1)
+        return 'done'
+
+    leader = []
+    thread = threading.Thread(target=lambda: leader.append(flights.do('q', work)))
+    thread.start()
+    started.wait(1)
+
+    with pytest.raises(WaitTimeout):
+        flights.do('q', work, timeout=0.01)
+
+    # A later caller joins the same execution and still gets the result
+    assert flights.do('q', work, timeout=2) == ('done', True)
+    thread.join(1)
+    assert leader == [('done', False)]
+    assert flights.stats()['detached'] == 1
+
+
+def test_leader_runs_work_on_its_own_thread():
+    flights = SingleFlight()
+
+    result, shared = flights.do('q', lambda: threading.current_thread(), timeout=0)
+
+    # No extra thread, so executor limits on the caller bound the work too
+    assert result is threading.current_thread() and not shared
+
+
+def test_distinct_keys_run_separately():
+    flights = SingleFlight()
+
+    assert flights.do('a', lambda: 1) == (1, False)
+    assert flights.do('b', lambda: 2) == (2, False)
+    assert flights.stats()['executions'] == 2
+
+
+def test_identical_api_queries_coalesce(warehouse, client):
+    warehouse.execute_latency = 0.1
+    responses = run_concurrently(
+        4, lambda: client.post('/api/query', json={'query': 'SELECT * FROM trips'})
+    )
+
+    assert len(warehouse.cursors) == 1
+    assert sorted(r.headers['X-Cache'] for r in responses) == ['MISS', 'SHARED', 'SHARED', 'SHARED']
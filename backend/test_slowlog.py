@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the slow-query log (slowlog.py and /api/debug/slow-queries)
+"""
+
+import os
+
+import pytest
+
+from slowlog import SlowQueryLog, fingerprint, normalize_literals
+
+
+class Cursor:
+    def __init__(self, query_id):
+        self.query_id = query_id
+
+
+def log_query(log, query, seconds, rows=10, query_id=None):
+    entry = log.start(query, Cursor(query_id))
+    entry.add(rows, rows * 8)
+    log.record(entry, seconds, 'ok')
+
+
+def test_fingerprint_ignores_literals_but_not_identifiers():
+    a = "SELECT `m1`, SUM(fare) FROM t WHERE zip = 10001 AND vendor IN ('CMT', 'VTS')  LIMIT 100;"
+    b = "select `m1`, SUM(fare) FROM t WHERE zip = 7 AND vendor IN ('x') LIMIT 5"
+
+    assert normalize_literals(a) == "SELECT `m1`, SUM(fare) FROM t WHERE zip = ? AND vendor IN (?) LIMIT ?"
+    assert fingerprint(a)[0] != fingerprint(b)[0]  # keyword case is part of the shape
+    assert fingerprint(a)[0] == fingerprint(a.replace('10001', '2'))[0]
+    assert fingerprint("SELECT `2016`")[1] == "SELECT `2016`"
+    assert fingerprint("SELECT x1 FROM t")[1] == "SELECT x1 FROM t"
+
+
+def test_report_ranks_fingerprints_by_total_and_p95(tmp_path):
+    log = SlowQueryLog(str(tmp_path / 'slow.db'), threshold_ms=100)
+    for zip_code in range(10):
+        log_query(log, f"SELECT * FROM trips WHERE zip = {zip_code}", 0.3, query_id=f"q{zip_code}")
+    log_query(log, "SELECT COUNT(*) FROM trips", 2.0)
+    log_query(log, "SELECT 1", 0.05)  # under the threshold
+
+    by_total = log.report(order='total')
+    assert [group['count'] for group in by_total] == [10, 1]
+    assert by_total[0]['sql'] == "SELECT * FROM trips WHERE zip = ?"
+    assert by_total[0]['total_ms'] == pytest.approx(3000, rel=0.01)
+    assert by_total[0]['avg_rows'] == 10 and by_total[0]['avg_bytes'] == 80
+    assert by_total[0]['last_query_id'] == 'q9'
+    assert by_total[0]['endpoints'] == {'unknown': 10}
+
+    assert log.report(order='p95')[0]['sql'] == "SELECT COUNT(*) FROM trips"
+    assert log.stats()['recorded'] == 11 and log.stats()['written'] == 11
+    with pytest.raises(ValueError):
+        log.report(order='fastest')
+
+
+def test_log_rotates_and_reports_across_files(tmp_path):
+    path = str(tmp_path / 'slow.db')
+    log = SlowQueryLog(path, threshold_ms=0, max_bytes=1, backups=1, flush_interval=0)
+    for batch in range(3):
+        log_query(log, f"SELECT {batch}", 0.01)
+        log.flush()
+
+    assert os.path.exists(path) and os.path.exists(path + '.1') and not os.path.exists(path + '.2')
+    assert log.stats()['rotations'] == 2
+    # The oldest file was rotated away; the other two remain
+    assert log.report()[0]['count'] == 2
+
+
+def test_first_write_after_restart_rotates_a_full_file(tmp_path):
+    path = str(tmp_path / 'slow.db')
+    before = SlowQueryLog(path, threshold_ms=0, flush_interval=0)
+    log_query(before, "SELECT 1", 0.01)
+    before.flush()
+
+    log = SlowQueryLog(path, threshold_ms=0, max_bytes=1, backups=1, flush_interval=0)
+    log_query(log, "SELECT 2", 0.01)
+    log.flush()
+
+    assert log.stats()['rotations'] == 1 and os.path.exists(path + '.1')
+
+
+def test_slow_queries_endpoint(warehouse, client):
+    client.post('/api/query', json={'query': 'SELECT * FROM t WHERE id = 1'})
+    client.post('/api/query', json={'query': 'SELECT * FROM t WHERE id = 2'})
+
+    body = client.get('/api/debug/slow-queries?order=count').get_json()
+
+    top = body['fingerprints'][0]
+    assert top['sql'] == 'SELECT * FROM t WHERE id = ?' and top['count'] == 2
+    assert top['endpoints'] == {'run_query': 2}
+    assert top['last_query_id'] == warehouse.cursors[-1].query_id
+    assert body['log']['recorded'] == 2
+    assert client.get('/api/debug/slow-queries?order=nope').status_code == 400
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Offline tests for /api/query result formats: NDJSON and Arrow streaming,
+columnar JSON
+Uses the fake warehouse fixtures from conftest.py
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pyarrow as pa
+
+import api
+import db
+
+
+def read_ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_stream_emits_meta_rows_and_end(warehouse, client):
+    response = client.post('/api/query', json={'query': 'SELECT *', 'stream': True})
+    lines = read_ndjson(response)
+
+    assert response.mimetype == 'application/x-ndjson'
+    assert lines[0] == {'type': 'meta', 'columns': ['id', 'name']}
+    assert lines[1] == [0, 'row-0']
+    assert len(lines) == 27
+    assert lines[-1]['status'] == 'success'
+    assert lines[-1]['row_count'] == 25
+    assert lines[-1]['truncated'] is False
+
+
+def test_accept_header_selects_stream(warehouse, client):
+    response = client.post('/api/query', json={'query': 'SELECT *'},
+                           headers={'Accept': 'application/x-ndjson'})
+
+    assert response.mimetype == 'application/x-ndjson'
+
+
+def test_row_ceiling_truncates_and_cancels(warehouse, client):
+    response = client.post('/api/query', json={'query': 'SELECT *', 'stream': True, 'max_rows': 12})
+    lines = read_ndjson(response)
+
+    assert lines[-1]['row_count'] == 12
+    assert lines[-1]['truncated_reason'] == 'max_rows'
+    assert warehouse.cursors[0].cancelled
+    assert warehouse.cursors[0].fetched == 20
+
+
+def test_byte_ceiling_truncates(warehouse, client, monkeypatch):
+    monkeypatch.setattr(api, 'STREAM_MAX_BYTES', 200)
+    lines = read_ndjson(client.post('/api/query', json={'query': 'SELECT *', 'stream': True}))
+
+    assert lines[-1]['truncated_reason'] == 'max_bytes'
+    assert 0 < lines[-1]['row_count'] < 25
+
+
+def test_empty_result_reports_columns(warehouse, client):
+    warehouse.result = (['id'], [])
+    lines = read_ndjson(client.post('/api/query', json={'query': 'SELECT *', 'stream': True}))
+
+    assert lines == [
+        {'type': 'meta', 'columns': ['id']},
+        {'type': 'end', 'status': 'success', 'row_count': 0, 'columns': ['id'],
+         'truncated': False, 'truncated_reason': None},
+    ]
+
+
+def test_query_error_before_stream_is_json_500(warehouse, client):
+    response = client.post('/api/query', json={'query': 'bad sql', 'stream': True})
+
+    assert response.status_code == 500
+    assert 'PARSE_SYNTAX_ERROR' in response.get_json()['message']
+
+
+def test_error_mid_stream_reported_in_end_line(warehouse, client):
+    warehouse.result = (['id'], [(i,) for i in range(25)])
+    warehouse.fail_after = 10
+    lines = read_ndjson(client.post('/api/query', json={'query': 'SELECT *', 'stream': True}))
+
+    assert lines[-1]['status'] == 'error'
+    assert lines[-1]['row_count'] == 10
+    assert db.get_pool_stats()['in_use'] == 0
+
+
+def test_buffered_query_still_returns_json(warehouse, client):
+    data = client.post('/api/query', json={'query': 'SELECT *'}).get_json()
+
+    assert data['status'] == 'success'
+    assert data['row_count'] == 25
+    assert data['columns'] == ['id', 'name']
+
+
+ARROW = 'application/vnd.apache.arrow.stream'
+
+
+def read_arrow(response):
+    reader = pa.ipc.open_stream(response.get_data())
+    batches = []
+    metadata = None
+    while True:
+        try:
+            batch, metadata = reader.read_next_batch_with_custom_metadata()
+        except StopIteration:
+            break
+        batches.append(batch)
+    return pa.Table.from_batches(batches, schema=reader.schema), metadata
+
+
+def test_execute_query_returns_arrow_table(warehouse):
+    table = db.execute_query('SELECT *', return_arrow=True)
+
+    assert isinstance(table, pa.Table)
+    assert table.num_rows == 25
+    assert table.column_names == ['id', 'name']
+
+
+def test_arrow_stream_round_trips(warehouse, client):
+    response = client.post('/api/query', json={'query': 'SELECT *'}, headers={'Accept': ARROW})
+    table, metadata = read_arrow(response)
+
+    assert response.mimetype == ARROW
+    assert table.num_rows == 25
+    assert table.column('name')[3].as_py() == 'row-3'
+    assert metadata[b'status'] == b'success'
+    assert metadata[b'row_count'] == b'25'
+    assert metadata[b'truncated'] == b'false'
+
+
+def test_arrow_stream_row_ceiling(warehouse, client):
+    response = client.post('/api/query', json={'query': 'SELECT *', 'max_rows': 15},
+                           headers={'Accept': ARROW})
+    table, metadata = read_arrow(response)
+
+    assert table.num_rows == 15
+    assert metadata[b'truncated_reason'] == b'max_rows'
+    assert warehouse.cursors[0].cancelled
+
+
+def test_arrow_stream_empty_result_keeps_schema(warehouse, client):
+    warehouse.result = (['id'], [])
+    table, metadata = read_arrow(client.post('/api/query', json={'query': 'SELECT *'},
+                                             headers={'Accept': ARROW}))
+
+    assert table.num_rows == 0
+    assert table.column_names == ['id']
+    assert metadata[b'row_count'] == b'0'
+
+
+def test_arrow_to_columnar_converts_per_column():
+    table = pa.table({
+        'd': [date(2024, 1, 2), None],
+        'ts': [datetime(2024, 1, 2, 3, 4), None],
+        'amount': pa.array([Decimal('1.50'), None], pa.decimal128(10, 2)),
+        'n': [7, 8],
+    })
+    result = db.arrow_to_columnar(table)
+
+    assert result['columns'] == ['d', 'ts', 'amount', 'n']
+    assert result['types'][:3] == ['date', 'timestamp', 'decimal']
+    assert result['data'] == [
+        ['2024-01-02', None],
+        ['2024-01-02T03:04:00', None],
+        [1.5, None],
+        [7, 8],
+    ]
+    assert result['row_count'] == 2
+
+
+def test_columnar_format_endpoint(warehouse, client):
+    data = client.post('/api/query', json={'query': 'SELECT *', 'format': 'columnar'}).get_json()
+
+    assert data['status'] == 'success'
+    assert data['columns'] == ['id', 'name']
+    assert data['row_count'] == 25
+    assert data['data'][0] == list(range(25))
+    assert data['data'][1][2] == 'row-2'
+
+
+def test_columnar_format_empty_result(warehouse, client):
+    warehouse.result = (['id'], [])
+    data = client.post('/api/query?format=columnar', json={'query': 'SELECT *'}).get_json()
+
+    assert data['data'] == [[]]
+    assert data['row_count'] == 0
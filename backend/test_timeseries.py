@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the incremental time-series cache (timeseries.py,
+db.fetch_series and /api/chart)
+"""
+
+from datetime import datetime, timedelta
+
+from auth import FakeClock
+from conftest import TRIPS_TABLE
+from timeseries import SeriesCache, merge_intervals, rollup_buckets, subtract_intervals
+
+
+def day(d):
+    return datetime(2016, 1, d)
+
+
+def chart_body(start, end):
+    return {
+        'table': TRIPS_TABLE,
+        'grain': 'day',
+        'metrics': [{'column': 'fare_amount', 'aggregation': 'sum', 'name': 'Fare'}],
+        'date_range': {'start': start, 'end': end},
+    }
+
+
+def test_interval_arithmetic():
+    assert merge_intervals([(day(5), day(7)), (day(1), day(3)), (day(3), day(4))]) == [
+        (day(1), day(4)), (day(5), day(7))]
+    assert subtract_intervals([(day(1), day(10))], [(day(3), day(5)), (day(8), day(12))]) == [
+        (day(1), day(3)), (day(5), day(8))]
+
+
+def test_lookup_reports_only_missing_ranges():
+    cache = SeriesCache(1024 * 1024, clock=FakeClock())
+    cache.store('s', [(day(1), day(10))], {day(1): 1.0, day(2): 2.0}, open_from=day(31))
+
+    values, missing = cache.lookup('s', [(day(1), day(15))])
+
+    assert values == {day(1): 1.0, day(2): 2.0}
+    assert missing == [(day(10), day(15))]
+    assert cache.stats()['partial_hits'] == 1
+
+
+def test_open_bucket_expires_before_closed_ones():
+    clock = FakeClock()
+    cache = SeriesCache(1024 * 1024, ttl=3600, open_ttl=60, clock=clock)
+    cache.store('s', [(day(1), day(11))], {day(9): 9.0, day(10): 10.0}, open_from=day(10))
+
+    clock.advance(61)
+    values, missing = cache.lookup('s', [(day(1), day(11))])
+
+    assert missing == [(day(10), day(11))]
+    assert day(9) in values and day(10) not in values
+
+
+def test_widening_the_range_fetches_only_new_days(warehouse, trips, client):
+    warehouse.result = (['time', '_m0_sum'], [(day(d), float(d)) for d in range(1, 21)])
+    first = client.post('/api/chart', json=chart_body('2016-01-01', '2016-01-10'))
+    assert first.headers['X-Cache'] == 'MISS'
+
+    second = client.post('/api/chart', json=chart_body('2016-01-01', '2016-01-20'))
+    body = second.get_json()
+
+    assert second.headers['X-Cache'] == 'PARTIAL'
+    query = warehouse.cursors[-1].query
+    assert "TIMESTAMP '2016-01-11 00:00:00'" in query
+    assert "TIMESTAMP '2016-01-01 00:00:00'" not in query
+    assert [row['Fare'] for row in body['data']] == [float(d) for d in range(1, 21)]
+
+    third = client.post('/api/chart', json=chart_body('2016-01-05', '2016-01-15'))
+    assert third.headers['X-Cache'] == 'HIT'
+    assert len(warehouse.cursors) == 2
+    assert third.get_json()['row_count'] == 11
+
+
+def test_rollup_buckets_merges_partials_by_calendar():
+    values = {day(3): (2, 10.0, 1.0), day(4): (1, 5.0, 4.0), day(11): (3, None, None)}
+
+    assert rollup_buckets(values, 'week', ['SUM', 'SUM', 'MIN']) == {
+        datetime(2016, 1, 4): (1, 5.0, 4.0),
+        datetime(2015, 12, 28): (2, 10.0, 1.0),
+        datetime(2016, 1, 11): (3, None, None),
+    }
+    assert rollup_buckets(values, 'month', ['SUM', 'SUM', 'MIN']) == {
+        datetime(2016, 1, 1): (6, 15.0, 1.0)}
+
+
+def test_coarser_grain_is_rolled_up_from_cached_days(warehouse, trips, client):
+    body = {
+        'table': TRIPS_TABLE,
+        'grain': 'day',
+        'metrics': [{'column': 'fare_amount', 'aggregation': 'avg', 'name': 'Fare'}],
+        'date_range': {'start': '2016-01-01', 'end': '2016-02-29'},
+    }
+    days = [datetime(2016, 1, 1) + timedelta(days=i) for i in range(60)]
+    warehouse.result = (['time', '_m0_sum', '_m0_count'], [(d, 10.0 * d.month, 2) for d in days])
+    client.post('/api/chart', json=body)
+    assert 'SUM(`fare_amount`) AS `_m0_sum`, COUNT(`fare_amount`) AS `_m0_count`' in warehouse.cursors[-1].query
+
+    response = client.post('/api/chart', json={**body, 'grain': 'month'})
+
+    assert response.headers['X-Cache'] == 'ROLLUP'
+    assert len(warehouse.cursors) == 1
+    assert [row['Fare'] for row in response.get_json()['data']] == [5.0, 10.0]
+
+
+def test_count_distinct_is_not_rolled_up(warehouse, trips, client):
+    body = chart_body('2016-01-01', '2016-01-31')
+    body['metrics'] = [{'column': 'vendor', 'aggregation': 'count_distinct', 'name': 'Vendors'}]
+    warehouse.result = (['time', '_m0_value'], [(day(d), 2) for d in range(1, 32)])
+    client.post('/api/chart', json=body)
+
+    response = client.post('/api/chart', json={**body, 'grain': 'month'})
+
+    assert response.headers['X-Cache'] == 'MISS'
+    assert 'COUNT(DISTINCT `vendor`) AS `_m0_value`' in warehouse.cursors[-1].query
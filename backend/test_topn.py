@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Offline tests for server-side Top-N (topn.py and /api/topn)
+"""
+
+from conftest import TRIPS_TABLE
+from topn import build_topn_query, parse_topn_spec, shape_topn
+
+
+def topn_body(**overrides):
+    body = {'table': TRIPS_TABLE, 'dimension': 'vendor', 'metric': 'fare_amount',
+            'aggregation': 'sum', 'limit': 2}
+    body.update(overrides)
+    return body
+
+
+def test_exact_query_ranks_and_folds_in_warehouse(trips):
+    sql = build_topn_query(parse_topn_spec(topn_body(), trips))
+
+    assert "SUM(`fare_amount`) AS `_sum`" in sql
+    assert "DENSE_RANK() OVER (ORDER BY `name_value` DESC NULLS LAST" in sql
+    assert "GROUP BY LEAST(`name_rank`, 3)" in sql
+    assert "`tpep_pickup_datetime`" not in sql
+
+
+def test_avg_folds_other_from_sum_and_count(trips):
+    spec = parse_topn_spec(topn_body(aggregation='avg', limit=1), trips)
+    rows = [
+        {'name': 'a', 'name_rank': 1, 'name_other': False, '_sum': 30.0, '_count': 3, 'groups': 1},
+        {'name': 'b', 'name_rank': 2, 'name_other': True, '_sum': 10.0, '_count': 5, 'groups': 3},
+    ]
+    body = shape_topn(rows, spec)
+
+    assert body['data'] == [
+        {'name': 'a', 'rank': 1, 'is_other': False, 'value': 10.0},
+        {'name': 'Other', 'rank': 2, 'is_other': True, 'value': 2.0},
+    ]
+    assert body['total'] == 5.0
+    assert body['groups'] == 3 and body['other_groups'] == 2
+
+
+def test_topn_endpoint_with_secondary_dimension(warehouse, trips, client):
+    columns = ['name_rank', 'name', 'name_other', 'series_rank', 'series', 'series_other', '_sum', 'groups']
+    warehouse.result = (columns, [
+        (1, 'CMT', False, 1, 'card', False, 50.0, 1),
+        (1, 'CMT', False, 2, 'cash', True, 5.0, 1),
+        (2, 'VTS', False, 1, 'card', False, 30.0, 2),
+        (3, 'DDS', True, 1, 'card', False, 4.0, 7),
+    ])
+    response = client.post('/api/topn', json=topn_body(secondary_dimension='pickup_zip', secondary_limit=1))
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body['series'] == ['card', 'Other']
+    assert body['data'][0] == {'name': 'CMT', 'rank': 1, 'is_other': False, 'total': 55.0, 'card': 50.0, 'Other': 5.0}
+    assert body['data'][-1]['is_other'] and body['data'][-1]['total'] == 4.0
+    assert body['total'] == 89.0
+    assert body['other_groups'] == 5
+
+
+def test_approximate_mode_ranks_candidates_by_metric(warehouse, trips, client):
+    warehouse.result = (['name', 'name_other', '_count', 'groups'], [
+        ('a', False, 5, 1000),
+        ('b', False, 9, 1000),
+        ('c', False, 7, 1000),
+        (None, True, 100, 1000),
+    ])
+    response = client.post('/api/topn', json=topn_body(metric='*', aggregation='count', approximate=True))
+    body = response.get_json()
+
+    assert "approx_top_k(t.`vendor`, 10)" in body['sql']
+    assert "approx_count_distinct(t.`vendor`)" in body['sql']
+    assert [row['name'] for row in body['data']] == ['b', 'c', 'Other']
+    assert body['data'][-1]['value'] == 105
+    assert body['total'] == 121
+    assert body['approximate'] is True
+
+
+def test_unknown_dimension_is_rejected(warehouse, trips, client):
+    response = client.post('/api/topn', json=topn_body(dimension='vendor; DROP TABLE x'))
+
+    assert response.status_code == 400
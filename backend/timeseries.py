@@ -0,0 +1,227 @@
+"""
+Incremental time-series cache
+Keeps per-bucket aggregates for each series together with the time ranges
+they cover, so a wider request only has to fetch the ranges not seen yet,
+and rolls partial aggregates up into coarser grains
+"""
+
+import threading
+import time
+from datetime import datetime, timezone
+
+from cache import ResultCache
+
+# Grains whose buckets each lie inside a single bucket of the key grain,
+# coarsest first. Weeks straddle months, so nothing coarser rolls up from them.
+FINER_GRAINS = {
+    'day': ('hour',),
+    'week': ('day', 'hour'),
+    'month': ('day', 'hour'),
+    'quarter': ('month', 'day', 'hour'),
+    'year': ('quarter', 'month', 'day', 'hour'),
+}
+
+
+def naive_utc(value):
+    """Bucket time from Arrow/the connector as a naive UTC datetime"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    return datetime(value.year, value.month, value.day)
+
+
+def merge_intervals(intervals):
+    """Sort [start, end) intervals and join overlapping or touching ones"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(intervals, remove):
+    """Parts of [start, end) intervals not covered by the remove intervals"""
+    remaining = list(intervals)
+    for cut_start, cut_end in remove:
+        pieces = []
+        for start, end in remaining:
+            if cut_end <= start or cut_start >= end:
+                pieces.append((start, end))
+                continue
+            if start < cut_start:
+                pieces.append((start, cut_start))
+            if cut_end < end:
+                pieces.append((cut_end, end))
+        remaining = pieces
+    return remaining
+
+
+def rollup_buckets(values, grain, merges):
+    """
+    Re-bucket partial aggregates into coarser grain buckets
+
+    Truncation and merging run in Arrow (floor_temporal + group_by), with
+    weeks starting on Monday as in DATE_TRUNC.
+
+    Args:
+        values (dict): {bucket time: tuple of partials} at a finer grain
+        grain (str): Grain to roll up to
+        merges (list): How each partial merges: SUM, MIN or MAX
+
+    Returns:
+        dict: {grain bucket time: tuple of merged partials}
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if not values:
+        return {}
+    times = pa.array(list(values), pa.timestamp('us'))
+    columns = {'time': pc.floor_temporal(times, unit=grain, week_starts_monday=True)}
+    for index in range(len(merges)):
+        column = pa.array([partials[index] for partials in values.values()])
+        # All-null partials (e.g. MIN over empty buckets) have no kernels
+        columns[f'p{index}'] = column.cast(pa.int64()) if pa.types.is_null(column.type) else column
+    aggregations = [(f'p{index}', merge.lower()) for index, merge in enumerate(merges)]
+    grouped = pa.table(columns).group_by('time').aggregate(aggregations)
+    buckets = [naive_utc(t) for t in grouped.column('time').to_pylist()]
+    merged = zip(*(grouped.column(f'{name}_{function}').to_pylist() for name, function in aggregations))
+    return dict(zip(buckets, merged))
+
+
+class _Series:
+    __slots__ = ('buckets', 'coverage')
+
+    def __init__(self):
+        self.buckets = {}
+        # (start, end, expires_at) - ranges whose buckets are all known
+        self.coverage = []
+
+    def nbytes(self):
+        return 200 + 64 * len(self.buckets) + 64 * len(self.coverage)
+
+
+class SeriesCache:
+    """
+    Per-bucket values of time series, filled in range by range
+
+    A series is identified by the caller's key (table, time column, metric,
+    aggregation, filters, grain). Values are opaque to the cache; db.py stores
+    tuples of partial aggregates. Each stored range records when it expires:
+    closed buckets live for ttl, while the bucket containing "now" and any
+    later ones may still change and are only trusted for open_ttl. Series
+    are evicted least-recently-used under max_bytes.
+
+    Args:
+        max_bytes (int): Total size budget across all series
+        ttl (float): Seconds closed buckets are kept
+        open_ttl (float): Seconds the current, still-filling bucket is kept
+        clock (callable): Monotonic time source
+    """
+
+    def __init__(self, max_bytes, ttl=3600, open_ttl=60, clock=time.monotonic):
+        self.ttl = ttl
+        self.open_ttl = open_ttl
+        self._clock = clock
+        self._series = ResultCache(max_bytes, default_ttl=ttl, clock=clock)
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'full_hits': 0, 'partial_hits': 0, 'misses': 0,
+                       'fetched_ranges': 0, 'rollups': 0}
+
+    def lookup(self, key, ranges):
+        """
+        Known buckets within ranges and the parts that still need fetching
+
+        Args:
+            key: Series key
+            ranges (list): Bucket-aligned [start, end) datetime pairs
+
+        Returns:
+            tuple: (values, missing) - {bucket time: value} and a list of
+            [start, end) intervals not covered by unexpired data
+        """
+        ranges = merge_intervals(ranges)
+        with self._lock:
+            series = self._series.get(key)
+            now = self._clock()
+            if series is None:
+                values, missing = {}, ranges
+            else:
+                valid = [(start, end) for start, end, expires_at in series.coverage if expires_at > now]
+                missing = subtract_intervals(ranges, valid)
+                values = {
+                    bucket: value for bucket, value in series.buckets.items()
+                    if any(start <= bucket < end for start, end in ranges)
+                    and not any(start <= bucket < end for start, end in missing)
+                }
+            self._stats['lookups'] += 1
+            if not missing:
+                self._stats['full_hits'] += 1
+            elif missing == ranges:
+                self._stats['misses'] += 1
+            else:
+                self._stats['partial_hits'] += 1
+        return values, missing
+
+    def store(self, key, intervals, values, open_from, rolled_up=False):
+        """
+        Record freshly fetched buckets for the given intervals
+
+        Buckets inside the intervals that are missing from values had no
+        rows and are dropped.
+
+        Args:
+            key: Series key
+            intervals (list): [start, end) ranges that were queried
+            values (dict): {bucket time: value} from the query
+            open_from (datetime): Start of the bucket containing now; buckets
+                from here on get open_ttl
+            rolled_up (bool): Values were derived from a finer grain rather
+                than fetched
+        """
+        with self._lock:
+            series = self._series.get(key) or _Series()
+            now = self._clock()
+            series.coverage = [
+                (start, end, expires_at)
+                for cut_start, cut_end, expires_at in series.coverage
+                for start, end in subtract_intervals([(cut_start, cut_end)], intervals)
+            ]
+            for start, end in intervals:
+                for bucket in [b for b in series.buckets if start <= b < end]:
+                    del series.buckets[bucket]
+                for bucket, value in values.items():
+                    if start <= bucket < end:
+                        series.buckets[bucket] = value
+                if start < open_from:
+                    series.coverage.append((start, min(end, open_from), now + self.ttl))
+                if end > open_from:
+                    series.coverage.append((max(start, open_from), end, now + self.open_ttl))
+            series.coverage.sort()
+            self._stats['rollups' if rolled_up else 'fetched_ranges'] += len(intervals)
+            self._series.put(key, series, series.nbytes())
+
+    def invalidate(self, key=None):
+        """Drop one series, or all of them when key is None"""
+        with self._lock:
+            return self._series.invalidate(key)
+
+    def stats(self):
+        """
+        Series cache counters
+
+        Returns:
+            dict: series held, bytes used and lookup counters
+        """
+        with self._lock:
+            cache = self._series.stats()
+            return {
+                'series': cache['entries'],
+                'bytes': cache['bytes'],
+                'max_bytes': cache['max_bytes'],
+                'evictions': cache['evictions'],
+                **self._stats,
+            }
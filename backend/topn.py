@@ -0,0 +1,371 @@
+"""
+Server-side Top-N
+Ranks a dimension by an aggregated metric in the warehouse and folds the tail
+into a single "Other" row, optionally broken down by a secondary dimension
+"""
+
+from dataclasses import dataclass
+
+from charts import (
+    PARTIALS, Metric, column_lookup, parse_filter, parse_metric, parse_time_window,
+    resolve_column, resolve_time_column, where_conditions,
+)
+from schema import quote_identifier, quote_table_name
+
+OTHER_LABEL = 'Other'
+MAX_LIMIT = 1000
+# approx_top_k tracks candidates by row count; over-fetch them so ranking by
+# the metric still finds the true top N in skewed data
+APPROX_CANDIDATE_FACTOR = 5
+APPROX_MAX_CANDIDATES = 10000
+
+
+@dataclass(frozen=True)
+class TopNSpec:
+    """
+    A validated Top-N request
+
+    Filters and the optional time window use the same fields as ChartSpec so
+    charts.where_conditions() applies to both.
+    """
+    table: str
+    dimension: str
+    metric: Metric
+    limit: int = 10
+    secondary: str = None
+    secondary_limit: int = 10
+    filters: tuple = ()
+    time_column: str = None
+    trailing: tuple = None
+    start: object = None
+    end: object = None
+    approximate: bool = False
+
+
+def _parse_limit(value, default, what):
+    try:
+        limit = int(value if value is not None else default)
+    except (TypeError, ValueError):
+        raise ValueError(f"{what} must be an integer")
+    if not 0 < limit <= MAX_LIMIT:
+        raise ValueError(f"{what} must be between 1 and {MAX_LIMIT}")
+    return limit
+
+
+def parse_topn_spec(body, columns):
+    """
+    Validate a Top-N request against the table's columns
+
+    Args:
+        body (dict): table, dimension, metric, aggregation, limit,
+            secondary_dimension, secondary_limit, filters, trailing,
+            date_range, time_column and approximate
+        columns (list): schema.ColumnInfo records for the table
+
+    Returns:
+        TopNSpec
+
+    Raises:
+        ValueError: If any part of the request is invalid
+    """
+    table = body.get('table')
+    quote_table_name(table)
+    lookup = column_lookup(columns)
+
+    dimension = resolve_column(lookup, body.get('dimension'), 'dimension').name
+    metric = parse_metric({'column': body.get('metric'), 'aggregation': body.get('aggregation')}, lookup)
+    if not metric.decomposable:
+        raise ValueError(f"Top-N cannot fold {metric.aggregation} into an Other row")
+    secondary_name = body.get('secondary_dimension') or body.get('secondaryDimension')
+    secondary = resolve_column(lookup, secondary_name, 'secondary dimension').name if secondary_name else None
+    if secondary is not None and secondary == dimension:
+        raise ValueError("secondary_dimension must differ from dimension")
+
+    trailing, start, end = parse_time_window(body)
+    time_column = None
+    if trailing or start is not None or end is not None:
+        time_column = resolve_time_column(body, columns)
+        if time_column is None:
+            raise ValueError(f"Table '{table}' has no date or timestamp column to apply the time range to")
+
+    return TopNSpec(
+        table=table,
+        dimension=dimension,
+        metric=metric,
+        limit=_parse_limit(body.get('limit'), 10, 'limit'),
+        secondary=secondary,
+        secondary_limit=_parse_limit(body.get('secondary_limit'), 10, 'secondary_limit'),
+        filters=tuple(parse_filter(item, lookup) for item in body.get('filters') or []),
+        time_column=time_column.name if time_column is not None else None,
+        trailing=trailing,
+        start=start,
+        end=end,
+        approximate=bool(body.get('approximate')),
+    )
+
+
+def _where(spec):
+    if spec.time_column is not None:
+        return where_conditions(spec)
+    return [f.to_sql() for f in spec.filters] or ['TRUE']
+
+
+def _partial_selects(metric, prefix=''):
+    value = '1' if metric.column == '*' else prefix + quote_identifier(metric.column)
+    return [f"{function}({value}) AS `{alias}`" for alias, function, _ in PARTIALS[metric.aggregation]]
+
+
+def _merged(metric, over=''):
+    """Partials merged across rows (or a window), keeping their aliases"""
+    return [f"{merge}(`{alias}`){over} AS `{alias}`" for alias, _, merge in PARTIALS[metric.aggregation]]
+
+
+def _value_sql(metric, over=''):
+    """Final metric value from partials merged across rows or a window"""
+    if metric.aggregation == 'avg':
+        return f"SUM(`_sum`){over} / NULLIF(SUM(`_count`){over}, 0)"
+    alias, _, merge = PARTIALS[metric.aggregation][0]
+    return f"{merge}(`{alias}`){over}"
+
+
+def build_topn_query(spec):
+    """
+    Exact Top-N in one statement
+
+    Groups are aggregated once into partials; window functions rank each
+    dimension value by its merged metric, and a final GROUP BY on
+    LEAST(rank, N + 1) folds everything past N into one row per dimension.
+
+    Returns:
+        str: SQL returning name, name_rank, name_other, [series, series_rank,
+        series_other,] partial aggregates and groups, ordered by rank
+    """
+    metric = spec.metric
+    keys = [f"{quote_identifier(spec.dimension)} AS `name`"]
+    if spec.secondary:
+        keys.append(f"{quote_identifier(spec.secondary)} AS `series`")
+    group_by = ', '.join(str(i + 1) for i in range(len(keys)))
+
+    totals = [f"{_value_sql(metric, ' OVER (PARTITION BY `name`)')} AS `name_value`"]
+    ranks = ["DENSE_RANK() OVER (ORDER BY `name_value` DESC NULLS LAST, `name` NULLS LAST) AS `name_rank`"]
+    final = [
+        "MIN(`name_rank`) AS `name_rank`",
+        "MAX(`name`) AS `name`",
+        f"MIN(`name_rank`) > {spec.limit} AS `name_other`",
+    ]
+    buckets = [f"LEAST(`name_rank`, {spec.limit + 1})"]
+    if spec.secondary:
+        totals.append(f"{_value_sql(metric, ' OVER (PARTITION BY `series`)')} AS `series_value`")
+        ranks.append("DENSE_RANK() OVER (ORDER BY `series_value` DESC NULLS LAST, `series` NULLS LAST) AS `series_rank`")
+        final += [
+            "MIN(`series_rank`) AS `series_rank`",
+            "MAX(`series`) AS `series`",
+            f"MIN(`series_rank`) > {spec.secondary_limit} AS `series_other`",
+        ]
+        buckets.append(f"LEAST(`series_rank`, {spec.secondary_limit + 1})")
+    final += _merged(metric) + ["MAX(`name_rank`) AS `groups`"]
+
+    return (
+        "WITH grouped AS (\n"
+        f"  SELECT {', '.join(keys + _partial_selects(metric))}\n"
+        f"  FROM {quote_table_name(spec.table)}\n"
+        f"  WHERE {' AND '.join(_where(spec))}\n"
+        f"  GROUP BY {group_by}\n"
+        "), totals AS (\n"
+        f"  SELECT *, {', '.join(totals)} FROM grouped\n"
+        "), ranked AS (\n"
+        f"  SELECT *, {', '.join(ranks)} FROM totals\n"
+        ")\n"
+        f"SELECT {', '.join(final)}\n"
+        "FROM ranked\n"
+        f"GROUP BY {', '.join(buckets)}\n"
+        f"ORDER BY {', '.join(buckets)}"
+    )
+
+
+def build_approx_topn_query(spec):
+    """
+    Approximate Top-N for very high-cardinality dimensions
+
+    approx_top_k() picks candidate values (the most frequent ones) and
+    approx_count_distinct() sizes the dimension in a first aggregate; the
+    metric is then aggregated over candidates plus a single bucket for
+    everything else, so the shuffle is bounded by the candidate count rather
+    than the dimension's cardinality. Candidates are ranked by the metric
+    afterwards (see shape_topn).
+
+    Returns:
+        str: SQL returning name, name_other, [series, series_other,]
+        partial aggregates and groups
+    """
+    metric = spec.metric
+    dimension = 't.' + quote_identifier(spec.dimension)
+    candidates = min(spec.limit * APPROX_CANDIDATE_FACTOR, APPROX_MAX_CANDIDATES)
+    picks = [
+        f"transform(approx_top_k({dimension}, {candidates}), x -> x.item) AS `_topn_names`",
+        f"approx_count_distinct({dimension}) AS `_topn_groups`",
+    ]
+    keys = [
+        f"CASE WHEN array_contains(c.`_topn_names`, {dimension}) THEN {dimension} END AS `name`",
+        f"NOT coalesce(array_contains(c.`_topn_names`, {dimension}), false) AS `name_other`",
+    ]
+    if spec.secondary:
+        secondary = 't.' + quote_identifier(spec.secondary)
+        series_candidates = min(spec.secondary_limit * APPROX_CANDIDATE_FACTOR, APPROX_MAX_CANDIDATES)
+        picks.append(f"transform(approx_top_k({secondary}, {series_candidates}), x -> x.item) AS `_topn_series`")
+        keys += [
+            f"CASE WHEN array_contains(c.`_topn_series`, {secondary}) THEN {secondary} END AS `series`",
+            f"NOT coalesce(array_contains(c.`_topn_series`, {secondary}), false) AS `series_other`",
+        ]
+    where = ' AND '.join(_where(spec))
+    group_by = ', '.join(str(i + 1) for i in range(len(keys)))
+    return (
+        "WITH candidates AS (\n"
+        f"  SELECT {', '.join(picks)}\n"
+        f"  FROM {quote_table_name(spec.table)} AS t\n"
+        f"  WHERE {where}\n"
+        ")\n"
+        f"SELECT {', '.join(keys + _partial_selects(metric, prefix='t.'))}, "
+        "MAX(c.`_topn_groups`) AS `groups`\n"
+        f"FROM {quote_table_name(spec.table)} AS t CROSS JOIN candidates c\n"
+        f"WHERE {where}\n"
+        f"GROUP BY {group_by}"
+    )
+
+
+def _merge_into(target, row, metric):
+    for alias, _, merge in PARTIALS[metric.aggregation]:
+        value = row.get(alias)
+        if value is None:
+            continue
+        current = target.get(alias)
+        if current is None:
+            target[alias] = value
+        elif merge == 'SUM':
+            target[alias] = current + value
+        elif merge == 'MIN':
+            target[alias] = min(current, value)
+        else:
+            target[alias] = max(current, value)
+
+
+def _final(partials, metric):
+    if metric.aggregation == 'avg':
+        total, count = partials.get('_sum'), partials.get('_count')
+        return total / count if total is not None and count else None
+    value = partials.get(PARTIALS[metric.aggregation][0][0])
+    if value is None and metric.aggregation == 'count':
+        return 0
+    return value
+
+
+def _number(value):
+    return float(value) if value is not None and not isinstance(value, (int, float)) else value
+
+
+def _rank_candidates(rows, key, other_key, limit, metric):
+    """Mark all but the top `limit` candidate values (by metric) as other"""
+    totals = {}
+    for row in rows:
+        if not row[other_key]:
+            _merge_into(totals.setdefault(row[key], {}), row, metric)
+    ranked = sorted(totals, key=lambda value: (
+        _final(totals[value], metric) is None, -(_number(_final(totals[value], metric)) or 0), str(value)))
+    keep = set(ranked[:limit])
+    for row in rows:
+        if row[key] not in keep:
+            row[other_key] = True
+
+
+def _label(value):
+    return 'Unknown' if value is None else str(value)
+
+
+def shape_topn(rows, spec, include_other=True):
+    """
+    Turn Top-N query rows into the response body
+
+    Args:
+        rows (list): Row dicts from build_topn_query or build_approx_topn_query
+        spec (TopNSpec): The request
+        include_other (bool): Keep the folded "Other" row in data
+
+    Returns:
+        dict: data (ranked rows, "Other" last), total (metric over every
+        group), groups (distinct dimension values, approximate in
+        approximate mode), other_groups and, with a secondary dimension,
+        series (the stacked series names)
+    """
+    metric = spec.metric
+    if spec.approximate:
+        _rank_candidates(rows, 'name', 'name_other', spec.limit, metric)
+        if spec.secondary:
+            _rank_candidates(rows, 'series', 'series_other', spec.secondary_limit, metric)
+
+    grand = {}
+    primary = {}
+    order = []
+    series_order = {}
+    groups = 0
+    for row in rows:
+        _merge_into(grand, row, metric)
+        groups = max(groups, row.get('groups') or 0)
+        key = OTHER_LABEL if row['name_other'] else ('top', row['name'])
+        if key not in primary:
+            primary[key] = {'partials': {}, 'series': {}, 'rank': row.get('name_rank')}
+            order.append(key)
+        entry = primary[key]
+        _merge_into(entry['partials'], row, metric)
+        if spec.secondary:
+            series = OTHER_LABEL if row['series_other'] else _label(row['series'])
+            _merge_into(entry['series'].setdefault(series, {}), row, metric)
+            series_order.setdefault(series, row.get('series_rank') or 0)
+
+    top = [key for key in order if key != OTHER_LABEL]
+    top.sort(key=lambda key: (
+        primary[key]['rank'] if primary[key]['rank'] is not None else 0,
+        _final(primary[key]['partials'], metric) is None,
+        -(_number(_final(primary[key]['partials'], metric)) or 0),
+    ))
+    data = []
+    for rank, key in enumerate(top, start=1):
+        data.append(_shape_row(key[1], rank, False, primary[key], spec))
+    top_groups = len(top)
+    if OTHER_LABEL in primary and include_other:
+        data.append(_shape_row(OTHER_LABEL, len(top) + 1, True, primary[OTHER_LABEL], spec))
+
+    body = {
+        'data': data,
+        'total': _number(_final(grand, metric)),
+        'groups': groups,
+        'other_groups': max(groups - top_groups, 0) if OTHER_LABEL in primary else 0,
+        'approximate': spec.approximate,
+    }
+    if spec.secondary:
+        names = sorted((s for s in series_order if s != OTHER_LABEL), key=lambda s: series_order[s])
+        if spec.approximate:
+            names.sort(key=lambda s: -(_number(_series_total(primary, s, metric)) or 0))
+        if OTHER_LABEL in series_order:
+            names.append(OTHER_LABEL)
+        body['series'] = names
+    return body
+
+
+def _series_total(primary, series, metric):
+    partials = {}
+    for entry in primary.values():
+        if series in entry['series']:
+            _merge_into(partials, entry['series'][series], metric)
+    return _final(partials, metric)
+
+
+def _shape_row(name, rank, is_other, entry, spec):
+    value = _number(_final(entry['partials'], spec.metric))
+    row = {'name': name, 'rank': rank, 'is_other': is_other}
+    if not spec.secondary:
+        row['value'] = value
+        return row
+    row['total'] = value
+    for series, partials in entry['series'].items():
+        row[series] = _number(_final(partials, spec.metric))
+    return row